@@ -0,0 +1,44 @@
+import os
+import sys
+
+# Vercel環境でutilsディレクトリをパスに追加
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from utils.app_core import ApiHandler, ApiResponse, Endpoint
+from utils.job_queue import get_job_queue
+
+
+def job_status_response(job_id):
+    """ジョブの状態を (HTTPステータス, レスポンス dict) で返す"""
+    if not job_id:
+        return 400, {"success": False, "error": "Missing job id"}
+
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return 404, {"success": False, "error": "Job not found"}
+
+    result = job["result"] or {}
+    return 200, {
+        "success": True,
+        "job_id": job["id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "notion_page_id": result.get("notion_page_id"),
+        "updated_existing": result.get("updated_existing"),
+        "error": job["error"],
+    }
+
+
+def handle_job_status_request(request):
+    """GET /api/job_status?id=<job_id>"""
+    status, data = job_status_response(request.query.get("id"))
+    return ApiResponse(status, data)
+
+
+ENDPOINT = Endpoint({"GET": handle_job_status_request})
+
+
+class handler(ApiHandler):
+    endpoint = ENDPOINT
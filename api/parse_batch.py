@@ -0,0 +1,266 @@
+import os
+import queue
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Vercel環境でutilsディレクトリをパスに追加
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from parse_daily_report import parse_pdf_bytes, report_data, save_within_deadline
+from utils.app_core import ApiHandler, ApiResponse, Endpoint, body_error_response, error_response, wants_stream
+from utils.buffer_reader import BufferReader
+from utils.deadline import NOTION_MIN_CALL_SECONDS, UNLIMITED, request_deadline
+from utils.idempotency import get_idempotency_store, request_fingerprint
+from utils.parse_pool import run_parsing
+from utils.request_body import MAX_UPLOAD_BYTES, read_multipart
+
+# 複数の日計表 PDF（ZIP または複数の file パート）をまとめて解析・保存する
+#
+# - PDF 解析はファイルごとに並列に実行する（ローカルサーバーでは parse_pool のプロセスプール）
+# - Notion への保存はプロセス共有の writer（BATCH_NOTION_WRITERS スレッド、デフォルト 1）が解析の終わった順に行う。
+#   同じ日付のファイルが重なってもページが重複せず、Notion のレート制限も超えない
+# - 結果はファイルごとに、保存が終わった順に返す（ストリーミングモードでは 1 行ずつ）
+# - 単体のアップロードと同じキーで重複を判定するため、直前にアップロードした PDF は保存し直さない
+# - 処理時間の上限（utils.deadline）までに保存が終わらないファイルは、残りを保存ジョブに回す
+
+# 1 回のリクエストで受け付けるファイル数
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", 31))
+
+# 並列に解析するファイル数
+BATCH_PARSE_WORKERS = int(os.environ.get("BATCH_PARSE_WORKERS", 4))
+
+# Notion に保存するスレッド数
+BATCH_NOTION_WRITERS = int(os.environ.get("BATCH_NOTION_WRITERS", 1))
+
+# ZIP を展開したときの合計サイズの上限（ZIP 爆弾対策）
+BATCH_MAX_EXTRACTED_BYTES = int(os.environ.get("BATCH_MAX_EXTRACTED_BYTES", MAX_UPLOAD_BYTES * 2))
+
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+
+
+class BatchError(ValueError):
+    """アップロードされたファイルを日計表 PDF の一覧にできない（400 / 413）"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def handle_batch_request(request):
+    """POST /api/parse_batch: 複数の日計表 PDF を解析して Notion に保存する"""
+    deadline = request_deadline()
+    try:
+        _, files = read_multipart(request.rfile, request.content_type, request.content_length, multiple=True)
+    except ValueError as e:
+        return body_error_response(e)
+
+    try:
+        pdfs = collect_pdfs(files.get("file", []))
+    except BatchError as e:
+        return error_response(e.status, str(e))
+
+    records = iter_batch_records(pdfs, deadline)
+    if wants_stream(request):
+        return ApiResponse(200, stream=records)
+
+    results = list(records)
+    summary = results.pop()
+    return ApiResponse(200, {
+        "success": summary["success"],
+        "files": [{k: v for k, v in record.items() if k != "type"} for record in results],
+        "pages": summary["pages"],
+        "failed": summary["failed"],
+        "deferred": summary["deferred"],
+    })
+
+
+def collect_pdfs(uploads):
+    """file パート（PDF または ZIP）を [(ファイル名, PDF のバイト列)] にする"""
+    pdfs = []
+    for upload in uploads:
+        if is_zip(upload):
+            pdfs.extend(extract_zip(upload.data))
+        else:
+            pdfs.append((upload.filename, upload.data))
+        if len(pdfs) > BATCH_MAX_FILES:
+            raise BatchError(f"Too many files (max {BATCH_MAX_FILES})", status=413)
+    if not pdfs:
+        raise BatchError("No PDF files uploaded")
+    return pdfs
+
+
+def is_zip(upload):
+    return upload.content_type in ZIP_CONTENT_TYPES or (upload.filename or "").lower().endswith(".zip")
+
+
+def extract_zip(data, max_bytes=BATCH_MAX_EXTRACTED_BYTES):
+    """ZIP 内の PDF を [(ファイル名, bytes)] で返す（フォルダ・PDF 以外・macOS のメタデータは無視）"""
+    try:
+        archive = zipfile.ZipFile(BufferReader(data))
+    except (zipfile.BadZipFile, ValueError) as e:
+        # ValueError: 終端レコードより短いデータ（BufferReader は負の位置へのシークを ValueError にする）
+        raise BatchError(f"Invalid ZIP file: {e}")
+
+    with archive:
+        entries = [
+            info for info in archive.infolist()
+            if not info.is_dir() and info.filename.lower().endswith(".pdf")
+            and not info.filename.startswith("__MACOSX/")
+        ]
+        if len(entries) > BATCH_MAX_FILES:
+            raise BatchError(f"Too many files (max {BATCH_MAX_FILES})", status=413)
+        if sum(info.file_size for info in entries) > max_bytes:
+            raise BatchError(f"Extracted files too large (max {max_bytes} bytes)", status=413)
+        # file_size は ZIP の申告値のため、読み込みも上限で打ち切る
+        entries.sort(key=lambda info: info.filename)
+        return [(info.filename, _read_entry(archive, info, max_bytes)) for info in entries]
+
+
+def _read_entry(archive, info, max_bytes):
+    with archive.open(info) as f:
+        data = f.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise BatchError(f"Extracted files too large (max {max_bytes} bytes)", status=413)
+    return data
+
+
+def iter_batch_records(pdfs, deadline=UNLIMITED):
+    """ファイルごとの結果を保存が終わった順に返し、最後に全体の結果を返す
+
+    {"type": "file", "filename", "success", "date", "data", "notion_page_id", "updated_existing", "replayed"}
+    {"type": "file", "filename", "success", "date", "data", "notion_page_id": null, "job_id", "job_status_url",
+     "deferred": true, "replayed"}（deadline までに保存が終わらず、残りをジョブに回した）
+    {"type": "file", "filename", "success": false, "error"}
+    {"type": "result", "success", "files", "failed", "deferred", "pages": {日付: notion_page_id}, "timings"}
+    """
+    started = time.perf_counter()
+    results = queue.Queue()
+    writer = get_batch_writer()
+    store = get_idempotency_store()
+
+    def parse(filename, pdf_bytes):
+        try:
+            # 単体のアップロード（既存ページID なし・通常モード）と同じキー
+            key = fingerprint = request_fingerprint(pdf_bytes, None, "sync")
+            replay, flight = store.begin(key, fingerprint)
+            if replay is not None:
+                results.put(file_record(filename, replay[1], replayed=True))
+                return
+            try:
+                parsed = run_parsing(parse_pdf_bytes, pdf_bytes)
+            except Exception as e:
+                store.finish(key, flight, error=e)
+                raise
+            writer.submit(save, filename, pdf_bytes, parsed, key, flight)
+        except Exception as e:
+            results.put({"type": "file", "filename": filename, "success": False, "error": str(e)})
+
+    def save(filename, pdf_bytes, parsed, key, flight):
+        record = {"type": "file", "filename": filename, "success": False, "error": "Saving to Notion was interrupted"}
+        try:
+            try:
+                data, today_difference = report_data(parsed["summary"], parsed["patients"])
+                status, saved = save_within_deadline(
+                    deadline, pdf_bytes, parsed["summary"], parsed["patients"], today_difference)
+            except Exception as e:
+                store.finish(key, flight, error=e)
+                raise
+            # 単体のアップロードのレスポンスと同じ形で保存する（2xx 以外は保存されない）
+            result = {"success": True, "data": data, "patients": parsed["patients"], **saved}
+            store.finish(key, flight, (status, result))
+            if result["success"]:
+                record = file_record(filename, result, replayed=False)
+            else:
+                # 時間内に保存できなかった（同じ PDF の再アップロードで続きから保存する）
+                record = {"type": "file", "filename": filename, "success": False, "error": result["error"],
+                          "date": data["date"], "data": data}
+        except Exception as e:
+            record = {"type": "file", "filename": filename, "success": False, "error": str(e)}
+        finally:
+            # 結果は必ず 1 件送る（送らないと結果を待つ側が止まったままになる）
+            results.put(record)
+
+    parsers = ThreadPoolExecutor(max_workers=max(1, min(BATCH_PARSE_WORKERS, len(pdfs))),
+                                 thread_name_prefix="batch-parse")
+    try:
+        for filename, pdf_bytes in pdfs:
+            parsers.submit(parse, filename, pdf_bytes)
+
+        pages, failed, deferred = {}, 0, 0
+        pending = [filename for filename, _ in pdfs]
+        while pending:
+            try:
+                record = results.get(timeout=result_timeout(deadline))
+            except queue.Empty:
+                # 処理時間の上限を過ぎても結果が届かないファイルは失敗として返す
+                failed += len(pending)
+                for filename in pending:
+                    yield {"type": "file", "filename": filename, "success": False,
+                           "error": "No result before the request time budget ran out"}
+                break
+            pending.remove(record["filename"])
+            if not record["success"]:
+                failed += 1
+            elif record["notion_page_id"] is None:
+                deferred += 1
+            else:
+                pages[record["date"]] = record["notion_page_id"]
+            yield record
+    finally:
+        # クライアントが途中で切断した場合は、まだ始まっていない解析を取り消す（保存中のものは最後まで行う）
+        parsers.shutdown(wait=False, cancel_futures=True)
+
+    yield {
+        "type": "result",
+        "success": failed == 0,
+        "files": len(pdfs),
+        "failed": failed,
+        "deferred": deferred,
+        "pages": dict(sorted(pages.items())),
+        "timings": {"total": round((time.perf_counter() - started) * 1000, 1)},
+    }
+
+
+def result_timeout(deadline):
+    """ファイルの結果を待つ秒数（上限なしなら None）
+
+    保存は deadline までに打ち切られ、残りの処理（ジョブの登録など）は NOTION_MIN_CALL_SECONDS で足りる。
+    """
+    timeout = deadline.timeout()
+    return None if timeout is None else timeout + NOTION_MIN_CALL_SECONDS
+
+
+def file_record(filename, result, replayed):
+    return {
+        "type": "file",
+        "filename": filename,
+        "success": True,
+        "date": result["data"]["date"],
+        **{k: v for k, v in result.items() if k not in ("success", "patients")},
+        "replayed": replayed,
+    }
+
+
+_default_writer = None
+_default_lock = threading.Lock()
+
+
+def get_batch_writer():
+    """プロセス共有の Notion 保存用スレッドプールを返す"""
+    global _default_writer
+    with _default_lock:
+        if _default_writer is None:
+            _default_writer = ThreadPoolExecutor(max_workers=BATCH_NOTION_WRITERS, thread_name_prefix="notion-writer")
+        return _default_writer
+
+
+ENDPOINT = Endpoint({"POST": handle_batch_request})
+
+
+class handler(ApiHandler):
+    endpoint = ENDPOINT
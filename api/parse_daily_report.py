@@ -1,12 +1,9 @@
-from http.server import BaseHTTPRequestHandler
 import pdfplumber
-import json
-import io
 import re
 import os
 import sys
+import time
 from datetime import datetime
-from notion_client import Client
 
 # Vercel環境でutilsディレクトリをパスに追加
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -21,277 +18,500 @@ except ImportError:
     # Vercel環境では不要（環境変数は自動的に設定される）
     pass
 
-from utils.notion_uploader import upload_file_to_notion
+from notion_client.errors import APIErrorCode, APIResponseError
 
-try:
-    from multipart import parse_form_data
-    HAS_MULTIPART = True
-except ImportError:
-    # フォールバック: 古いcgiモジュール（Python 3.12以前）
-    try:
-        import cgi
-        HAS_CGI = True
-        HAS_MULTIPART = False
-    except ImportError:
-        HAS_CGI = False
-        HAS_MULTIPART = False
-
-notion = Client(auth=os.environ["NOTION_TOKEN"], notion_version="2025-09-03")
+from utils.notion_uploader import upload_file_to_notion
+from utils.notion_rate_limit import RateLimitedClient
+from utils.append_planner import plan_append_batches, append_batches, block_payload_size, MAX_CHILDREN_PER_REQUEST
+from utils.job_queue import get_job_queue
+from utils.checkpoint import get_checkpoint_store, content_hash, reusable_file_upload_id
+from utils.deadline import NOTION_MIN_CALL_SECONDS, UNLIMITED, DeadlineExceeded, deadline_scope, request_deadline
+from utils.request_body import read_multipart
+from utils.app_core import ApiHandler, ApiResponse, Endpoint, body_error_response, error_response, wants_stream
+from utils.buffer_reader import BufferReader
+from utils.parse_pool import run_parsing
+from utils.metrics import get_metrics_registry
+from utils.idempotency import (
+    IdempotencyConflict, IdempotencyInProgress, get_idempotency_store, idempotency_key, request_fingerprint,
+)
+from utils.page_index import get_page_index
+from utils.verification_history import get_verification_history
+from utils.notion_blocks import RowTemplate, heading, iter_child_blocks, table, table_row, text
+from utils.patient_file import PATIENT_FILE_FORMATS, dump_patients, patients_filename, patients_to_columns
+from utils.warmup import import_api_modules, warm_pdfminer, warm_up
+
+notion = RateLimitedClient(auth=os.environ["NOTION_TOKEN"], notion_version="2025-09-03")
 DATABASE_ID = os.environ["NOTION_DATABASE_ID"]
 DATA_SOURCE_ID = os.environ.get("NOTION_DATA_SOURCE_ID", DATABASE_ID)  # フォールバック
 
+# ジョブモード（Notion 保存をバックグラウンドで実行）のジョブ種別
+SAVE_JOB_KIND = "save_daily_report"
 
-class handler(BaseHTTPRequestHandler):
+# 保存ジョブ（ジョブモード・処理時間の上限までに終わらなかった保存の残り）を使うか
+#   Vercel ではジョブキュー（/tmp）とワーカーが関数のインスタンスごとに分かれ、レスポンス後はワーカーも止まる。
+#   /api/job_status も別の関数でジョブが見えないため、関数の間で共有するジョブキューとワーカーがある場合だけ 1 にする。
+#   0 の場合、ジョブモードの指定は無視して通常どおり保存し、時間内に終わらなかった保存は解析結果を 504 で返して
+#   同じ PDF の再アップロードでチェックポイントから続きを保存する
+def save_jobs_configured(environ=os.environ):
+    """DEFER_SAVES_TO_JOBS の値（未設定なら Vercel では無効、それ以外では有効）"""
+    return environ.get("DEFER_SAVES_TO_JOBS", "0" if environ.get("VERCEL") else "1") not in ("", "0")
 
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self._set_cors_headers()
-        self.end_headers()
 
-    def do_POST(self):
-        try:
-            # --- multipart からファイル取得 ---
-            content_type = self.headers.get("Content-Type", "")
-            content_length = int(self.headers.get("Content-Length", 0))
-            body = self.rfile.read(content_length)
-
-            existing_page_id = None
-
-            if HAS_MULTIPART:
-                # python-multipart を使用（Python 3.13+）
-                environ = {
-                    "REQUEST_METHOD": "POST",
-                    "CONTENT_TYPE": content_type,
-                    "CONTENT_LENGTH": str(content_length),
-                }
-                fields, files = parse_form_data(environ, io.BytesIO(body))
+DEFER_SAVES_TO_JOBS = save_jobs_configured()
 
-                if "file" not in files:
-                    self._send_json(400, {"success": False, "error": "No file uploaded"})
-                    return
+# ページのレイアウト
+#   standard: 患者表は10行ずつ、詳細データは患者ごとに2列の表
+#   compact:  患者表は Notion の上限まで1つの表に入れ、詳細データは1つの横長の表にまとめる
+PAGE_LAYOUT = os.environ.get("NOTION_PAGE_LAYOUT", "standard")
 
-                file_item = files["file"]
-                pdf_bytes = file_item.raw
+# 個別患者データの保存方法
+#   blocks:     ページ内のテーブルブロック
+#   csv / json: 患者データをファイルにして添付し、ページ本文は集計データのみ
+PATIENT_STORAGE = os.environ.get("NOTION_PATIENT_STORAGE", "blocks")
 
-                # 既存ページIDの取得（再アップロード時）
-                if "existing_page_id" in fields:
-                    existing_page_id = fields["existing_page_id"].value
+# レスポンスの患者データの形式（フォームの patients_format で選ぶ）
+PATIENTS_RESPONSE_FORMATS = ("rows", "columnar")
 
-            elif HAS_CGI:
-                # 古いcgiモジュールを使用（Python 3.12以前）
-                environ = {
-                    "REQUEST_METHOD": "POST",
-                    "CONTENT_TYPE": content_type,
-                    "CONTENT_LENGTH": str(content_length),
-                }
-                fs = cgi.FieldStorage(
-                    fp=io.BytesIO(body),
-                    environ=environ,
-                    keep_blank_values=True,
-                )
-
-                file_item = fs["file"]
-                if file_item.file is None:
-                    self._send_json(400, {"success": False, "error": "No file uploaded"})
-                    return
-
-                pdf_bytes = file_item.file.read()
-
-                # 既存ページIDの取得（再アップロード時）
-                if "existing_page_id" in fs:
-                    existing_page_id = fs["existing_page_id"].value
-
-            else:
-                self._send_json(500, {
-                    "success": False,
-                    "error": "No multipart parser available. Install python-multipart: pip install python-multipart"
-                })
-                return
-
-            # 1. PDF 解析
-            parsed_data = parse_pdf(io.BytesIO(pdf_bytes))
-
-            # 2. 当日差額を計算（全体 + 保険種別ごと）
-            today_difference = sum(patient.get("sagaku", 0) for patient in parsed_data["patients"])
-            type_differences = calc_type_differences(parsed_data["patients"])
-
-            # 3. Notion に保存 or 既存ページを更新
-            updated_existing = False
-            if existing_page_id:
-                # 再アップロード: 既存ページを更新
-                print(f"[DEBUG] Re-upload detected. Updating existing page: {existing_page_id}")
-                notion_page_id = update_notion_page(
-                    existing_page_id,
-                    pdf_bytes,
-                    parsed_data["summary"],
-                    parsed_data["patients"],
-                    today_difference
-                )
-                updated_existing = True
-            else:
-                # 初回アップロード: 新規ページ作成
-                notion_page_id = save_to_notion(
-                    pdf_bytes,
-                    parsed_data["summary"],
-                    parsed_data["patients"],
-                    today_difference
-                )
-
-            # 4. レスポンス（個別データと集計データの両方を返す）
-            result = {
-                "success": True,
-                "data": {
-                    **parsed_data["summary"],
-                    "previous_difference": parsed_data["summary"].get("zenkai_sagaku", 0),
-                    "today_difference": today_difference,
-                    "shaho_difference": type_differences["shaho"],
-                    "kokuho_difference": type_differences["kokuho"],
-                    "kouki_difference": type_differences["kouki"],
-                },
-                "patients": parsed_data["patients"],
-                "notion_page_id": notion_page_id,
-                "updated_existing": updated_existing,
-            }
-            self._send_json(200, result)
 
+def handle_parse_request(request):
+    """POST /api/parse_daily_report: PDF を解析して Notion に保存する"""
+    # 処理時間の上限（Vercel のタイムアウト）はボディの受信から数える
+    deadline = request_deadline()
+
+    # --- multipart からファイル取得 ---
+    # ボディは少しずつ読みながらパースし、大きな PDF は一時ファイルに書き出す。
+    # PDF はそのバッファ（または mmap）への参照のまま pdfplumber とアップローダーに渡す
+    try:
+        fields, files = read_multipart(request.rfile, request.content_type, request.content_length)
+    except ValueError as e:
+        return body_error_response(e)
+
+    if "file" not in files:
+        return error_response(400, "No file uploaded")
+
+    pdf_bytes = files["file"].data
+
+    # 既存ページIDの取得（再アップロード時）
+    existing_page_id = fields.get("existing_page_id") or None
+    mode = fields.get("mode")
+    patients_format = fields.get("patients_format") or "rows"
+    if patients_format not in PATIENTS_RESPONSE_FORMATS:
+        return error_response(400, f"Unknown patients_format: {patients_format}")
+    job_mode = wants_job_mode(request.headers, mode)
+
+    # 同じ内容のリクエスト（ダブルクリック・再送）は 1 回だけ処理し、結果を共有する
+    fingerprint = request_fingerprint(pdf_bytes, existing_page_id, "job" if job_mode else "sync")
+    try:
+        key = idempotency_key(request.headers, fingerprint)
+    except ValueError as e:
+        return error_response(400, str(e))
+
+    # ストリーミングモード: 解析の途中経過から NDJSON で返す
+    if wants_stream(request):
+        # 内容の違うリクエストはストリームを始める前に 422 で返す
+        try:
+            get_idempotency_store().get(key, fingerprint)
+        except IdempotencyConflict as e:
+            return error_response(e.status, str(e))
+        return ApiResponse(200, stream=stream_parse_records(
+            pdf_bytes, existing_page_id, job_mode, (key, fingerprint), deadline))
+
+    try:
+        status, result, replayed = get_idempotency_store().run(
+            key, fingerprint, lambda: process_report(pdf_bytes, existing_page_id, job_mode, deadline))
+    except (IdempotencyConflict, IdempotencyInProgress) as e:
+        return error_response(e.status, str(e))
+
+    # レスポンス（個別データと集計データの両方を返す）
+    return ApiResponse(
+        status,
+        {**result, **patients_response(result["patients"], patients_format)},
+        {"Idempotent-Replayed": "true"} if replayed else None,
+    )
+
+
+def process_report(pdf_bytes, existing_page_id, job_mode, deadline=UNLIMITED):
+    """PDF を解析して Notion に保存し、(status, レスポンス) を返す（患者データは rows 形式）"""
+    # 1. PDF 解析（ローカルサーバーではプロセスプールで実行）
+    parsed_data = run_parsing(parse_pdf_bytes, pdf_bytes)
+
+    # 2. 当日差額を計算（全体 + 保険種別ごと）
+    data, today_difference = report_data(parsed_data["summary"], parsed_data["patients"])
+
+    # 3a. ジョブモード: 解析結果をすぐに返し、Notion 保存はバックグラウンドで実行
+    if job_mode:
+        job_id = enqueue_save_job(
+            pdf_bytes,
+            parsed_data["summary"],
+            parsed_data["patients"],
+            today_difference,
+            existing_page_id,
+        )
+        status, result = 202, save_job_result(job_id)
+
+    # 3. Notion に保存 or 既存ページを更新
+    #    ページIDが送られてこなくても、同じ日付のページがあれば更新する
+    #    時間内に終わらなければ残りはジョブに回す
+    else:
+        status, result = save_within_deadline(
+            deadline,
+            pdf_bytes,
+            parsed_data["summary"],
+            parsed_data["patients"],
+            today_difference,
+            existing_page_id,
+        )
+    return status, {
+        "success": True,
+        "data": data,
+        "patients": parsed_data["patients"],
+        **result,
+    }
+
+
+def save_within_deadline(deadline, pdf_bytes, summary, patients, today_difference, existing_page_id=None):
+    """deadline までに Notion へ保存し、(status, レスポンスの保存結果) を返す
+
+    残り時間が足りなくなったら（レート制限の待ち・遅い応答・リトライを含む）保存を打ち切り、
+    残りを保存ジョブに回して 202 を返す。途中まで保存したページはチェックポイントに記録されて
+    いるため、ジョブはアップロード済みのファイルや追加済みのブロックを飛ばして続きから再開する。
+    DEFER_SAVES_TO_JOBS が無効なら 504（"success": false）を返す。2xx ではないため重複アップロードの
+    結果としては保存されず、同じ PDF の再アップロードが同じチェックポイントから続きを保存する。
+    """
+    try:
+        deadline.check(NOTION_MIN_CALL_SECONDS, "saving to Notion")
+        with deadline_scope(deadline):
+            notion_page_id, updated_existing = upsert_daily_report(
+                pdf_bytes, summary, patients, today_difference, existing_page_id)
+    except DeadlineExceeded as e:
+        if not DEFER_SAVES_TO_JOBS:
+            print(f"[WARNING] {e}. The Notion save resumes on the next upload of the same PDF")
+            get_metrics_registry().inc("notion_saves_deferred_total", to="reupload")
+            return 504, {
+                "success": False,
+                "notion_page_id": None,
+                "error": f"Saving to Notion did not finish in time ({e}). Upload the same PDF again to resume.",
+                "resumable": True,
+            }
+        print(f"[WARNING] {e}. Deferring the rest of the Notion save to a job")
+        job_id = enqueue_save_job(pdf_bytes, summary, patients, today_difference, existing_page_id)
+        get_metrics_registry().inc("notion_saves_deferred_total", to="job")
+        return 202, {**save_job_result(job_id), "deferred": True}
+    return 200, {"notion_page_id": notion_page_id, "updated_existing": updated_existing}
+
+
+def save_job_result(job_id):
+    """保存をジョブに回したときのレスポンスの保存結果"""
+    return {"notion_page_id": None, "job_id": job_id, "job_status_url": f"/api/job_status?id={job_id}"}
+
+
+def report_data(summary, patients):
+    """レスポンスの data（集計データ + 当日差額）と当日差額を返す"""
+    today_difference = sum(patient.get("sagaku", 0) for patient in patients)
+    type_differences = calc_type_differences(patients)
+
+    data = {
+        **summary,
+        "previous_difference": summary.get("zenkai_sagaku", 0),
+        "today_difference": today_difference,
+        "shaho_difference": type_differences["shaho"],
+        "kokuho_difference": type_differences["kokuho"],
+        "kouki_difference": type_differences["kouki"],
+    }
+    return data, today_difference
+
+
+def stream_parse_records(pdf_bytes, existing_page_id, job_mode, idempotency=None, deadline=UNLIMITED):
+    """ストリーミングモードで返すレコード（NDJSON の 1 行ずつ）
+
+    {"type": "summary"}  集計データ（表の抽出より先に分かる）
+    {"type": "patients"} ページごとの患者データ
+    {"type": "data"}     当日差額を含む集計データ（レスポンスの data と同じ）
+    {"type": "result"}   notion_page_id（ジョブモード・保存が時間内に終わらない場合は job_id）と所要時間（ミリ秒）
+    {"type": "error"}    途中で失敗した場合（ステータスは送信済みのため行で知らせる）
+
+    途中経過を返すため、解析はプロセスプールではなくこのスレッドで行う。
+    idempotency に (key, fingerprint) を渡すと、同じキーのリクエストが処理中・完了済みなら
+    その結果を同じ形のレコードで返す（result に "replayed": true）。
+    """
+    store = get_idempotency_store()
+    flight = None
+    if idempotency is not None:
+        try:
+            replay, flight = store.begin(*idempotency)
         except Exception as e:
-            self._send_json(500, {"success": False, "error": str(e)})
+            yield {"type": "error", "success": False, "error": str(e)}
+            return
+        if replay is not None:
+            yield from replay_records(*replay)
+            return
+
+    timings = {}
+    started = time.perf_counter()
+    try:
+        summary = None
+        patients = []
+        for kind, value in iter_parse_pdf(BufferReader(pdf_bytes)):
+            if kind == "summary":
+                summary = value
+                timings["summary"] = time.perf_counter() - started
+                yield {"type": "summary", "data": {**summary, "previous_difference": summary.get("zenkai_sagaku", 0)}}
+            elif value:
+                patients.extend(value)
+                yield {"type": "patients", "patients": value}
+        timings["parse"] = time.perf_counter() - started
+
+        data, today_difference = report_data(summary, patients)
+        yield {"type": "data", "data": data}
+
+        if job_mode:
+            job_id = enqueue_save_job(pdf_bytes, summary, patients, today_difference, existing_page_id)
+            status, result = 202, save_job_result(job_id)
+        else:
+            notion_started = time.perf_counter()
+            status, result = save_within_deadline(
+                deadline, pdf_bytes, summary, patients, today_difference, existing_page_id)
+            timings["notion"] = time.perf_counter() - notion_started
+
+        if flight is not None:
+            # 非ストリーミングのレスポンスと同じ形で保存する
+            store.finish(idempotency[0], flight,
+                         (status, {"success": True, "data": data, "patients": patients, **result}))
+            flight = None
+
+        timings["total"] = time.perf_counter() - started
+        yield {
+            "type": "result",
+            "success": True,
+            **result,
+            "timings": {name: round(seconds * 1000, 1) for name, seconds in timings.items()},
+        }
+    except Exception as e:
+        if flight is not None:
+            store.finish(idempotency[0], flight, error=e)
+            flight = None
+        yield {"type": "error", "success": False, "error": str(e)}
+    finally:
+        # クライアントが途中で切断した場合も、待っているリクエストを解放する
+        if flight is not None:
+            store.finish(idempotency[0], flight, error=RuntimeError("The original request was cancelled"))
+
+
+def replay_records(status, result):
+    """保存済みのレスポンスをストリーミングモードのレコードにする"""
+    yield {"type": "summary", "data": result["data"]}
+    if result["patients"]:
+        yield {"type": "patients", "patients": result["patients"]}
+    yield {"type": "data", "data": result["data"]}
+    yield {
+        "type": "result",
+        **{k: v for k, v in result.items() if k not in ("data", "patients")},
+        "replayed": True,
+        "timings": {},
+    }
+
+
+def patients_response(patients, patients_format):
+    """レスポンスの患者データ部分
+
+    rows: 患者ごとの dict の配列（従来の形式）
+    columnar: フィールドごとの配列 {field: [...]}。キー名が患者数ぶん繰り返されないため小さい
+    """
+    if patients_format == "columnar":
+        return {"patients": patients_to_columns(patients), "patients_format": "columnar"}
+    return {"patients": patients}
+
 
-    # --- helpers ---
-    def _set_cors_headers(self):
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "POST, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+def handle_warmup_request(request):
+    """GET /api/warmup: 新しいインスタンスで最初に読み込まれるものを先に読み込む（定期実行用）
 
-    def _send_json(self, status, data):
-        self.send_response(status)
-        self._set_cors_headers()
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        self.wfile.write(json.dumps(data, ensure_ascii=False).encode())
+    ?notion=0 で Notion への接続（日付 → ページIDの索引の読み込み）を省く。
+    """
+    result = warm_up_process(notion=request.query.get("notion") not in ("0", "false"))
+    return ApiResponse(200, {"success": not result["errors"], **result})
+
+
+def warm_up_process(notion=True):
+    """このプロセスの初回だけ、PDF 解析・API モジュール・Notion の索引を準備する"""
+    steps = [("pdfminer", warm_pdfminer), ("modules", import_api_modules)]
+    if notion:
+        steps.append(("notion", warm_notion))
+    return warm_up(steps)
+
+
+def warm_notion():
+    """Notion への接続を張り、日付 → ページIDの索引を読み込む（古ければ Notion から作り直す）"""
+    get_page_index(query_report_pages).lookup(datetime.now().strftime("%Y-%m-%d"))
+
+
+ENDPOINT = Endpoint({"POST": handle_parse_request, "GET": handle_warmup_request}, allow_headers="Content-Type, Prefer, Idempotency-Key",
+                    expose_headers="Idempotent-Replayed")
+
+
+class handler(ApiHandler):
+    endpoint = ENDPOINT
 
 
 # ====================
 # PDF 解析
 # ====================
+def parse_pdf_bytes(pdf_bytes):
+    """PDF のバイト列（bytes / memoryview）を解析する（プロセスプールから呼べるモジュール関数）"""
+    return parse_pdf(BufferReader(pdf_bytes))
+
+
 def parse_pdf(pdf_file):
     """PDF から日付、個別患者データ、集計データを抽出"""
-    with pdfplumber.open(pdf_file) as pdf:
-        # --- 日付 ---
-        first_text = pdf.pages[0].extract_text() or ""
-        date_match = re.search(r"令和\s*(\d+)\s*年\s*(\d+)\s*月\s*(\d+)\s*日", first_text)
-        if date_match:
-            year = int(date_match.group(1)) + 2018
-            month = int(date_match.group(2))
-            day = int(date_match.group(3))
-            date_str = f"{year}-{month:02d}-{day:02d}"
+    summary = None
+    patients = []
+    for kind, value in iter_parse_pdf(pdf_file):
+        if kind == "summary":
+            summary = value
         else:
-            date_str = datetime.now().strftime("%Y-%m-%d")
+            patients.extend(value)
+    return {
+        "summary": summary,
+        "patients": patients,
+    }
 
-        # --- 個別患者データ抽出 ---
-        patients = []
-        for page in pdf.pages:
-            tables = page.extract_tables()
-            if not tables:
-                continue
 
-            for table in tables:
-                if not table or len(table) < 2:
-                    continue
+def iter_parse_pdf(pdf_file):
+    """parse_pdf の結果を段階ごとに返すジェネレータ
 
-                # ヘッダー行をスキップ（1行目）
-                for row in table[1:]:
-                    if not row or len(row) < 2:
-                        continue
+    最初に ("summary", 集計データ)、続いてページごとに ("patients", そのページの患者データ) を返す。
+    集計データはテキストだけで決まるため、時間のかかる表の抽出より先に返せる。
+    """
+    metrics = get_metrics_registry()
+    with metrics.timer("parse_stage_seconds", stage="open"):
+        pdf = pdfplumber.open(pdf_file)
+    with pdf:
+        # 詳細な合計行は最終ページではなく途中のページにある可能性があるため、
+        # 全ページのテキストを結合して検索する
+        with metrics.timer("parse_stage_seconds", stage="text"):
+            page_texts = [page.extract_text() or "" for page in pdf.pages]
+        with metrics.timer("parse_stage_seconds", stage="summary"):
+            summary = parse_summary(page_texts)
+        yield "summary", summary
 
-                    # 空行や集計行をスキップ
-                    first_col = (row[0] or "").strip()
-                    if not first_col or first_col in ["合計", "訪問（再掲）", "社保", "国保", "後期", "保険なし", "10%対象", "8%対象", "物販合計"]:
-                        continue
+        # --- 個別患者データ抽出 ---
+        for page in pdf.pages:
+            with metrics.timer("parse_stage_seconds", stage="tables"):
+                page_patients = parse_page_patients(page)
+            yield "patients", page_patients
 
-                    # 番号が数字でない場合はスキップ
-                    if not first_col.isdigit():
-                        continue
 
-                    # 患者データをパース
-                    patient = parse_patient_row(row)
-                    if patient:
-                        patients.append(patient)
+def parse_page_patients(page):
+    """1 ページの表から患者データを抽出"""
+    patients = []
+    tables = page.extract_tables()
+    if not tables:
+        return patients
 
-        # --- 集計データ（全ページから検索） ---
-        # 詳細な合計行は最終ページではなく途中のページにある可能性があるため、
-        # 全ページのテキストを結合して検索する
-        all_text = ""
-        for page in pdf.pages:
-            all_text += (page.extract_text() or "") + "\n"
-
-        summary = {
-            "date": date_str,
-            "shaho_count": 0,
-            "shaho_amount": 0,
-            "kokuho_count": 0,
-            "kokuho_amount": 0,
-            "kouki_count": 0,
-            "kouki_amount": 0,
-            "jihi_count": 0,
-            "jihi_amount": 0,
-            "hoken_nashi_count": 0,
-            "hoken_nashi_amount": 0,
-            "total_count": 0,
-            "total_points": 0,
-            "total_amount": 0,
-            "bushan_amount": 0,
-            "kaigo_amount": 0,
-            "zenkai_sagaku": 0,
-        }
+    for table in tables:
+        if not table or len(table) < 2:
+            continue
 
-        patterns = {
-            "shaho": r"社保\s+(\d+)\s+[\d,]+\s+([\d,]+)",
-            "kokuho": r"国保\s+(\d+)\s+[\d,]+\s+([\d,]+)",
-            "kouki": r"後期\s+(\d+)\s+[\d,]+\s+([\d,]+)",
-            "hoken_nashi": r"保険なし\s+(\d+)\s+[\d,]+\s+([\d,]+)",
-        }
-        for key, pattern in patterns.items():
-            matches = re.findall(pattern, all_text)
-            if matches:
-                last_match = matches[-1]
-                summary[f"{key}_count"] = int(last_match[0])
-                summary[f"{key}_amount"] = int(last_match[1].replace(",", ""))
-
-        # 合計（人数 / 点数 / 負担額）— 患者明細の合計行
-        total_m = re.search(r"合計\s+(\d+)\s+([\d,]+)\s+([\d,]+)", all_text)
-        if total_m:
-            summary["total_count"] = int(total_m.group(1))
-            summary["total_points"] = int(total_m.group(2).replace(",", ""))
-            summary["total_amount"] = int(total_m.group(3).replace(",", ""))
-
-        # 自費・前回差額（全体合計行から位置ベースで抽出）
-        goukei_full_m = re.search(
-            r"合計\s+(\d+)\s+([\d,]+)\s+([\d,]+)\s+(\d+)\s+(\d+)\s+([\d,]+)\s+([\d,]+)\s+(-?[\d,]+)\s+([\d,]+)\s+(-?\d+)",
-            all_text,
-        )
-        if goukei_full_m:
-            summary["jihi_amount"] = int(goukei_full_m.group(6).replace(",", ""))
-            summary["zenkai_sagaku"] = int(goukei_full_m.group(8).replace(",", ""))
-        else:
-            jihi_m = re.search(r"自費\s+([\d,]+)", all_text)
-            if jihi_m:
-                summary["jihi_amount"] = int(jihi_m.group(1).replace(",", ""))
+        # ヘッダー行をスキップ（1行目）
+        for row in table[1:]:
+            if not row or len(row) < 2:
+                continue
 
-        # 物販
-        bushan_m = re.search(r"物販合計\s+([\d,]+)", all_text)
-        if bushan_m:
-            summary["bushan_amount"] = int(bushan_m.group(1).replace(",", ""))
+            # 空行や集計行をスキップ
+            first_col = (row[0] or "").strip()
+            if not first_col or first_col in ["合計", "訪問（再掲）", "社保", "国保", "後期", "保険なし", "10%対象", "8%対象", "物販合計"]:
+                continue
 
-        # 介護
-        kaigo_m = re.search(r"介護.*?([\d,]+)", all_text)
-        if kaigo_m:
-            summary["kaigo_amount"] = int(kaigo_m.group(1).replace(",", ""))
+            # 番号が数字でない場合はスキップ
+            if not first_col.isdigit():
+                continue
 
-        return {
-            "summary": summary,
-            "patients": patients,
-        }
+            # 患者データをパース
+            patient = parse_patient_row(row)
+            if patient:
+                patients.append(patient)
+    return patients
+
+
+def parse_summary(page_texts):
+    """ページごとのテキストから日付と集計データを抽出"""
+    # --- 日付 ---
+    first_text = page_texts[0] if page_texts else ""
+    date_match = re.search(r"令和\s*(\d+)\s*年\s*(\d+)\s*月\s*(\d+)\s*日", first_text)
+    if date_match:
+        year = int(date_match.group(1)) + 2018
+        month = int(date_match.group(2))
+        day = int(date_match.group(3))
+        date_str = f"{year}-{month:02d}-{day:02d}"
+    else:
+        date_str = datetime.now().strftime("%Y-%m-%d")
+
+    # --- 集計データ（全ページから検索） ---
+    all_text = "".join(text + "\n" for text in page_texts)
+
+    summary = {
+        "date": date_str,
+        "shaho_count": 0,
+        "shaho_amount": 0,
+        "kokuho_count": 0,
+        "kokuho_amount": 0,
+        "kouki_count": 0,
+        "kouki_amount": 0,
+        "jihi_count": 0,
+        "jihi_amount": 0,
+        "hoken_nashi_count": 0,
+        "hoken_nashi_amount": 0,
+        "total_count": 0,
+        "total_points": 0,
+        "total_amount": 0,
+        "bushan_amount": 0,
+        "kaigo_amount": 0,
+        "zenkai_sagaku": 0,
+    }
+
+    patterns = {
+        "shaho": r"社保\s+(\d+)\s+[\d,]+\s+([\d,]+)",
+        "kokuho": r"国保\s+(\d+)\s+[\d,]+\s+([\d,]+)",
+        "kouki": r"後期\s+(\d+)\s+[\d,]+\s+([\d,]+)",
+        "hoken_nashi": r"保険なし\s+(\d+)\s+[\d,]+\s+([\d,]+)",
+    }
+    for key, pattern in patterns.items():
+        matches = re.findall(pattern, all_text)
+        if matches:
+            last_match = matches[-1]
+            summary[f"{key}_count"] = int(last_match[0])
+            summary[f"{key}_amount"] = int(last_match[1].replace(",", ""))
+
+    # 合計（人数 / 点数 / 負担額）— 患者明細の合計行
+    total_m = re.search(r"合計\s+(\d+)\s+([\d,]+)\s+([\d,]+)", all_text)
+    if total_m:
+        summary["total_count"] = int(total_m.group(1))
+        summary["total_points"] = int(total_m.group(2).replace(",", ""))
+        summary["total_amount"] = int(total_m.group(3).replace(",", ""))
+
+    # 自費・前回差額（全体合計行から位置ベースで抽出）
+    goukei_full_m = re.search(
+        r"合計\s+(\d+)\s+([\d,]+)\s+([\d,]+)\s+(\d+)\s+(\d+)\s+([\d,]+)\s+([\d,]+)\s+(-?[\d,]+)\s+([\d,]+)\s+(-?\d+)",
+        all_text,
+    )
+    if goukei_full_m:
+        summary["jihi_amount"] = int(goukei_full_m.group(6).replace(",", ""))
+        summary["zenkai_sagaku"] = int(goukei_full_m.group(8).replace(",", ""))
+    else:
+        jihi_m = re.search(r"自費\s+([\d,]+)", all_text)
+        if jihi_m:
+            summary["jihi_amount"] = int(jihi_m.group(1).replace(",", ""))
+
+    # 物販
+    bushan_m = re.search(r"物販合計\s+([\d,]+)", all_text)
+    if bushan_m:
+        summary["bushan_amount"] = int(bushan_m.group(1).replace(",", ""))
+
+    # 介護
+    kaigo_m = re.search(r"介護.*?([\d,]+)", all_text)
+    if kaigo_m:
+        summary["kaigo_amount"] = int(kaigo_m.group(1).replace(",", ""))
+
+    return summary
 
 
 def parse_patient_row(row):
@@ -434,171 +654,118 @@ def calc_type_differences(patients):
 # ====================
 # Notion ブロック生成
 # ====================
-def build_page_blocks(summary, patients, today_difference, file_upload_id):
-    """Notionページのコンテンツブロックを生成"""
+# 毎回同じになるブロックはテンプレートとして一度だけ生成して共有する
+_SUMMARY_HEADING = heading(1, "📊 集計データ")
+_INSURANCE_HEADING = heading(2, "保険種別内訳")
+_INSURANCE_HEADER_ROW = table_row(["保険種別", "人数", "金額"])
+_INSURANCE_ROWS = [
+    (RowTemplate([label, None, None]), key)
+    for label, key in [
+        ("社保", "shaho"),
+        ("国保", "kokuho"),
+        ("後期", "kouki"),
+        ("自費", "jihi"),
+        ("保険なし", "hoken_nashi"),
+    ]
+]
+_PATIENT_HEADER_ROW = table_row(["No", "患者ID", "氏名", "保険種別", "点数", "負担額", "領収額"])
+_PATIENT_ROW = RowTemplate([None] * 7)
+_DETAIL_HEADING = heading(2, "💰 詳細データ（差額・自費・物販・介護あり）")
+_DETAIL_TITLE_ROW = RowTemplate([None, None])
+_DETAIL_COLUMNS = [
+    ("介護単位", "kaigo_units", False),
+    ("介護負担", "kaigo_burden", True),
+    ("自費", "jihi", True),
+    ("物販", "bushan", True),
+    ("前回差額", "zenkai_sagaku", True),
+    ("差額", "sagaku", True),
+]
+_DETAIL_ROWS = [(RowTemplate([label, None]), key, is_yen) for label, key, is_yen in _DETAIL_COLUMNS]
+_PDF_HEADING = heading(1, "📄 元の日計表PDF")
+_PDF_CAPTION = [text("元の日計表")]
+_PATIENTS_FILE_CAPTION = [text("個別患者データ（utils.patient_file.load_patients で読み込めます）")]
+
+# 患者データを10件ずつに分割（Notionのテーブル行数制限対策）
+PATIENT_TABLE_CHUNK_SIZE = 10
+# compact レイアウトでは 1 リクエストの children 上限（ヘッダー行を含めて100行）まで 1 つの表に入れる
+COMPACT_TABLE_CHUNK_SIZE = MAX_CHILDREN_PER_REQUEST - 1
+
+
+def format_detail_value(patient, key, is_yen):
+    return f"¥{patient[key]:,}" if is_yen else str(patient[key])
+
+
+def build_page_blocks(summary, patients, today_difference, file_upload_id, layout=None, patients_file=None):
+    """Notionページのコンテンツブロックを生成
+
+    layout: "standard" または "compact"（省略時は NOTION_PAGE_LAYOUT）
+    patients_file: 患者データを添付ファイルにした場合の (file_upload_id, filename)。
+                   指定するとテーブルの代わりにファイルブロックを置く
+    """
+    compact = (layout or PAGE_LAYOUT) == "compact"
+    chunk_size = COMPACT_TABLE_CHUNK_SIZE if compact else PATIENT_TABLE_CHUNK_SIZE
     blocks = []
 
     # 集計データサマリー
+    summary_lines = [
+        f"日付: {summary['date']}\n",
+        f"合計人数: {summary['total_count']}人\n",
+        f"合計金額: ¥{summary['total_amount']:,}\n",
+        f"前回差額: ¥{summary['zenkai_sagaku']:,}\n",
+        f"当日差額: ¥{today_difference:,}\n",
+        f"物販: ¥{summary['bushan_amount']:,}\n",
+        f"介護: ¥{summary['kaigo_amount']:,}",
+    ]
+    insurance_rows = [_INSURANCE_HEADER_ROW]
+    for template, key in _INSURANCE_ROWS:
+        insurance_rows.append(template.fill(f"{summary[key + '_count']}人", f"¥{summary[key + '_amount']:,}"))
+
     blocks.extend([
-        {
-            "object": "block",
-            "type": "heading_1",
-            "heading_1": {
-                "rich_text": [{"type": "text", "text": {"content": "📊 集計データ"}}]
-            },
-        },
+        _SUMMARY_HEADING,
         {
             "object": "block",
             "type": "paragraph",
-            "paragraph": {
-                "rich_text": [
-                    {"type": "text", "text": {"content": f"日付: {summary['date']}\n"}},
-                    {"type": "text", "text": {"content": f"合計人数: {summary['total_count']}人\n"}},
-                    {"type": "text", "text": {"content": f"合計金額: ¥{summary['total_amount']:,}\n"}},
-                    {"type": "text", "text": {"content": f"前回差額: ¥{summary['zenkai_sagaku']:,}\n"}},
-                    {"type": "text", "text": {"content": f"当日差額: ¥{today_difference:,}\n"}},
-                    {"type": "text", "text": {"content": f"物販: ¥{summary['bushan_amount']:,}\n"}},
-                    {"type": "text", "text": {"content": f"介護: ¥{summary['kaigo_amount']:,}"}},
-                ]
-            },
-        },
-        {
-            "object": "block",
-            "type": "heading_2",
-            "heading_2": {
-                "rich_text": [{"type": "text", "text": {"content": "保険種別内訳"}}]
-            },
-        },
-        {
-            "object": "block",
-            "type": "table",
-            "table": {
-                "table_width": 3,
-                "has_column_header": True,
-                "children": [
-                    {
-                        "type": "table_row",
-                        "table_row": {
-                            "cells": [
-                                [{"type": "text", "text": {"content": "保険種別"}}],
-                                [{"type": "text", "text": {"content": "人数"}}],
-                                [{"type": "text", "text": {"content": "金額"}}],
-                            ]
-                        },
-                    },
-                    {
-                        "type": "table_row",
-                        "table_row": {
-                            "cells": [
-                                [{"type": "text", "text": {"content": "社保"}}],
-                                [{"type": "text", "text": {"content": f"{summary['shaho_count']}人"}}],
-                                [{"type": "text", "text": {"content": f"¥{summary['shaho_amount']:,}"}}],
-                            ]
-                        },
-                    },
-                    {
-                        "type": "table_row",
-                        "table_row": {
-                            "cells": [
-                                [{"type": "text", "text": {"content": "国保"}}],
-                                [{"type": "text", "text": {"content": f"{summary['kokuho_count']}人"}}],
-                                [{"type": "text", "text": {"content": f"¥{summary['kokuho_amount']:,}"}}],
-                            ]
-                        },
-                    },
-                    {
-                        "type": "table_row",
-                        "table_row": {
-                            "cells": [
-                                [{"type": "text", "text": {"content": "後期"}}],
-                                [{"type": "text", "text": {"content": f"{summary['kouki_count']}人"}}],
-                                [{"type": "text", "text": {"content": f"¥{summary['kouki_amount']:,}"}}],
-                            ]
-                        },
-                    },
-                    {
-                        "type": "table_row",
-                        "table_row": {
-                            "cells": [
-                                [{"type": "text", "text": {"content": "自費"}}],
-                                [{"type": "text", "text": {"content": f"{summary['jihi_count']}人"}}],
-                                [{"type": "text", "text": {"content": f"¥{summary['jihi_amount']:,}"}}],
-                            ]
-                        },
-                    },
-                    {
-                        "type": "table_row",
-                        "table_row": {
-                            "cells": [
-                                [{"type": "text", "text": {"content": "保険なし"}}],
-                                [{"type": "text", "text": {"content": f"{summary['hoken_nashi_count']}人"}}],
-                                [{"type": "text", "text": {"content": f"¥{summary['hoken_nashi_amount']:,}"}}],
-                            ]
-                        },
-                    },
-                ]
-            },
+            "paragraph": {"rich_text": [text(line) for line in summary_lines]},
         },
+        _INSURANCE_HEADING,
+        table(3, insurance_rows),
     ])
 
     # 個別患者データテーブル
-    blocks.extend([
-        {
-            "object": "block",
-            "type": "heading_1",
-            "heading_1": {
-                "rich_text": [{"type": "text", "text": {"content": f"👥 個別患者データ ({len(patients)}件)"}}]
-            },
-        },
-    ])
+    blocks.append(heading(1, f"👥 個別患者データ ({len(patients)}件)"))
 
-    # 患者データを10件ずつに分割（Notionのテーブル行数制限対策）
-    chunk_size = 10
-    for i in range(0, len(patients), chunk_size):
-        patient_chunk = patients[i:i+chunk_size]
-
-        table_children = [
+    if patients_file:
+        patients_file_upload_id, patients_filename = patients_file
+        blocks.extend([
             {
-                "type": "table_row",
-                "table_row": {
-                    "cells": [
-                        [{"type": "text", "text": {"content": "No"}}],
-                        [{"type": "text", "text": {"content": "患者ID"}}],
-                        [{"type": "text", "text": {"content": "氏名"}}],
-                        [{"type": "text", "text": {"content": "保険種別"}}],
-                        [{"type": "text", "text": {"content": "点数"}}],
-                        [{"type": "text", "text": {"content": "負担額"}}],
-                        [{"type": "text", "text": {"content": "領収額"}}],
-                    ]
-                },
-            }
-        ]
-
-        for patient in patient_chunk:
-            table_children.append({
-                "type": "table_row",
-                "table_row": {
-                    "cells": [
-                        [{"type": "text", "text": {"content": str(patient["number"])}}],
-                        [{"type": "text", "text": {"content": patient["patient_id"]}}],
-                        [{"type": "text", "text": {"content": patient["name"]}}],
-                        [{"type": "text", "text": {"content": patient["insurance_type"]}}],
-                        [{"type": "text", "text": {"content": str(patient["points"])}}],
-                        [{"type": "text", "text": {"content": f"¥{patient['burden_amount']:,}"}}],
-                        [{"type": "text", "text": {"content": f"¥{patient['receipt_amount']:,}"}}],
-                    ]
+                "object": "block",
+                "type": "file",
+                "file": {
+                    "type": "file_upload",
+                    "file_upload": {"id": patients_file_upload_id},
+                    "name": patients_filename,
+                    "caption": _PATIENTS_FILE_CAPTION,
                 },
-            })
-
-        blocks.append({
-            "object": "block",
-            "type": "table",
-            "table": {
-                "table_width": 7,
-                "has_column_header": True,
-                "children": table_children,
             },
-        })
+            _PDF_HEADING,
+            build_pdf_block(file_upload_id),
+        ])
+        return blocks
+
+    fill_patient = _PATIENT_ROW.fill
+    for i in range(0, len(patients), chunk_size):
+        rows = [_PATIENT_HEADER_ROW]
+        for patient in patients[i:i + chunk_size]:
+            rows.append(fill_patient(
+                str(patient["number"]),
+                patient["patient_id"],
+                patient["name"],
+                patient["insurance_type"],
+                str(patient["points"]),
+                f"¥{patient['burden_amount']:,}",
+                f"¥{patient['receipt_amount']:,}",
+            ))
+        blocks.append(table(7, rows))
 
     # 詳細データ（差額や物販などがある患者のみ）
     patients_with_details = [
@@ -611,252 +778,398 @@ def build_page_blocks(summary, patients, today_difference, file_upload_id):
     ]
 
     if patients_with_details:
-        blocks.extend([
-            {
-                "object": "block",
-                "type": "heading_2",
-                "heading_2": {
-                    "rich_text": [{"type": "text", "text": {"content": "💰 詳細データ（差額・自費・物販・介護あり）"}}]
-                },
-            },
-        ])
+        blocks.append(_DETAIL_HEADING)
 
-        for patient in patients_with_details:
-            blocks.append({
-                "object": "block",
-                "type": "table",
-                "table": {
-                    "table_width": 2,
-                    "has_column_header": False,
-                    "children": [
-                        {
-                            "type": "table_row",
-                            "table_row": {
-                                "cells": [
-                                    [{"type": "text", "text": {"content": f"{patient['number']}. {patient['name']}"}}],
-                                    [{"type": "text", "text": {"content": patient['patient_id']}}],
-                                ]
-                            },
-                        },
-                        {
-                            "type": "table_row",
-                            "table_row": {
-                                "cells": [
-                                    [{"type": "text", "text": {"content": "介護単位"}}],
-                                    [{"type": "text", "text": {"content": str(patient["kaigo_units"])}}],
-                                ]
-                            },
-                        },
-                        {
-                            "type": "table_row",
-                            "table_row": {
-                                "cells": [
-                                    [{"type": "text", "text": {"content": "介護負担"}}],
-                                    [{"type": "text", "text": {"content": f"¥{patient['kaigo_burden']:,}"}}],
-                                ]
-                            },
-                        },
-                        {
-                            "type": "table_row",
-                            "table_row": {
-                                "cells": [
-                                    [{"type": "text", "text": {"content": "自費"}}],
-                                    [{"type": "text", "text": {"content": f"¥{patient['jihi']:,}"}}],
-                                ]
-                            },
-                        },
-                        {
-                            "type": "table_row",
-                            "table_row": {
-                                "cells": [
-                                    [{"type": "text", "text": {"content": "物販"}}],
-                                    [{"type": "text", "text": {"content": f"¥{patient['bushan']:,}"}}],
-                                ]
-                            },
-                        },
-                        {
-                            "type": "table_row",
-                            "table_row": {
-                                "cells": [
-                                    [{"type": "text", "text": {"content": "前回差額"}}],
-                                    [{"type": "text", "text": {"content": f"¥{patient['zenkai_sagaku']:,}"}}],
-                                ]
-                            },
-                        },
-                        {
-                            "type": "table_row",
-                            "table_row": {
-                                "cells": [
-                                    [{"type": "text", "text": {"content": "差額"}}],
-                                    [{"type": "text", "text": {"content": f"¥{patient['sagaku']:,}"}}],
-                                ]
-                            },
-                        },
-                    ],
-                },
-            })
+        if compact:
+            blocks.extend(build_compact_detail_tables(patients_with_details))
+        else:
+            for patient in patients_with_details:
+                rows = [_DETAIL_TITLE_ROW.fill(f"{patient['number']}. {patient['name']}", patient["patient_id"])]
+                for template, key, is_yen in _DETAIL_ROWS:
+                    rows.append(template.fill(format_detail_value(patient, key, is_yen)))
+                blocks.append(table(2, rows, has_column_header=False))
 
     # 元のPDF
-    blocks.extend([
-        {
-            "object": "block",
-            "type": "heading_1",
-            "heading_1": {
-                "rich_text": [{"type": "text", "text": {"content": "📄 元の日計表PDF"}}]
-            },
-        },
-        {
-            "object": "block",
-            "type": "file",
-            "file": {
-                "type": "file_upload",
-                "file_upload": {"id": file_upload_id},
-                "caption": [{"type": "text", "text": {"content": "元の日計表"}}],
-            },
-        },
-    ])
+    blocks.extend([_PDF_HEADING, build_pdf_block(file_upload_id)])
 
     return blocks
 
 
+def build_pdf_block(file_upload_id):
+    return {
+        "object": "block",
+        "type": "file",
+        "file": {
+            "type": "file_upload",
+            "file_upload": {"id": file_upload_id},
+            "caption": _PDF_CAPTION,
+        },
+    }
+
+
+def build_compact_detail_tables(patients_with_details):
+    """詳細データを 1 行 1 患者の横長の表にまとめる（全員 0 の列は出さない）"""
+    columns = [
+        (label, key, is_yen)
+        for label, key, is_yen in _DETAIL_COLUMNS
+        if any(p.get(key, 0) != 0 for p in patients_with_details)
+    ]
+    header = table_row(["患者", "患者ID"] + [label for label, _, _ in columns])
+    row = RowTemplate([None] * (2 + len(columns)))
+
+    tables = []
+    for i in range(0, len(patients_with_details), COMPACT_TABLE_CHUNK_SIZE):
+        rows = [header]
+        for patient in patients_with_details[i:i + COMPACT_TABLE_CHUNK_SIZE]:
+            rows.append(row.fill(
+                f"{patient['number']}. {patient['name']}",
+                patient["patient_id"],
+                *(format_detail_value(patient, key, is_yen) for _, key, is_yen in columns),
+            ))
+        tables.append(table(2 + len(columns), rows))
+    return tables
+
+
+def build_page_properties(summary, today_difference, file_upload_id, pdf_filename):
+    """日計表ページのデータベースプロパティを生成"""
+    return {
+        "タイトル": {"title": [{"text": {"content": f"{summary['date']} 日計表"}}]},
+        "日付": {"date": {"start": summary["date"]}},
+        "社保人数": {"number": summary["shaho_count"]},
+        "社保金額": {"number": summary["shaho_amount"]},
+        "国保人数": {"number": summary["kokuho_count"]},
+        "国保金額": {"number": summary["kokuho_amount"]},
+        "後期人数": {"number": summary["kouki_count"]},
+        "後期金額": {"number": summary["kouki_amount"]},
+        "自費人数": {"number": summary["jihi_count"]},
+        "自費金額": {"number": summary["jihi_amount"]},
+        "保険なし人数": {"number": summary["hoken_nashi_count"]},
+        "保険なし金額": {"number": summary["hoken_nashi_amount"]},
+        "合計人数": {"number": summary["total_count"]},
+        "合計金額": {"number": summary["total_amount"]},
+        "物販": {"number": summary["bushan_amount"]},
+        "介護": {"number": summary["kaigo_amount"]},
+        "前回差額": {"number": summary["zenkai_sagaku"]},
+        "当日差額": {"number": today_difference},
+        "PDF": {
+            "files": [
+                {
+                    "type": "file_upload",
+                    "file_upload": {"id": file_upload_id},
+                    "name": pdf_filename,
+                }
+            ]
+        },
+        "照合状態": {"select": {"name": "未照合"}},
+    }
+
+
 # ====================
 # Notion 保存
 # ====================
 def save_to_notion(pdf_bytes, summary, patients, today_difference):
-    """Notion に PDF、集計データ、個別患者データをすべて保存"""
+    """Notion に PDF、集計データ、個別患者データをすべて保存
 
-    try:
-        # 1. PDF アップロード
-        pdf_filename = f"日計表_{summary['date']}.pdf"
-        print(f"[DEBUG] Uploading PDF: {pdf_filename}")
-        file_upload_id = upload_file_to_notion(pdf_bytes, pdf_filename, "application/pdf")
-        print(f"[DEBUG] PDF uploaded successfully. File ID: {file_upload_id}")
-    except Exception as e:
-        print(f"[ERROR] PDF upload failed: {str(e)}")
-        raise Exception(f"PDF upload failed: {str(e)}")
+    各ステップの結果は PDF のハッシュをキーにチェックポイントへ記録し、
+    リトライ時は最初の未完了ステップから再開する（再アップロードや重複ページ作成を防ぐ）。
+    再開したページが Notion で削除・アーカイブされていた場合はチェックポイントを捨てて作り直す。
+    残り時間が足りない場合の DeadlineExceeded は包まずに送出する（呼び出し元が続きをジョブに回す）。
+    """
+    checkpoints = get_checkpoint_store()
+    key = f"save:{content_hash(pdf_bytes)}"
+    checkpoint = checkpoints.get(key)
+    pdf_filename = f"日計表_{summary['date']}.pdf"
+
+    # 1. PDF アップロード
+    if checkpoint.get("page_id"):
+        # ページ作成済みならファイルは添付済みなので、期限に関係なく再利用できる
+        file_upload_id = checkpoint["file_upload_id"]
+    else:
+        file_upload_id = reusable_file_upload_id(checkpoint)
+    if file_upload_id:
+        print(f"[DEBUG] Resuming from checkpoint. File ID: {file_upload_id}")
+    else:
+        try:
+            print(f"[DEBUG] Uploading PDF: {pdf_filename}")
+            file_upload_id = upload_file_to_notion(pdf_bytes, pdf_filename, "application/pdf")
+            print(f"[DEBUG] PDF uploaded successfully. File ID: {file_upload_id}")
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"[ERROR] PDF upload failed: {str(e)}")
+            raise Exception(f"PDF upload failed: {str(e)}")
+        checkpoint = checkpoints.update(key, file_upload_id=file_upload_id, file_uploaded_at=time.time())
+
+    # 1b. 添付モードでは患者データもファイルにしてアップロード
+    patients_file = None
+    if PATIENT_STORAGE in PATIENT_FILE_FORMATS:
+        if checkpoint.get("page_id") and checkpoint.get("patients_file"):
+            patients_file = tuple(checkpoint["patients_file"])
+        else:
+            patients_file = upload_patients_file(summary, patients)
+            checkpoint = checkpoints.update(key, patients_file=list(patients_file))
+
+    # 2. ページ内ブロックを生成し、Notion の制限内のバッチに分割
+    blocks = build_page_blocks(summary, patients, today_difference, file_upload_id, patients_file=patients_file)
+    properties = build_page_properties(summary, today_difference, file_upload_id, pdf_filename)
+    batches = plan_append_batches(blocks, reserved_bytes=block_payload_size(properties))
+
+    # 3. ページ作成（データベースプロパティ + 最初のバッチを同梱して往復を1回減らす）
+    page_id = checkpoint.get("page_id")
+    resumed = bool(page_id)
+    if resumed:
+        print(f"[DEBUG] Resuming from checkpoint. Page ID: {page_id}")
+    else:
+        try:
+            print(f"[DEBUG] Creating Notion page with database ID: {DATABASE_ID}")
+            print(f"[DEBUG] Page properties: タイトル={summary['date']} 日計表, 日付={summary['date']}")
+
+            page = notion.pages.create(
+                parent={"type": "data_source_id", "data_source_id": DATA_SOURCE_ID},
+                properties=properties,
+                children=batches[0] if batches else [],
+            )
+            page_id = page["id"]
+            print(f"[DEBUG] Notion page created successfully. Page ID: {page_id}")
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"[ERROR] Notion page creation failed: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            raise Exception(f"Notion page creation failed: {str(e)}")
+        checkpoint = checkpoints.update(key, page_id=page_id, appended=1)
 
-    # 2. ページ作成（データベースプロパティ）
+    # 4. 残りのバッチを順番に追加（追加済みのバッチは飛ばす）
     try:
-        print(f"[DEBUG] Creating Notion page with database ID: {DATABASE_ID}")
-        print(f"[DEBUG] Page properties: タイトル={summary['date']} 日計表, 日付={summary['date']}")
-
-        page = notion.pages.create(
-            parent={"type": "data_source_id", "data_source_id": DATA_SOURCE_ID},
-            properties={
-                "タイトル": {"title": [{"text": {"content": f"{summary['date']} 日計表"}}]},
-                "日付": {"date": {"start": summary["date"]}},
-                "社保人数": {"number": summary["shaho_count"]},
-                "社保金額": {"number": summary["shaho_amount"]},
-                "国保人数": {"number": summary["kokuho_count"]},
-                "国保金額": {"number": summary["kokuho_amount"]},
-                "後期人数": {"number": summary["kouki_count"]},
-                "後期金額": {"number": summary["kouki_amount"]},
-                "自費人数": {"number": summary["jihi_count"]},
-                "自費金額": {"number": summary["jihi_amount"]},
-                "保険なし人数": {"number": summary["hoken_nashi_count"]},
-                "保険なし金額": {"number": summary["hoken_nashi_amount"]},
-                "合計人数": {"number": summary["total_count"]},
-                "合計金額": {"number": summary["total_amount"]},
-                "物販": {"number": summary["bushan_amount"]},
-                "介護": {"number": summary["kaigo_amount"]},
-                "前回差額": {"number": summary["zenkai_sagaku"]},
-                "当日差額": {"number": today_difference},
-                "PDF": {
-                    "files": [
-                        {
-                            "type": "file_upload",
-                            "file_upload": {"id": file_upload_id},
-                            "name": pdf_filename,
-                        }
-                    ]
-                },
-                "照合状態": {"select": {"name": "未照合"}},
-            },
+        append_batches(
+            notion,
+            page_id,
+            batches,
+            start=checkpoint.get("appended", 1),
+            on_batch_done=lambda index: checkpoints.update(key, appended=index + 1),
         )
-        page_id = page["id"]
-        print(f"[DEBUG] Notion page created successfully. Page ID: {page_id}")
-    except Exception as e:
-        print(f"[ERROR] Notion page creation failed: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        raise Exception(f"Notion page creation failed: {str(e)}")
-
-    # 3. ページ内にすべてのデータを保存
-    blocks = build_page_blocks(summary, patients, today_difference, file_upload_id)
-
-    # すべてのブロックを追加
-    notion.blocks.children.append(block_id=page_id, children=blocks)
-
+    except APIResponseError as e:
+        # チェックポイントのページが Notion で削除・アーカイブされていた場合は、
+        # 添付済みのファイルも使えないので最初からやり直してページを作り直す
+        if not (resumed and is_missing_page_error(e)):
+            raise
+        print(f"[WARNING] Page {page_id} from checkpoint is deleted or archived in Notion. Creating a new page")
+        checkpoints.clear(key)
+        return save_to_notion(pdf_bytes, summary, patients, today_difference)
+
+    checkpoints.clear(key)
     return page_id
 
 
 def update_notion_page(existing_page_id, pdf_bytes, summary, patients, today_difference):
-    """既存の Notion ページを最新のPDFデータで更新（再アップロード時）"""
+    """既存の Notion ページを最新のPDFデータで更新（再アップロード時）
 
-    try:
-        # 1. 新しいPDFをアップロード
-        pdf_filename = f"日計表_{summary['date']}.pdf"
-        print(f"[DEBUG] Re-upload: Uploading new PDF: {pdf_filename}")
-        file_upload_id = upload_file_to_notion(pdf_bytes, pdf_filename, "application/pdf")
-        print(f"[DEBUG] New PDF uploaded. File ID: {file_upload_id}")
-    except Exception as e:
-        print(f"[ERROR] PDF upload failed during re-upload: {str(e)}")
-        raise Exception(f"PDF upload failed: {str(e)}")
+    save_to_notion と同様に、完了済みのステップはチェックポイントから再開する。
+    """
+    checkpoints = get_checkpoint_store()
+    key = f"update:{existing_page_id}:{content_hash(pdf_bytes)}"
+    checkpoint = checkpoints.get(key)
+    pdf_filename = f"日計表_{summary['date']}.pdf"
+
+    # 1. 新しいPDFをアップロード
+    if checkpoint.get("properties_updated"):
+        # プロパティ更新済みならファイルは添付済み
+        file_upload_id = checkpoint["file_upload_id"]
+    else:
+        file_upload_id = reusable_file_upload_id(checkpoint)
+    if file_upload_id:
+        print(f"[DEBUG] Resuming from checkpoint. File ID: {file_upload_id}")
+    else:
+        try:
+            print(f"[DEBUG] Re-upload: Uploading new PDF: {pdf_filename}")
+            file_upload_id = upload_file_to_notion(pdf_bytes, pdf_filename, "application/pdf")
+            print(f"[DEBUG] New PDF uploaded. File ID: {file_upload_id}")
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"[ERROR] PDF upload failed during re-upload: {str(e)}")
+            raise Exception(f"PDF upload failed: {str(e)}")
+        checkpoint = checkpoints.update(key, file_upload_id=file_upload_id, file_uploaded_at=time.time())
+
+    # 1b. 添付モードでは患者データもファイルにしてアップロード
+    patients_file = None
+    if PATIENT_STORAGE in PATIENT_FILE_FORMATS:
+        if checkpoint.get("appended") and checkpoint.get("patients_file"):
+            patients_file = tuple(checkpoint["patients_file"])
+        else:
+            patients_file = upload_patients_file(summary, patients)
+            checkpoint = checkpoints.update(key, patients_file=list(patients_file))
 
     # 2. 既存ページのプロパティを更新
+    if not checkpoint.get("properties_updated"):
+        try:
+            print(f"[DEBUG] Updating page properties: {existing_page_id}")
+            notion.pages.update(
+                page_id=existing_page_id,
+                properties=build_page_properties(summary, today_difference, file_upload_id, pdf_filename),
+            )
+            print(f"[DEBUG] Page properties updated successfully")
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"[ERROR] Page property update failed: {str(e)}")
+            if is_missing_page_error(e):
+                checkpoints.clear(key)
+                raise StalePageError(f"Page {existing_page_id} is deleted or archived in Notion") from e
+            raise Exception(f"Page property update failed: {str(e)}")
+        checkpoint = checkpoints.update(key, properties_updated=True)
+
+    # 3. 既存のブロックをすべて削除
+    if not checkpoint.get("blocks_cleared"):
+        try:
+            print(f"[DEBUG] Deleting existing blocks from page: {existing_page_id}")
+            existing_block_ids = list_child_block_ids(existing_page_id)
+            for block_id in existing_block_ids:
+                notion.blocks.delete(block_id=block_id)
+            print(f"[DEBUG] Deleted {len(existing_block_ids)} blocks")
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"[WARNING] Failed to delete some blocks: {str(e)}")
+        # 照合結果のブロックも消えたので、照合結果の索引を作り直させる
+        get_verification_history().forget(existing_page_id)
+        checkpoint = checkpoints.update(key, blocks_cleared=True, appended=0)
+
+    # 4. 新しいブロックを追加（save_to_notionと同じ構造、制限内のバッチに分割）
+    blocks = build_page_blocks(summary, patients, today_difference, file_upload_id, patients_file=patients_file)
     try:
-        print(f"[DEBUG] Updating page properties: {existing_page_id}")
-        notion.pages.update(
-            page_id=existing_page_id,
-            properties={
-                "タイトル": {"title": [{"text": {"content": f"{summary['date']} 日計表"}}]},
-                "日付": {"date": {"start": summary["date"]}},
-                "社保人数": {"number": summary["shaho_count"]},
-                "社保金額": {"number": summary["shaho_amount"]},
-                "国保人数": {"number": summary["kokuho_count"]},
-                "国保金額": {"number": summary["kokuho_amount"]},
-                "後期人数": {"number": summary["kouki_count"]},
-                "後期金額": {"number": summary["kouki_amount"]},
-                "自費人数": {"number": summary["jihi_count"]},
-                "自費金額": {"number": summary["jihi_amount"]},
-                "保険なし人数": {"number": summary["hoken_nashi_count"]},
-                "保険なし金額": {"number": summary["hoken_nashi_amount"]},
-                "合計人数": {"number": summary["total_count"]},
-                "合計金額": {"number": summary["total_amount"]},
-                "物販": {"number": summary["bushan_amount"]},
-                "介護": {"number": summary["kaigo_amount"]},
-                "前回差額": {"number": summary["zenkai_sagaku"]},
-                "当日差額": {"number": today_difference},
-                "PDF": {
-                    "files": [
-                        {
-                            "type": "file_upload",
-                            "file_upload": {"id": file_upload_id},
-                            "name": pdf_filename,
-                        }
-                    ]
-                },
-                "照合状態": {"select": {"name": "未照合"}},
-            },
+        append_batches(
+            notion,
+            existing_page_id,
+            plan_append_batches(blocks),
+            start=checkpoint.get("appended", 0),
+            on_batch_done=lambda index: checkpoints.update(key, appended=index + 1),
         )
-        print(f"[DEBUG] Page properties updated successfully")
-    except Exception as e:
-        print(f"[ERROR] Page property update failed: {str(e)}")
-        raise Exception(f"Page property update failed: {str(e)}")
+    except APIResponseError as e:
+        # チェックポイントから再開したあとにページが削除・アーカイブされていた場合
+        if not is_missing_page_error(e):
+            raise
+        checkpoints.clear(key)
+        raise StalePageError(f"Page {existing_page_id} is deleted or archived in Notion") from e
+    print(f"[DEBUG] New blocks added to existing page")
 
-    # 3. 既存のブロックをすべて削除
+    checkpoints.clear(key)
+    return existing_page_id
+
+
+def upload_patients_file(summary, patients):
+    """患者データを CSV / JSON にしてアップロードし (file_upload_id, filename) を返す"""
+    filename = patients_filename(summary["date"], PATIENT_STORAGE)
     try:
-        print(f"[DEBUG] Deleting existing blocks from page: {existing_page_id}")
-        existing_blocks = notion.blocks.children.list(block_id=existing_page_id)
-        for block in existing_blocks["results"]:
-            notion.blocks.delete(block_id=block["id"])
-        print(f"[DEBUG] Deleted {len(existing_blocks['results'])} blocks")
+        print(f"[DEBUG] Uploading patient data: {filename} ({len(patients)} patients)")
+        file_upload_id = upload_file_to_notion(
+            dump_patients(patients, PATIENT_STORAGE),
+            filename,
+            PATIENT_FILE_FORMATS[PATIENT_STORAGE],
+        )
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        print(f"[WARNING] Failed to delete some blocks: {str(e)}")
+        print(f"[ERROR] Patient data upload failed: {str(e)}")
+        raise Exception(f"Patient data upload failed: {str(e)}")
+    return file_upload_id, filename
 
-    # 4. 新しいブロックを追加（save_to_notionと同じ構造）
-    blocks = build_page_blocks(summary, patients, today_difference, file_upload_id)
-    notion.blocks.children.append(block_id=existing_page_id, children=blocks)
-    print(f"[DEBUG] New blocks added to existing page")
 
-    return existing_page_id
+class StalePageError(Exception):
+    """更新しようとしたページが Notion で削除・アーカイブされていた"""
+
+
+def is_missing_page_error(error):
+    """ページが削除（object_not_found）またはアーカイブされていて更新できないエラーか"""
+    if not isinstance(error, APIResponseError):
+        return False
+    if error.code == APIErrorCode.ObjectNotFound:
+        return True
+    return error.code == APIErrorCode.ValidationError and "archived" in str(error).lower()
+
+
+def upsert_daily_report(pdf_bytes, summary, patients, today_difference, existing_page_id=None):
+    """同じ日付のページがあれば更新、なければ新規作成し (page_id, updated_existing) を返す
+
+    既存ページはクライアントから送られた existing_page_id を優先し、
+    なければ日付 → ページ ID の索引から引く（アップロードごとの Notion クエリは不要）。
+    既存ページが Notion で削除・アーカイブされていた場合は索引から外し、新しいページを作る。
+    """
+    page_index = get_page_index(query_report_pages)
+    page_id = existing_page_id or page_index.lookup(summary["date"])
+    updated_existing = False
+
+    if page_id:
+        print(f"[DEBUG] Re-upload detected. Updating existing page: {page_id}")
+        try:
+            page_id = update_notion_page(page_id, pdf_bytes, summary, patients, today_difference)
+            updated_existing = True
+        except StalePageError as e:
+            print(f"[WARNING] {e}. Creating a new page instead")
+            page_index.forget(summary["date"])
+            page_id = None
+
+    if not page_id:
+        page_id = save_to_notion(pdf_bytes, summary, patients, today_difference)
+
+    page_index.remember(summary["date"], page_id)
+    return page_id, updated_existing
+
+
+def query_report_pages(body):
+    """日計表データソースをクエリ（notion-client にない data_sources エンドポイントを直接呼ぶ）"""
+    return notion.request(path=f"data_sources/{DATA_SOURCE_ID}/query", method="POST", body=body)
+
+
+def list_child_block_ids(block_id):
+    """子ブロックの ID をすべて取得（100件ごとのページネーションを辿る）"""
+    return [block["id"] for block in iter_child_blocks(notion, block_id)]
+
+
+# ====================
+# ジョブモード（バックグラウンド保存）
+# ====================
+def wants_job_mode(headers, mode=None):
+    """`Prefer: respond-async` ヘッダまたはフォームの mode=job でジョブモードを判定
+
+    保存ジョブが無効（DEFER_SAVES_TO_JOBS=0、Vercel の既定）なら、job_status_url を確認できないため常に False。
+    """
+    if not DEFER_SAVES_TO_JOBS:
+        return False
+    if mode == "job":
+        return True
+    return "respond-async" in (headers.get("Prefer") or "")
+
+
+def run_save_job(payload, pdf_bytes):
+    """ジョブキューのワーカーから呼ばれる Notion 保存処理"""
+    page_id, updated_existing = upsert_daily_report(
+        pdf_bytes,
+        payload["summary"],
+        payload["patients"],
+        payload["today_difference"],
+        payload.get("existing_page_id"),
+    )
+    return {"notion_page_id": page_id, "updated_existing": updated_existing}
+
+
+def get_save_queue():
+    """保存ジョブ用のキューを返す（ワーカーは初回呼び出し時に起動）"""
+    jobs = get_job_queue()
+    jobs.register(SAVE_JOB_KIND, run_save_job)
+    jobs.start()
+    return jobs
+
+
+def enqueue_save_job(pdf_bytes, summary, patients, today_difference, existing_page_id=None):
+    """Notion 保存をジョブとして登録し job_id を返す"""
+    if not DEFER_SAVES_TO_JOBS:
+        raise RuntimeError("Save jobs are disabled (DEFER_SAVES_TO_JOBS=0): no shared job queue to run them")
+    payload = {
+        "summary": summary,
+        "patients": patients,
+        "today_difference": today_difference,
+        "existing_page_id": existing_page_id,
+    }
+    return get_save_queue().enqueue(SAVE_JOB_KIND, payload, blob=pdf_bytes)
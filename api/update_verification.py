@@ -1,9 +1,10 @@
-from http.server import BaseHTTPRequestHandler
-from notion_client import Client
 import json
 import os
 import sys
 import base64
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # Vercel環境でutilsディレクトリをパスに追加
@@ -19,117 +20,298 @@ except ImportError:
     # Vercel環境では不要（環境変数は自動的に設定される）
     pass
 
+from utils.app_core import ApiHandler, ApiResponse, Endpoint, body_error_response, error_response
+from utils.deadline import DeadlineExceeded, deadline_scope, request_deadline
 from utils.notion_uploader import upload_file_to_notion
+from utils.notion_rate_limit import RateLimitedClient
+from utils.notion_blocks import iter_child_blocks
+from utils.request_body import MAX_UPLOAD_BYTES, UploadTooLarge, read_body, read_multipart
+from utils.verification_pdf import render_verification_pdf
+from utils.verification_history import VERIFICATION_HEADING, find_verification_attempts, get_verification_history
 
-notion = Client(auth=os.environ["NOTION_TOKEN"])
+notion = RateLimitedClient(auth=os.environ["NOTION_TOKEN"])
 
+# 照合画面 PDF をアップロードする上限（バイト）。超えた PDF はメモブロックに置き換える。
+# 未設定なら上限なし（大きな PDF は multi_part で送信される）
+PDF_UPLOAD_LIMIT = int(os.environ["NOTION_MAX_UPLOAD_BYTES"]) if os.environ.get("NOTION_MAX_UPLOAD_BYTES") else None
 
-class handler(BaseHTTPRequestHandler):
 
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self._set_cors_headers()
-        self.end_headers()
+def handle_verification_request(request):
+    """POST /api/update_verification: 照合結果を Notion に保存する"""
+    deadline = request_deadline()
+    try:
+        body = read_verification_request(request.headers, request.rfile)
+    except ValueError as e:
+        return body_error_response(e)
 
-    def do_POST(self):
-        try:
-            content_length = int(self.headers.get("Content-Length", 0))
-            body = json.loads(self.rfile.read(content_length))
-
-            page_id = body["notion_page_id"]
-            is_matched = body["is_matched"]
-            cash_input = body["cash_input"]
-            frontend_pdf_b64 = body["frontend_pdf_base64"]
-            date = body.get("date", "")  # 日付を取得（YYYY-MM-DD形式）
-            expense_director = body.get("expense_director", 0)  # 院長へ金額
-
-            # フロント画面 PDF をデコード
-            frontend_pdf_bytes = base64.b64decode(frontend_pdf_b64)
-
-            # PDF アップロード（日付ベースのファイル名）
-            if date:
-                frontend_filename = f"照合画面_{date}.pdf"
-            else:
-                # 日付がない場合はタイムスタンプを使用（フォールバック）
-                ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-                frontend_filename = f"照合画面_{ts}.pdf"
-
-            frontend_file_id = upload_file_to_notion(
-                frontend_pdf_bytes,
-                frontend_filename,
-                "application/pdf",
+    # 時間内に保存できなければ、関数が打ち切られる前に 504 を返す（クライアントは再送できる）
+    try:
+        with deadline_scope(deadline):
+            timings = save_verification(body, max_upload_bytes=PDF_UPLOAD_LIMIT)
+    except DeadlineExceeded as e:
+        return error_response(e.status, str(e))
+    return ApiResponse(200, {"success": True}, {"Server-Timing": format_server_timing(timings)})
+
+
+ENDPOINT = Endpoint({"POST": handle_verification_request}, expose_headers="Server-Timing")
+
+
+class handler(ApiHandler):
+    endpoint = ENDPOINT
+
+
+def save_verification(request, max_upload_bytes=None):
+    """照合結果を Notion のページに保存し、Notion 呼び出しごとの所要時間（秒）を返す
+
+    照合状態などのプロパティ更新は PDF に依存しないため、アップロードと並行して実行する。
+    アップロード完了後、ファイルプロパティとページ内ブロックの追加も並行して行う。
+    max_upload_bytes を超える PDF はアップロードせず、代わりにメモブロックを追加する。
+    PDF が送られていない場合は、受け取った値からサーバー側で照合画面 PDF を描画する。
+    ページに残す照合結果は VERIFICATION_HISTORY_LIMIT 件までで、古いものは削除する。
+    """
+    started = time.perf_counter()
+    timings = {}
+    page_id = request["notion_page_id"]
+    result_label = "一致" if request["is_matched"] else "不一致"
+    frontend_filename = verification_filename(request["date"])
+    verified_at = datetime.now()
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        def submit(func, *args, **kwargs):
+            # 並行する Notion 呼び出しにも呼び出し元の Deadline（utils.deadline）を引き継ぐ
+            return pool.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+        # 1. ステータス系プロパティの更新（描画・アップロードと並行）
+        status_update = submit(
+            timed, timings, "properties",
+            notion.pages.update,
+            page_id=page_id,
+            properties={
+                "照合状態": {"select": {"name": result_label}},
+                "入力金額": {"number": request["cash_input"]},
+                "院長へ": {"number": request["expense_director"]},
+                "照合日時": {"date": {"start": verified_at.isoformat()}},
+            },
+        )
+
+        frontend_pdf = request.get("frontend_pdf")
+        if frontend_pdf is None:
+            frontend_pdf = timed(
+                timings, "render",
+                render_verification_pdf,
+                request["is_matched"], request["cash_input"], request["expense_director"],
+                date=request["date"],
+                summary=request.get("summary"),
+                sheet=request.get("sheet"),
+                verified_at=verified_at.strftime("%Y-%m-%d %H:%M"),
             )
 
-            # ページプロパティ更新
-            notion.pages.update(
-                page_id=page_id,
-                properties={
-                    "照合状態": {
-                        "select": {"name": "一致" if is_matched else "不一致"}
-                    },
-                    "入力金額": {"number": cash_input},
-                    "院長へ": {"number": expense_director},
-                    "照合日時": {"date": {"start": datetime.now().isoformat()}},
-                    "照合画面PDF": {
-                        "files": [
-                            {
-                                "type": "file_upload",
-                                "file_upload": {"id": frontend_file_id},
-                                "name": frontend_filename,
-                            }
-                        ]
-                    },
-                },
+        # 2. 照合画面 PDF のアップロード
+        if max_upload_bytes is not None and len(frontend_pdf) > max_upload_bytes:
+            print(f"[DEBUG] Frontend PDF too large ({len(frontend_pdf)} bytes > {max_upload_bytes} bytes). Skipping upload.")
+            attach = [submit(
+                append_verification_blocks, timings, page_id, [build_skipped_note_block(request["is_matched"])],
+            )]
+        else:
+            frontend_file_id = timed(
+                timings, "upload",
+                upload_file_to_notion, frontend_pdf, frontend_filename, "application/pdf",
             )
 
-            # 照合画面 PDF をページ内ブロックに追加
-            notion.blocks.children.append(
-                block_id=page_id,
-                children=[
-                    {
-                        "object": "block",
-                        "type": "heading_2",
-                        "heading_2": {
-                            "rich_text": [
+            # 3. ファイルプロパティとページ内ブロックを追加
+            attach = [
+                submit(
+                    timed, timings, "file_property",
+                    notion.pages.update,
+                    page_id=page_id,
+                    properties={
+                        "照合画面PDF": {
+                            "files": [
                                 {
-                                    "type": "text",
-                                    "text": {"content": "✅ 照合画面PDF"},
+                                    "type": "file_upload",
+                                    "file_upload": {"id": frontend_file_id},
+                                    "name": frontend_filename,
                                 }
                             ]
                         },
                     },
+                ),
+                submit(
+                    append_verification_blocks, timings, page_id,
+                    build_verification_blocks(frontend_file_id, result_label),
+                ),
+            ]
+
+        # 失敗した呼び出しがあれば例外を呼び出し元に伝える
+        status_update.result()
+        for future in attach:
+            future.result()
+
+    timings["total"] = time.perf_counter() - started
+    print("[DEBUG] Verification timings: " + ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in timings.items()))
+    return timings
+
+
+def append_verification_blocks(timings, page_id, children):
+    """照合結果のブロックをページ末尾に追加し、上限を超えた古い照合結果を削除する"""
+    response = timed(timings, "blocks", notion.blocks.children.append, block_id=page_id, children=children)
+    block_ids = [block["id"] for block in response["results"]]
+    timed(timings, "prune", prune_verification_history, page_id, block_ids)
+
+
+def prune_verification_history(page_id, block_ids):
+    """ページの照合結果で索引を更新し、古い照合結果のブロックを削除する"""
+    history = get_verification_history()
+    if history.limit <= 0:
+        return
+    # 索引はこのインスタンスのキャッシュで、他のインスタンスが追加した照合結果を含まないため、毎回ページを走査する
+    attempts = find_verification_attempts(list_child_blocks(page_id))
+    if block_ids and not any(block_ids[0] in attempt for attempt in attempts):
+        # 追加直後のブロックが一覧にまだ出てこない場合も、今回の照合結果は最新として数える
+        attempts.append(block_ids)
+    history.seed(page_id, attempts)
+
+    for stale_ids in history.trim(page_id):
+        for block_id in stale_ids:
+            try:
+                notion.blocks.delete(block_id=block_id)
+            except Exception as e:
+                # 手動で削除済みのブロックなどは無視する（次の照合には影響しない）
+                print(f"[WARNING] Failed to delete old verification block {block_id}: {str(e)}")
+
+
+def list_child_blocks(page_id):
+    """ページ直下のブロックをすべて取得（100件ごとのページネーションを辿る）"""
+    return list(iter_child_blocks(notion, page_id))
+
+
+def verification_filename(date):
+    """照合画面 PDF のファイル名（日付がない場合はタイムスタンプ）"""
+    if date:
+        return f"照合画面_{date}.pdf"
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"照合画面_{ts}.pdf"
+
+
+def build_verification_blocks(frontend_file_id, result_label):
+    return [
+        {
+            "object": "block",
+            "type": "heading_2",
+            "heading_2": {
+                "rich_text": [
                     {
-                        "object": "block",
-                        "type": "file",
-                        "file": {
-                            "type": "file_upload",
-                            "file_upload": {"id": frontend_file_id},
-                            "caption": [
-                                {
-                                    "type": "text",
-                                    "text": {
-                                        "content": f"照合結果: {'一致' if is_matched else '不一致'}"
-                                    },
-                                }
-                            ],
-                        },
-                    },
+                        "type": "text",
+                        "text": {"content": VERIFICATION_HEADING},
+                    }
+                ]
+            },
+        },
+        {
+            "object": "block",
+            "type": "file",
+            "file": {
+                "type": "file_upload",
+                "file_upload": {"id": frontend_file_id},
+                "caption": [
+                    {
+                        "type": "text",
+                        "text": {"content": f"照合結果: {result_label}"},
+                    }
                 ],
-            )
+            },
+        },
+    ]
 
-            self._send_json(200, {"success": True})
 
-        except Exception as e:
-            self._send_json(500, {"success": False, "error": str(e)})
+def build_skipped_note_block(is_matched):
+    """PDF をアップロードできなかった場合のメモブロック"""
+    return {
+        "object": "block",
+        "type": "callout",
+        "callout": {
+            "rich_text": [
+                {
+                    "type": "text",
+                    "text": {
+                        "content": f"照合結果: {'一致' if is_matched else '不一致'} (照合画面PDFはサイズ制限によりアップロードできませんでした)"
+                    }
+                }
+            ],
+            "icon": {"emoji": "✅" if is_matched else "❌"}
+        },
+    }
 
-    def _set_cors_headers(self):
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "POST, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
 
-    def _send_json(self, status, data):
-        self.send_response(status)
-        self._set_cors_headers()
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        self.wfile.write(json.dumps(data, ensure_ascii=False).encode())
+def timed(timings, name, func, *args, **kwargs):
+    """func を実行し、所要時間を timings[name] に記録する"""
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        timings[name] = time.perf_counter() - started
+
+
+def format_server_timing(timings):
+    """Server-Timing ヘッダの値（ブラウザの開発者ツールで確認できる）"""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+def read_verification_request(headers, rfile):
+    """照合結果リクエストを読み込んで dict にする
+
+    multipart/form-data: PDF はバイナリのパート frontend_pdf、その他はフォームフィールド。
+                         ソケットから少しずつ読み、PDF はパートのバッファ（大きければ一時ファイルの
+                         mmap）への memoryview のまま扱う（base64 の展開なし）
+    application/json:    従来の形式（PDF は frontend_pdf_base64）
+
+    PDF の代わりに summary（日計表 PDF の集計）や sheet（画面の表）を JSON で送った場合は
+    frontend_pdf を None にし、save_verification がサーバー側で PDF を描画する。
+    """
+    content_type = headers.get("Content-Type", "")
+    content_length = int(headers.get("Content-Length", 0))
+    if content_length > MAX_UPLOAD_BYTES:
+        raise UploadTooLarge(f"Request body too large ({content_length} bytes > {MAX_UPLOAD_BYTES} bytes)")
+
+    if content_type.startswith("multipart/form-data"):
+        fields, files = read_multipart(rfile, content_type, content_length)
+        try:
+            sheet_data = {name: json.loads(fields[name]) for name in ("summary", "sheet") if fields.get(name)}
+        except json.JSONDecodeError:
+            raise ValueError("summary and sheet must be JSON")
+        if "frontend_pdf" not in files and not sheet_data:
+            raise ValueError("No frontend_pdf uploaded")
+        if not fields.get("notion_page_id"):
+            raise ValueError("notion_page_id is required")
+        try:
+            return {
+                "notion_page_id": fields["notion_page_id"],
+                "is_matched": fields.get("is_matched", "").lower() in ("true", "1"),
+                "cash_input": int(fields.get("cash_input") or 0),
+                "date": fields.get("date", ""),
+                "expense_director": int(fields.get("expense_director") or 0),
+                "frontend_pdf": files["frontend_pdf"].data if "frontend_pdf" in files else None,
+                "summary": sheet_data.get("summary"),
+                "sheet": sheet_data.get("sheet"),
+            }
+        except ValueError:
+            raise ValueError("cash_input and expense_director must be integers")
+
+    data = json.loads(read_body(rfile, content_length))
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+    for name in ("notion_page_id", "is_matched", "cash_input"):
+        if name not in data:
+            raise ValueError(f"{name} is required")
+    if "frontend_pdf_base64" not in data and not (data.get("summary") or data.get("sheet")):
+        raise ValueError("No frontend_pdf uploaded")
+    return {
+        "notion_page_id": data["notion_page_id"],
+        "is_matched": data["is_matched"],
+        "cash_input": data["cash_input"],
+        "date": data.get("date", ""),
+        "expense_director": data.get("expense_director", 0),
+        "frontend_pdf": base64.b64decode(data["frontend_pdf_base64"]) if "frontend_pdf_base64" in data else None,
+        "summary": data.get("summary"),
+        "sheet": data.get("sheet"),
+    }
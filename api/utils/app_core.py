@@ -0,0 +1,305 @@
+import gzip
+import importlib
+import json
+import os
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+from .metrics import get_metrics_registry, log_snapshot
+
+# HTTP の受け口に依存しない API の入出力
+#
+# 各 API モジュール（api/<name>.py）は ENDPOINT = Endpoint({...}) に
+# 「ApiRequest を受け取って ApiResponse を返す関数」を登録するだけにし、
+# Vercel（BaseHTTPRequestHandler）・ローカルの並行サーバー・asyncio サーバーは
+# それぞれ ApiRequest を作って Endpoint.handle を呼び、ApiResponse を書き出す。
+
+# これより小さい JSON は圧縮しない（圧縮のオーバーヘッドの方が大きい）
+RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get("RESPONSE_COMPRESS_MIN_BYTES", 1024))
+RESPONSE_COMPRESS_LEVEL = int(os.environ.get("RESPONSE_COMPRESS_LEVEL", 6))
+
+# 対応する Content-Encoding（同じ q 値なら先にあるものを選ぶ）
+CONTENT_ENCODINGS = ("gzip", "deflate")
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+# URL パス → api/ のモジュール名
+API_ROUTES = {
+    "/api/parse_daily_report": "parse_daily_report",
+    "/api/parse_batch": "parse_batch",
+    "/api/update_verification": "update_verification",
+    "/api/job_status": "job_status",
+    # 解析と同じ関数のインスタンスを温めるため、parse_daily_report の GET で処理する（vercel.json で書き換え）
+    "/api/warmup": "parse_daily_report",
+}
+
+# ローカルサーバーだけで提供するパス（Vercel にはデプロイしない utils のモジュール）
+LOCAL_API_ROUTES = {
+    "/api/metrics": "utils.metrics_api",
+}
+
+
+class ApiRequest:
+    """API リクエスト
+
+    headers は大文字小文字を区別しない get を持つもの（http.client.HTTPMessage など）、
+    rfile はボディを同期的に読めるファイルオブジェクト（Content-Length 分だけ読む）。
+    """
+
+    def __init__(self, method, path, headers, rfile):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.rfile = rfile
+
+    @property
+    def query(self):
+        """クエリ文字列（名前 -> 最初の値）"""
+        return {name: values[0] for name, values in parse_qs(urlparse(self.path).query).items()}
+
+    @property
+    def content_type(self):
+        return self.headers.get("Content-Type", "")
+
+    @property
+    def content_length(self):
+        return int(self.headers.get("Content-Length") or 0)
+
+
+class ApiResponse:
+    """API レスポンス（data は JSON にする dict）
+
+    close=True はリクエストボディを読み残したため、接続を閉じる必要があることを表す。
+    encoding は Accept-Encoding から選んだ圧縮方式（Endpoint.handle が設定する）。
+    stream を渡すと、その各要素（dict）を 1 行ずつ NDJSON で送るストリーミングレスポンスになる。
+    JSON 以外を返す場合は data の代わりに body（bytes）を渡し、Content-Type を headers に入れる。
+    """
+
+    def __init__(self, status, data=None, headers=None, close=False, stream=None, body=None):
+        self.status = status
+        self.data = data
+        self.headers = dict(headers or {})
+        self.close = close
+        self.encoding = None
+        self.stream = stream
+        self.body = body
+
+    def encode(self):
+        """送信するヘッダとボディを (header_items, body) で返す
+
+        JSON は区切りの空白なしで書き出し、RESPONSE_COMPRESS_MIN_BYTES 以上なら encoding で圧縮する。
+        Content-Type / Content-Encoding / Content-Length / Connection はここで補う。
+        """
+        items = list(self.headers.items())
+        body = b"" if self.body is None else bytes(self.body)
+        if self.data is not None:
+            body = json.dumps(self.data, ensure_ascii=False, separators=(",", ":")).encode()
+            items.append(("Content-Type", "application/json"))
+        if body:
+            items.append(("Vary", "Accept-Encoding"))
+            if self.encoding and len(body) >= RESPONSE_COMPRESS_MIN_BYTES:
+                body = compress(body, self.encoding)
+                items.append(("Content-Encoding", self.encoding))
+        items.append(("Content-Length", str(len(body))))
+        if self.close:
+            items.append(("Connection", "close"))
+        return items, body
+
+    def stream_header_items(self):
+        """ストリーミングレスポンスのヘッダ（長さは分からないので Content-Length なし）"""
+        items = list(self.headers.items())
+        items.append(("Content-Type", NDJSON_CONTENT_TYPE))
+        items.append(("Vary", "Accept-Encoding"))
+        items.append(("Cache-Control", "no-cache"))
+        if self.encoding:
+            items.append(("Content-Encoding", self.encoding))
+        if self.close:
+            items.append(("Connection", "close"))
+        return items
+
+    def iter_stream(self):
+        """stream の各要素を NDJSON の行にして返す（圧縮する場合は行ごとに flush する）"""
+        compressor = stream_compressor(self.encoding) if self.encoding else None
+        for record in self.stream:
+            line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+            if compressor is not None:
+                # Z_SYNC_FLUSH: ここまでの行をブラウザが展開できるように出し切る
+                line = compressor.compress(line) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield line
+        if compressor is not None:
+            yield compressor.flush()
+
+
+def negotiate_encoding(accept_encoding):
+    """Accept-Encoding ヘッダから CONTENT_ENCODINGS のうち使えるものを選ぶ（なければ None）"""
+    weights = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            weights[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in CONTENT_ENCODINGS:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body, encoding):
+    if encoding == "gzip":
+        # mtime=0: 同じ内容なら同じバイト列にする
+        return gzip.compress(body, compresslevel=RESPONSE_COMPRESS_LEVEL, mtime=0)
+    if encoding == "deflate":
+        # HTTP の deflate は zlib 形式（RFC 1950）
+        return zlib.compress(body, RESPONSE_COMPRESS_LEVEL)
+    raise ValueError(f"Unknown content encoding: {encoding}")
+
+
+def stream_compressor(encoding):
+    """行ごとに flush しながら圧縮する zlib の compressobj"""
+    if encoding == "gzip":
+        return zlib.compressobj(RESPONSE_COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    if encoding == "deflate":
+        return zlib.compressobj(RESPONSE_COMPRESS_LEVEL, zlib.DEFLATED, 15)
+    raise ValueError(f"Unknown content encoding: {encoding}")
+
+
+def wants_stream(request):
+    """NDJSON のストリーミングレスポンスを求めているか（Accept ヘッダまたは ?stream=1）"""
+    if request.query.get("stream") in ("1", "true"):
+        return True
+    return NDJSON_CONTENT_TYPE in (request.headers.get("Accept") or "")
+
+
+def error_response(status, message, close=False):
+    return ApiResponse(status, {"success": False, "error": message}, close=close)
+
+
+def body_error_response(error):
+    """リクエストボディの読み込みエラー（ValueError）のレスポンス
+
+    上限超過は 413、それ以外は 400。読み残したボディが次のリクエストと混ざらないよう接続を閉じる。
+    """
+    return error_response(getattr(error, "status", 400), str(error), close=True)
+
+
+class Endpoint:
+    """1 つの API パスのメソッドごとの処理と CORS ヘッダ"""
+
+    def __init__(self, handlers, allow_headers="Content-Type", expose_headers=None):
+        self.handlers = handlers
+        self.cors_headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": ", ".join([*handlers, "OPTIONS"]),
+            "Access-Control-Allow-Headers": allow_headers,
+        }
+        if expose_headers:
+            self.cors_headers["Access-Control-Expose-Headers"] = expose_headers
+
+    def handle(self, request):
+        """リクエストを処理して ApiResponse を返す（例外は 500 のレスポンスにする）"""
+        started = time.perf_counter()
+        response = self._dispatch(request)
+        response.headers = {**self.cors_headers, **response.headers}
+        response.encoding = negotiate_encoding(request.headers.get("Accept-Encoding"))
+
+        route = urlparse(request.path).path
+        metrics = get_metrics_registry()
+        metrics.inc("api_requests_total", route=route, method=request.method, status=str(response.status))
+        metrics.observe("api_request_seconds", time.perf_counter() - started, route=route)
+        return response
+
+    def _dispatch(self, request):
+        if request.method == "OPTIONS":
+            response = ApiResponse(200)
+        elif request.method not in self.handlers:
+            response = error_response(405, "Method Not Allowed", close=True)
+        else:
+            try:
+                response = self.handlers[request.method](request)
+            except Exception as e:
+                response = error_response(500, str(e))
+        return response
+
+
+def find_endpoint(path, local=False):
+    """URL パスに対応する API の Endpoint（API のパスでなければ None）
+
+    local=True ならローカルサーバー専用のパス（LOCAL_API_ROUTES）も探す。
+    """
+    path = urlparse(path).path
+    module_name = API_ROUTES.get(path) or (LOCAL_API_ROUTES.get(path) if local else None)
+    if module_name is None:
+        return None
+    return importlib.import_module(module_name).ENDPOINT
+
+
+def send_api_response(handler, response):
+    """ApiResponse を BaseHTTPRequestHandler の接続に書き出す"""
+    if response.stream is not None:
+        send_stream_response(handler, response)
+        return
+    header_items, body = response.encode()
+    handler.send_response(response.status)
+    for name, value in header_items:
+        handler.send_header(name, value)
+    handler.end_headers()
+    if handler.command != "HEAD":
+        handler.wfile.write(body)
+
+
+def send_stream_response(handler, response):
+    """ストリーミングレスポンスを行ごとに書き出す
+
+    HTTP/1.1 の接続では chunked、それ以外は接続を閉じてボディの終わりを示す。
+    """
+    chunked = handler.protocol_version == "HTTP/1.1" and handler.request_version == "HTTP/1.1"
+    handler.send_response(response.status)
+    for name, value in response.stream_header_items():
+        handler.send_header(name, value)
+    if chunked:
+        handler.send_header("Transfer-Encoding", "chunked")
+    else:
+        handler.close_connection = True
+    handler.end_headers()
+    for chunk in response.iter_stream():
+        if not chunk:
+            continue
+        if chunked:
+            chunk = b"%x\r\n%s\r\n" % (len(chunk), chunk)
+        handler.wfile.write(chunk)
+        handler.wfile.flush()
+    if chunked:
+        handler.wfile.write(b"0\r\n\r\n")
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """Vercel 用のハンドラ。サブクラスで endpoint に Endpoint を設定する"""
+
+    endpoint = None
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def do_OPTIONS(self):
+        self._handle()
+
+    def _handle(self):
+        request = ApiRequest(self.command, self.path, self.headers, self.rfile)
+        send_api_response(self, self.endpoint.handle(request))
+        log_snapshot()
@@ -0,0 +1,84 @@
+import json
+
+# Notion API のリクエスト制限
+# https://developers.notion.com/reference/request-limits
+MAX_CHILDREN_PER_REQUEST = 100   # 1 リクエストの children 配列の要素数
+MAX_BLOCKS_PER_REQUEST = 1000    # ネストを含めた 1 リクエストあたりのブロック総数
+MAX_PAYLOAD_BYTES = 500_000      # リクエストボディ全体のサイズ
+
+# プロパティなど children 以外の JSON 構造に確保する余白
+PAYLOAD_MARGIN_BYTES = 10_000
+
+
+def count_blocks(block):
+    """ネストした children（テーブル行など）を含むブロック数を返す"""
+    body = block.get(block.get("type"), {})
+    children = body.get("children", []) if isinstance(body, dict) else []
+    return 1 + sum(count_blocks(child) for child in children)
+
+
+def block_payload_size(block):
+    """ブロックを JSON にしたときのバイト数"""
+    return len(json.dumps(block, ensure_ascii=False).encode("utf-8"))
+
+
+def plan_append_batches(
+    blocks,
+    reserved_bytes=0,
+    max_children=MAX_CHILDREN_PER_REQUEST,
+    max_blocks=MAX_BLOCKS_PER_REQUEST,
+    max_bytes=MAX_PAYLOAD_BYTES - PAYLOAD_MARGIN_BYTES,
+):
+    """ブロック列を Notion の制限内に収まるバッチへ順序を保って分割する
+
+    reserved_bytes: 最初のバッチを pages.create に同梱する場合の
+                    プロパティ部分のバイト数（最初のバッチだけ上限から差し引く）。
+                    先頭のブロックが差し引いた上限に収まらなければ最初のバッチを空にし
+                    （pages.create は children なし）、そのブロックは次のバッチに入れる
+    """
+    batches = []
+    current, current_blocks, current_bytes = [], 0, 0
+    budget = max_bytes - reserved_bytes
+
+    for block in blocks:
+        n = count_blocks(block)
+        size = block_payload_size(block)
+        if n > max_blocks or size > max_bytes:
+            raise ValueError(
+                f"Block too large for a single Notion request ({n} blocks, {size} bytes)"
+            )
+
+        if not batches and not current and size > budget:
+            batches.append([])
+            budget = max_bytes
+
+        if current and (
+            len(current) >= max_children
+            or current_blocks + n > max_blocks
+            or current_bytes + size > budget
+        ):
+            batches.append(current)
+            current, current_blocks, current_bytes = [], 0, 0
+            budget = max_bytes
+
+        current.append(block)
+        current_blocks += n
+        current_bytes += size
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+def append_batches(notion, block_id, batches, start=0, on_batch_done=None):
+    """バッチを順番に blocks.children.append する
+
+    追記は常にページ末尾に入るため、順序を保つには前のバッチの完了を待つ必要がある。
+    待機はレート制限（RateLimitedClient）のみで、バッチ間に余計な待ちは入れない。
+    on_batch_done: バッチ追加のたびにそのインデックスで呼ばれる（チェックポイント用）
+    """
+    for index in range(start, len(batches)):
+        notion.blocks.children.append(block_id=block_id, children=batches[index])
+        print(f"[DEBUG] Appended block batch {index + 1}/{len(batches)} ({len(batches[index])} blocks)")
+        if on_batch_done:
+            on_batch_done(index)
@@ -0,0 +1,266 @@
+import asyncio
+import http.client
+import io
+import mimetypes
+import os
+import posixpath
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import unquote, urlparse
+
+from .app_core import ApiRequest, error_response, find_endpoint
+from .local_server import KEEPALIVE_SECONDS, PUBLIC_DIR
+from .request_body import CHUNK_SIZE, MAX_UPLOAD_BYTES, UPLOAD_SPOOL_THRESHOLD, SpooledBody
+
+# asyncio（標準ライブラリの streams）によるオンプレミス用サーバー
+#
+# - 接続の受け付け・ヘッダとボディの読み込み・レスポンスの書き出しはイベントループ 1 本で行い、
+#   アイドルな keep-alive 接続や遅いアップロードはスレッドを占有しない
+# - API の処理（Notion 呼び出し）はスレッドプールで実行して await する。notion-client は同期 API のため、
+#   同時に処理する API リクエストの数は ASYNC_SERVER_API_WORKERS で制限される
+# - PDF 解析は parse_pool のプロセスプールに振り分けられる（configure_parse_pool を呼んだ場合）
+# - /api/<name> は api/<name>.py の ENDPOINT で処理する（Vercel・スレッドプールのサーバーと同じコード）
+
+ASYNC_SERVER_API_WORKERS = int(os.environ.get("ASYNC_SERVER_API_WORKERS", 16))
+
+# リクエスト行 + ヘッダの上限
+MAX_REQUEST_HEAD_BYTES = 64 * 1024
+
+SERVER_NAME = "daily-report-async"
+
+
+class AsyncServer:
+    """public/ の静的ファイルと api/ の Endpoint を 1 つのポートで提供する asyncio サーバー"""
+
+    def __init__(self, api_workers=ASYNC_SERVER_API_WORKERS, keepalive=KEEPALIVE_SECONDS, public_dir=PUBLIC_DIR):
+        self.keepalive = keepalive
+        self.public_dir = public_dir
+        self._executor = ThreadPoolExecutor(max_workers=api_workers, thread_name_prefix="api-worker")
+        self._server = None
+
+    async def start(self, host="localhost", port=8000):
+        self._server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_REQUEST_HEAD_BYTES)
+        return self._server
+
+    @property
+    def sockets(self):
+        return self._server.sockets
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def handle_connection(self, reader, writer):
+        """1 つの接続で HTTP/1.1 のリクエストを順に処理する（keep-alive）"""
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keepalive)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._write_error(writer, 431, "Request Header Fields Too Large")
+                    break
+
+                try:
+                    method, path, version, headers = parse_request_head(head)
+                except ValueError as e:
+                    await self._write_error(writer, 400, str(e))
+                    break
+
+                keep_alive = wants_keep_alive(version, headers)
+                endpoint = find_endpoint(path, local=True)
+                if endpoint is not None:
+                    keep_alive &= await self._handle_api(endpoint, method, path, version, headers, reader, writer)
+                elif method in ("GET", "HEAD"):
+                    await self._handle_static(method, path, writer)
+                else:
+                    # 読まなかったリクエストボディが次のリクエストと混ざらないよう、接続を閉じる
+                    await self._write_error(writer, 404, "Not Found")
+                    break
+
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _handle_api(self, endpoint, method, path, version, headers, reader, writer):
+        """API リクエストを処理する（接続を維持できるなら True）"""
+        try:
+            content_length = int(headers.get("Content-Length") or 0)
+        except ValueError:
+            content_length = -1
+        if content_length < 0 or headers.get("Transfer-Encoding"):
+            await self._write_error(writer, 400, "Content-Length is required")
+            return False
+
+        # 上限を超えるボディは読まずに Endpoint へ渡す（read_multipart が 413 を返す）
+        body_read = content_length <= MAX_UPLOAD_BYTES
+        rfile = await read_body_async(reader, content_length) if body_read else io.BytesIO()
+        try:
+            request = ApiRequest(method, path, headers, rfile)
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(self._executor, endpoint.handle, request)
+        finally:
+            rfile.close()
+
+        if response.stream is not None:
+            return await self._write_stream(writer, response, version) and body_read and not response.close
+
+        # JSON の書き出しと圧縮も CPU 処理なのでイベントループの外で行う
+        header_items, body = await loop.run_in_executor(self._executor, response.encode)
+        await self._write_response(writer, response.status, header_items, body, method)
+        return body_read and not response.close
+
+    async def _write_stream(self, writer, response, version):
+        """ストリーミングレスポンスを書き出す（接続を維持できるなら True）
+
+        レコードの生成（PDF 解析・Notion 呼び出し）はスレッドプールで 1 行ずつ進め、
+        できた行から送る。HTTP/1.1 では chunked、HTTP/1.0 では接続を閉じてボディの終わりを示す。
+        """
+        chunked = version == "HTTP/1.1"
+        header_items = response.stream_header_items()
+        header_items.append(("Transfer-Encoding", "chunked") if chunked else ("Connection", "close"))
+        await self._write_head(writer, response.status, header_items)
+
+        loop = asyncio.get_running_loop()
+        chunks = response.iter_stream()
+        while True:
+            chunk = await loop.run_in_executor(self._executor, next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk) if chunked else chunk)
+                if not await self._drain(writer):
+                    chunks.close()
+                    return False
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+        return await self._drain(writer) and chunked
+
+    async def _handle_static(self, method, path, writer):
+        file_path = self._translate_path(path)
+        if file_path is None or not os.path.isfile(file_path):
+            body = b"Not Found"
+            await self._write_response(writer, 404, [("Content-Type", "text/plain"),
+                                                     ("Content-Length", str(len(body)))], body, method)
+            return
+
+        content = await asyncio.to_thread(_read_file, file_path)
+        content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+        await self._write_response(writer, 200, [("Content-Type", content_type),
+                                                 ("Content-Length", str(len(content)))], content, method)
+
+    def _translate_path(self, path):
+        """URL パスを public/ 内のファイルパスにする（public/ の外を指すなら None）"""
+        path = posixpath.normpath(unquote(urlparse(path).path))
+        if path.endswith("/"):
+            path += "index.html"
+        file_path = os.path.abspath(os.path.join(self.public_dir, path.lstrip("/")))
+        if os.path.isdir(file_path):
+            file_path = os.path.join(file_path, "index.html")
+        root = os.path.abspath(self.public_dir)
+        if os.path.commonpath([root, file_path]) != root:
+            return None
+        return file_path
+
+    async def _write_error(self, writer, status, message):
+        header_items, body = error_response(status, message, close=True).encode()
+        await self._write_response(writer, status, header_items, body, "GET")
+
+    async def _write_response(self, writer, status, header_items, body, method):
+        await self._write_head(writer, status, header_items, flush=False)
+        if method != "HEAD":
+            writer.write(body)
+        await self._drain(writer)
+
+    async def _write_head(self, writer, status, header_items, flush=True):
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Server: {SERVER_NAME}"]
+        lines += [f"{name}: {value}" for name, value in header_items]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if flush:
+            await self._drain(writer)
+
+    async def _drain(self, writer):
+        """送信バッファを送り出す（相手が切断していたら False）"""
+        try:
+            await writer.drain()
+        except ConnectionError:
+            return False
+        return True
+
+
+def parse_request_head(head):
+    """リクエスト行とヘッダを (method, path, version, headers) にする"""
+    request_line, _, header_block = head.partition(b"\r\n")
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+        raise ValueError("Bad request line")
+    method, path, version = parts
+    headers = http.client.parse_headers(io.BytesIO(header_block))
+    return method, path, version, headers
+
+
+def wants_keep_alive(version, headers):
+    connection = (headers.get("Connection") or "").lower()
+    if version == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+
+async def read_body_async(reader, content_length):
+    """リクエストボディを読み込み、先頭にシークしたファイルオブジェクトを返す
+
+    UPLOAD_SPOOL_THRESHOLD を超えるボディは一時ファイルに書き出し（メモリに全体を持たない）、SpooledBody で渡す。
+    read_multipart はファイルパートをもう一度書き出さず、この一時ファイルの mmap を参照する。
+    """
+    if content_length <= UPLOAD_SPOOL_THRESHOLD:
+        try:
+            return io.BytesIO(await reader.readexactly(content_length))
+        except asyncio.IncompleteReadError as e:
+            return io.BytesIO(e.partial)
+
+    body = tempfile.TemporaryFile(prefix="upload-")
+    remaining = content_length
+    try:
+        while remaining:
+            chunk = await reader.read(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                break
+            body.write(chunk)
+            remaining -= len(chunk)
+        body.seek(0)
+    except BaseException:
+        body.close()
+        raise
+    return SpooledBody(body)
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def _serve(host, port, api_workers):
+    server = AsyncServer(api_workers=api_workers)
+    await server.start(host, port)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+def serve(host="localhost", port=8000, api_workers=ASYNC_SERVER_API_WORKERS):
+    """asyncio サーバーを起動する（Ctrl+C まで戻らない）"""
+    asyncio.run(_serve(host, port, api_workers))
@@ -0,0 +1,63 @@
+import io
+
+
+class BufferReader(io.RawIOBase):
+    """bytes / bytearray / memoryview をコピーせずに読み出すシーク可能なファイルオブジェクト
+
+    io.BytesIO(memoryview) はバッファ全体をコピーするため、大きな PDF を
+    pdfplumber やアップローダーへ渡すときはこちらを使う。
+    """
+
+    def __init__(self, buffer):
+        super().__init__()
+        self._view = memoryview(buffer).cast("B")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def __len__(self):
+        return self._view.nbytes
+
+    def readinto(self, b):
+        n = min(len(b), self._view.nbytes - self._pos)
+        if n <= 0:
+            return 0
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._view.nbytes - self._pos
+        end = min(self._view.nbytes, self._pos + size)
+        data = self._view[self._pos:end].tobytes()
+        self._pos = end
+        return data
+
+    def readall(self):
+        return self.read()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._view.nbytes + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if pos < 0:
+            raise ValueError(f"Negative seek position: {pos}")
+        self._pos = pos
+        return pos
+
+    def tell(self):
+        return self._pos
+
+    def getbuffer(self):
+        """元のバッファへの memoryview を返す（コピーなし）"""
+        return self._view
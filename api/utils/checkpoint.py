@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import time
+
+from .local_state import connect, lazy_singleton, state_path
+from .metrics import get_metrics_registry
+from .upload_cache import FILE_UPLOAD_REUSE_SECONDS
+
+# チェックポイントを残しておく期間（秒）。中断したまま再アップロードされなかった保存の記録は
+# 作成からこの期間が過ぎたら削除する。file_upload_id は FILE_UPLOAD_REUSE_SECONDS で失効するが、
+# 作成済みの page_id はその後の再アップロードでも使える（ページの重複を防ぐ）ため、それより長く残す
+CHECKPOINT_RETENTION_SECONDS = float(os.environ.get("CHECKPOINT_RETENTION_SECONDS", 24 * 60 * 60))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    key TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+def content_hash(data):
+    """PDF などのバイト列の SHA-256 を返す"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class CheckpointStore:
+    """Notion 保存処理の途中経過（file_upload_id, page_id, 追加済みバッチ数など）を記録する
+
+    失敗後のリトライでは完了済みのステップを飛ばして、最初の未完了ステップから再開する。
+    作成から retention 秒を過ぎたチェックポイントは、開いたときと書き込むときに削除する。
+    """
+
+    def __init__(self, path=None, retention=CHECKPOINT_RETENTION_SECONDS, clock=time.time):
+        self.path = path or state_path("checkpoints.sqlite3")
+        self.retention = retention
+        self._clock = clock
+        with connect(self.path) as conn:
+            conn.execute(_SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(checkpoints)")}
+            if "created_at" not in columns:
+                # 以前のスキーマのファイル: 作成時刻は最後の更新時刻で代用する
+                conn.execute("ALTER TABLE checkpoints ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+                conn.execute("UPDATE checkpoints SET created_at = updated_at")
+            self._prune(conn)
+
+    def _prune(self, conn):
+        conn.execute("DELETE FROM checkpoints WHERE created_at < ?", (self._clock() - self.retention,))
+
+    def get(self, key):
+        """チェックポイントを dict で返す（なければ空の dict）"""
+        with connect(self.path) as conn:
+            row = conn.execute("SELECT data FROM checkpoints WHERE key = ?", (key,)).fetchone()
+        get_metrics_registry().inc("cache_lookups_total", cache="checkpoint", result="hit" if row else "miss")
+        return json.loads(row[0]) if row else {}
+
+    def update(self, key, **fields):
+        """チェックポイントにフィールドを追記して保存"""
+        with connect(self.path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._prune(conn)
+            row = conn.execute("SELECT data, created_at FROM checkpoints WHERE key = ?", (key,)).fetchone()
+            data = json.loads(row[0]) if row else {}
+            data.update(fields)
+            now = self._clock()
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (key, data, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(data, ensure_ascii=False), row[1] if row else now, now),
+            )
+            conn.execute("COMMIT")
+        return data
+
+    def clear(self, key):
+        """処理完了後にチェックポイントを削除"""
+        with connect(self.path) as conn:
+            conn.execute("DELETE FROM checkpoints WHERE key = ?", (key,))
+
+
+def reusable_file_upload_id(checkpoint, now=None):
+    """チェックポイントの file_upload_id がまだ添付可能なら返す"""
+    file_upload_id = checkpoint.get("file_upload_id")
+    uploaded_at = checkpoint.get("file_uploaded_at", 0)
+    if file_upload_id and (now or time.time()) - uploaded_at < FILE_UPLOAD_REUSE_SECONDS:
+        return file_upload_id
+    return None
+
+
+@lazy_singleton
+def get_checkpoint_store():
+    """プロセス共有のチェックポイントストアを返す"""
+    return CheckpointStore()
@@ -0,0 +1,81 @@
+import contextvars
+import math
+import os
+import time
+from contextlib import contextmanager
+
+# リクエストの処理時間の上限（サーバーレス関数のタイムアウト対策）
+#
+# - ハンドラーはリクエストの最初に Deadline を作り、deadline_scope で現在のスレッド（コンテキスト）に設定する
+# - Notion の呼び出し（notion_rate_limit.call_with_limits）は呼び出しの前に残り時間を確認し、
+#   HTTP のタイムアウトを残り時間に合わせて短くする。足りなければ DeadlineExceeded を送出する
+# - Notion への保存が間に合わない場合、ハンドラーは残りをジョブに回し、解析結果だけを先に返す
+#   （途中までの保存はチェックポイントに記録されているため、ジョブはその続きから再開する）
+
+# 1 リクエストの処理時間の上限（秒）。Vercel では関数のタイムアウト（10 秒）、それ以外では 0（上限なし）
+REQUEST_TIME_BUDGET_SECONDS = float(os.environ.get(
+    "REQUEST_TIME_BUDGET_SECONDS", 10 if os.environ.get("VERCEL") else 0))
+
+# 上限のうち、レスポンスの送信とジョブの登録のために残しておく秒数
+DEADLINE_RESERVE_SECONDS = float(os.environ.get("DEADLINE_RESERVE_SECONDS", 1.5))
+
+# 残り時間がこれより短ければ Notion の呼び出しを始めない（秒）
+NOTION_MIN_CALL_SECONDS = float(os.environ.get("NOTION_MIN_CALL_SECONDS", 1.0))
+
+
+class DeadlineExceeded(Exception):
+    """残り時間が足りないため処理を打ち切った（504）"""
+
+    status = 504
+
+
+class Deadline:
+    """処理を終えるべき時刻（budget が 0 または None なら上限なし）"""
+
+    def __init__(self, budget=None, reserve=DEADLINE_RESERVE_SECONDS, clock=time.monotonic):
+        self._clock = clock
+        self.limited = bool(budget)
+        self.expires_at = clock() + budget - reserve if self.limited else math.inf
+
+    def remaining(self):
+        """残り秒数（上限なしなら inf）"""
+        return max(0.0, self.expires_at - self._clock())
+
+    def check(self, needed=0.0, stage="request"):
+        """残り時間が needed 秒より短ければ DeadlineExceeded を送出する"""
+        remaining = self.remaining()
+        if remaining < needed:
+            raise DeadlineExceeded(
+                f"Time budget exhausted before {stage} ({remaining:.2f}s left, {needed:.2f}s needed)")
+
+    def timeout(self, default=None):
+        """1 回の HTTP 呼び出しのタイムアウト（default と残り時間の短い方。上限なしなら default）"""
+        if not self.limited:
+            return default
+        remaining = self.remaining()
+        return remaining if default is None else min(default, remaining)
+
+
+UNLIMITED = Deadline()
+
+_current = contextvars.ContextVar("deadline", default=UNLIMITED)
+
+
+def request_deadline(budget=None, clock=time.monotonic):
+    """リクエストの Deadline を作る（budget を省略すると REQUEST_TIME_BUDGET_SECONDS）"""
+    return Deadline(REQUEST_TIME_BUDGET_SECONDS if budget is None else budget, clock=clock)
+
+
+def current_deadline():
+    """deadline_scope で設定された Deadline（設定されていなければ上限なし）"""
+    return _current.get()
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """with の中の処理（Notion の呼び出し）に deadline を適用する"""
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
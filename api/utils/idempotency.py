@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .local_state import connect, lazy_singleton, state_path
+from .metrics import get_metrics_registry
+
+# 同じアップロードの重複実行を防ぐ（ダブルクリック・不安定な回線での再送）
+#
+# - 同じキーのリクエストが同時に来たら、最初の 1 件だけが処理し、残りはその結果を待って共有する（single-flight）
+# - 成功した結果は短時間保存し、同じキーの再送には処理をやり直さずに保存した結果を返す（replay）
+# - キーは Idempotency-Key ヘッダ。なければリクエストの内容（PDF のハッシュ・既存ページID・モード）から作る
+
+# 結果を保存しておく秒数（0 で保存しない。同時実行の共有だけ行う）
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 600))
+
+# 処理中の同じキーのリクエストを待つ上限（秒）
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", 120))
+
+# Idempotency-Key ヘッダの長さの上限
+MAX_KEY_LENGTH = 255
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    stored_at REAL NOT NULL
+)
+"""
+
+
+class IdempotencyConflict(Exception):
+    """同じ Idempotency-Key で内容の違うリクエストが来た（422）"""
+
+    status = 422
+
+
+class IdempotencyInProgress(Exception):
+    """同じキーのリクエストが処理中のまま待ち時間を超えた（409）"""
+
+    status = 409
+
+
+def request_fingerprint(*parts):
+    """リクエストの内容のハッシュ（bytes / memoryview / str / None を順に連結）"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            part = b""
+        elif isinstance(part, str):
+            part = part.encode()
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def idempotency_key(headers, fingerprint):
+    """Idempotency-Key ヘッダ（なければ fingerprint）を返す"""
+    key = (headers.get("Idempotency-Key") or "").strip()
+    if not key:
+        return fingerprint
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"Idempotency-Key is too long (max {MAX_KEY_LENGTH})")
+    return "key:" + key
+
+
+class _Flight:
+    """処理中のリクエスト 1 件（同じキーの後続リクエストはこれを待つ）"""
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class IdempotencyStore:
+    """キー → 完了したレスポンス（status, body）の短期保存と、処理中のリクエストの共有
+
+    保存先は NIKKEIHYOU_STATE_DIR の idempotency.sqlite3（同じマシンのプロセス間でも再送を検出できる）。
+    処理中のリクエストの共有はプロセス内のみ。
+    """
+
+    def __init__(self, path=None, ttl=IDEMPOTENCY_TTL_SECONDS, wait_seconds=IDEMPOTENCY_WAIT_SECONDS,
+                 clock=time.time):
+        self.path = path or state_path("idempotency.sqlite3")
+        self.ttl = ttl
+        self.wait_seconds = wait_seconds
+        self._clock = clock
+        self._flights = {}
+        self._lock = threading.Lock()
+        with connect(self.path) as conn:
+            conn.execute(_SCHEMA)
+
+    def get(self, key, fingerprint):
+        """保存済みの (status, body) を返す（なければ None）
+
+        同じキーで内容の違うリクエストなら IdempotencyConflict。
+        """
+        with connect(self.path) as conn:
+            conn.execute("DELETE FROM responses WHERE stored_at < ?", (self._clock() - self.ttl,))
+            row = conn.execute(
+                "SELECT fingerprint, status, body FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        _check_fingerprint(row[0], fingerprint)
+        return row[1], json.loads(row[2])
+
+    def put(self, key, fingerprint, status, body):
+        if self.ttl <= 0:
+            return
+        with connect(self.path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, fingerprint, status, body, stored_at) VALUES (?, ?, ?, ?, ?)",
+                (key, fingerprint, status, json.dumps(body, ensure_ascii=False), self._clock()),
+            )
+
+    def begin(self, key, fingerprint):
+        """処理を始める前に呼ぶ
+
+        保存済み、または同時に処理中だったリクエストの結果があれば ((status, body), None) を、
+        このリクエストが処理する番なら (None, flight) を返す。flight は必ず finish に渡すこと。
+        """
+        replay = self.get(key, fingerprint)
+        if replay is not None:
+            _record("replayed")
+            return replay, None
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(fingerprint)
+        if leader:
+            # get の後に別のリクエストが完了していた場合
+            replay = self.get(key, fingerprint)
+            if replay is not None:
+                self._release(key, flight, replay, None)
+                _record("replayed")
+                return replay, None
+            _record("computed")
+            return None, flight
+
+        _check_fingerprint(flight.fingerprint, fingerprint)
+        if not flight.done.wait(self.wait_seconds):
+            raise IdempotencyInProgress("A request with the same Idempotency-Key is still in progress")
+        if flight.error is not None:
+            raise flight.error
+        _record("coalesced")
+        return flight.result, None
+
+    def finish(self, key, flight, result=None, error=None):
+        """begin で処理する番になったリクエストの結果 (status, body) を記録し、待っているリクエストに渡す
+
+        2xx のレスポンスだけ保存する（失敗したリクエストは再送でやり直せるように）。
+        """
+        try:
+            if result is not None and 200 <= result[0] < 300:
+                self.put(key, flight.fingerprint, *result)
+        finally:
+            self._release(key, flight, result, error)
+
+    def _release(self, key, flight, result, error):
+        flight.result = result
+        flight.error = error
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.done.set()
+
+    def run(self, key, fingerprint, compute):
+        """compute() -> (status, body) を同じキーにつき 1 回だけ実行する
+
+        (status, body, replayed) を返す。replayed は別のリクエストの結果を返した場合 True。
+        """
+        replay, flight = self.begin(key, fingerprint)
+        if flight is None:
+            return (*replay, True)
+        try:
+            result = compute()
+        except Exception as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result)
+        return (*result, False)
+
+
+def _check_fingerprint(stored, fingerprint):
+    if stored != fingerprint:
+        raise IdempotencyConflict("Idempotency-Key was already used for a different request")
+
+
+def _record(result):
+    get_metrics_registry().inc("idempotent_requests_total", result=result)
+
+
+@lazy_singleton
+def get_idempotency_store():
+    """プロセス共有のストアを返す"""
+    return IdempotencyStore()
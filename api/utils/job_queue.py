@@ -0,0 +1,275 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+from .local_state import connect, lazy_singleton, state_path
+from .metrics import get_metrics_registry
+
+# ジョブの状態
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+DEFAULT_MAX_ATTEMPTS = 3
+
+# 実行中のジョブのリース（秒）。ワーカーは実行中にリースを延長し続け、
+# 期限が切れた running のジョブ（プロセスが落ちた）だけを他のワーカーが引き取る
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", 60))
+
+# 失敗したジョブを再実行するまでの待ち時間（秒）。試行ごとに 2 倍にする
+JOB_RETRY_DELAY_SECONDS = float(os.environ.get("JOB_RETRY_DELAY_SECONDS", 5))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    blob BLOB,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease_expires_at REAL,
+    not_before REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+# 以前のスキーマのキューファイルに追加する列
+_ADDED_COLUMNS = {
+    "owner": "TEXT",
+    "lease_expires_at": "REAL",
+    "not_before": "REAL NOT NULL DEFAULT 0",
+}
+
+
+class JobQueue:
+    """SQLite に永続化するバックグラウンドジョブキュー
+
+    ジョブは enqueue した時点でディスクに書かれるため、プロセスが再起動しても
+    未完了のジョブは次回起動時に再開される。ワーカーはスレッドで動作する。
+    実行中のジョブには実行者（owner）とリースを記録し、リースが切れたジョブだけを引き取る。
+    """
+
+    def __init__(self, path=None, workers=2, poll_interval=0.5, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 lease_seconds=JOB_LEASE_SECONDS, retry_delay=JOB_RETRY_DELAY_SECONDS, clock=time.time):
+        self.path = path or state_path("jobs.sqlite3")
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.retry_delay = retry_delay
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._clock = clock
+        self._handlers = {}
+        self._threads = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+
+        with connect(self.path, row_factory=sqlite3.Row) as conn:
+            conn.execute(_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, definition in _ADDED_COLUMNS.items():
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+
+    def register(self, kind, func):
+        """ジョブ種別ごとの処理関数を登録（func(payload, blob) -> dict）"""
+        self._handlers[kind] = func
+
+    def enqueue(self, kind, payload, blob=None):
+        """ジョブを登録して job_id を返す"""
+        job_id = uuid.uuid4().hex
+        now = self._clock()
+        with connect(self.path, row_factory=sqlite3.Row) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, blob, status, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload, ensure_ascii=False), blob, QUEUED, now, now),
+            )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """ジョブの状態を dict で返す（存在しない場合は None）"""
+        with connect(self.path, row_factory=sqlite3.Row) as conn:
+            row = conn.execute(
+                "SELECT id, kind, status, result, error, attempts, owner, lease_expires_at, not_before,"
+                " created_at, updated_at"
+                " FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def _claim(self):
+        """次に実行できるジョブを排他的に取得して running にする
+
+        対象は待ち時間（not_before）を過ぎた待機中のジョブと、リースが切れた実行中のジョブ。
+        リースが切れたジョブが試行回数を使い切っていれば failed にする。
+        """
+        with connect(self.path, row_factory=sqlite3.Row) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    now = self._clock()
+                    row = conn.execute(
+                        "SELECT * FROM jobs"
+                        " WHERE (status = ? AND not_before <= ?) OR (status = ? AND COALESCE(lease_expires_at, 0) < ?)"
+                        " ORDER BY created_at LIMIT 1",
+                        (QUEUED, now, RUNNING, now),
+                    ).fetchone()
+                    if row is None:
+                        break
+                    if row["status"] == RUNNING:
+                        print(f"[Job] {row['kind']} {row['id']} lease of {row['owner']} expired")
+                        if row["attempts"] >= self.max_attempts:
+                            conn.execute(
+                                "UPDATE jobs SET status = ?, error = ?, owner = NULL, lease_expires_at = NULL,"
+                                " updated_at = ? WHERE id = ?",
+                                (FAILED, "Worker stopped while running the job", now, row["id"]),
+                            )
+                            continue
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, owner = ?, lease_expires_at = ?,"
+                        " updated_at = ? WHERE id = ?",
+                        (RUNNING, self.owner, now + self.lease_seconds, now, row["id"]),
+                    )
+                    break
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def _renew_lease(self, job_id):
+        """実行中のジョブのリースを延長（他のワーカーに引き取られていれば False）"""
+        now = self._clock()
+        with connect(self.path, row_factory=sqlite3.Row) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires_at = ?, updated_at = ? WHERE id = ? AND owner = ? AND status = ?",
+                (now + self.lease_seconds, now, job_id, self.owner, RUNNING),
+            )
+        return cursor.rowcount == 1
+
+    def _heartbeat(self, job_id, finished):
+        # ジョブの実行中、リースの 1/3 ごとにリースを延長する
+        while not finished.wait(self.lease_seconds / 3):
+            try:
+                if not self._renew_lease(job_id):
+                    return
+            except Exception as e:
+                print(f"[Job] Failed to renew the lease of {job_id}: {e}")
+
+    def _finish(self, job_id, status, result=None, error=None, not_before=0):
+        # 完了したジョブの添付データ（PDF など）は不要になるので削除
+        clear_blob = ", blob = NULL" if status == DONE else ""
+        with connect(self.path, row_factory=sqlite3.Row) as conn:
+            # リースが切れて他のワーカーに引き取られたジョブは上書きしない
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, owner = NULL, lease_expires_at = NULL,"
+                f" not_before = ?, updated_at = ?{clear_blob} WHERE id = ? AND owner = ?",
+                (
+                    status,
+                    json.dumps(result, ensure_ascii=False) if result is not None else None,
+                    error,
+                    not_before,
+                    self._clock(),
+                    job_id,
+                    self.owner,
+                ),
+            )
+
+    def run_next(self):
+        """待機中のジョブを 1 件処理する。処理したら True を返す"""
+        row = self._claim()
+        if row is None:
+            return False
+
+        job_id = row["id"]
+        attempts = row["attempts"] + 1
+        handler = self._handlers.get(row["kind"])
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, finished), daemon=True)
+        heartbeat.start()
+        try:
+            if handler is None:
+                raise Exception(f"No handler registered for job kind: {row['kind']}")
+            result = handler(json.loads(row["payload"]), row["blob"])
+            self._finish(job_id, DONE, result=result)
+            get_metrics_registry().inc("jobs_total", kind=row["kind"], result=DONE)
+            print(f"[Job] {row['kind']} {job_id} completed")
+        except Exception as e:
+            traceback.print_exc()
+            if attempts < self.max_attempts:
+                delay = self.retry_delay * 2 ** (attempts - 1)
+                self._finish(job_id, QUEUED, error=str(e), not_before=self._clock() + delay)
+                get_metrics_registry().inc("jobs_total", kind=row["kind"], result="retry")
+                print(f"[Job] {row['kind']} {job_id} failed ({attempts}/{self.max_attempts}), retry in {delay:.0f}s: {e}")
+            else:
+                self._finish(job_id, FAILED, error=str(e))
+                get_metrics_registry().inc("jobs_total", kind=row["kind"], result=FAILED)
+                print(f"[Job] {row['kind']} {job_id} failed ({attempts}/{self.max_attempts}): {e}")
+        finally:
+            finished.set()
+            heartbeat.join()
+        return True
+
+    def recover(self):
+        """リースが切れた実行中のジョブ（実行していたプロセスが止まった）を待機中に戻す
+
+        他のプロセスが実行中のジョブ（リースが有効）はそのままにする。
+        """
+        now = self._clock()
+        with connect(self.path, row_factory=sqlite3.Row) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, lease_expires_at = NULL, updated_at = ?"
+                " WHERE status = ? AND COALESCE(lease_expires_at, 0) < ? AND attempts < ?",
+                (QUEUED, now, RUNNING, now, self.max_attempts),
+            )
+
+    def start(self):
+        """ワーカースレッドを起動（起動済みなら何もしない）"""
+        if self._threads:
+            return
+        self.recover()
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        """ワーカースレッドを停止"""
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_next():
+                    continue
+            except Exception as e:
+                print(f"[Job] Worker error: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+
+@lazy_singleton
+def get_job_queue():
+    """プロセス共有のジョブキューを返す"""
+    return JobQueue()
@@ -0,0 +1,108 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+from .app_core import ApiRequest, find_endpoint, send_api_response
+
+# オンプレミス（Vercel が使えないとき）用の並行サーバー
+#
+# - 接続は固定サイズのスレッドプールで処理する（遅い PDF 解析や Notion 呼び出しが
+#   他の医院のアップロードや public/ の静的ファイルを待たせない）
+# - ワーカーがすべて使用中なら次の接続の受け付けを待つ。待っている接続はプールのキューではなく
+#   カーネルの listen キュー（request_queue_size）に溜まるので、負荷が続いてもメモリが増え続けない
+# - HTTP/1.1 keep-alive。アイドルな接続がワーカーを占有し続けないよう一定時間で切断する
+# - /api/<name> は api/<name>.py の ENDPOINT で処理する（Vercel と同じコード）
+
+LOCAL_SERVER_WORKERS = int(os.environ.get("LOCAL_SERVER_WORKERS", 8))
+KEEPALIVE_SECONDS = float(os.environ.get("LOCAL_SERVER_KEEPALIVE_SECONDS", 5))
+
+PUBLIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "public")
+
+
+class PooledHTTPServer(HTTPServer):
+    """接続を固定サイズのスレッドプールで処理する HTTPServer
+
+    ThreadingHTTPServer は接続ごとにスレッドを作り上限がないため、ワーカー数を決められるようにする。
+    """
+
+    request_queue_size = 64
+
+    def __init__(self, server_address, handler_class, workers=LOCAL_SERVER_WORKERS):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http-worker")
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            self._pool.submit(self._process_request, request, client_address)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class LocalServerHandler(SimpleHTTPRequestHandler):
+    """public/ の静的ファイルと api/ のハンドラを 1 つのポートで提供する"""
+
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_SECONDS
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=PUBLIC_DIR, **kwargs)
+
+    def do_GET(self):
+        if not self._dispatch("GET"):
+            super().do_GET()
+
+    def do_HEAD(self):
+        if not self._dispatch("HEAD"):
+            super().do_HEAD()
+
+    def do_POST(self):
+        if not self._dispatch("POST"):
+            self._reject(404, "Not Found")
+
+    def do_OPTIONS(self):
+        if not self._dispatch("OPTIONS"):
+            self._reject(404, "Not Found")
+
+    def _dispatch(self, method):
+        """API のパスなら api/ の Endpoint で処理して True を返す"""
+        endpoint = find_endpoint(self.path, local=True)
+        if endpoint is None:
+            return False
+
+        response = endpoint.handle(ApiRequest(method, self.path, self.headers, self.rfile))
+        send_api_response(self, response)
+        if response.close:
+            self.close_connection = True
+        return True
+
+    def _reject(self, status, message):
+        # 読まなかったリクエストボディが次のリクエストと混ざらないよう、接続を閉じる
+        self.close_connection = True
+        self.send_error(status, message)
+
+
+def serve(host="localhost", port=8000, workers=LOCAL_SERVER_WORKERS):
+    """並行サーバーを起動する（Ctrl+C まで戻らない）"""
+    server = PooledHTTPServer((host, port), LocalServerHandler, workers=workers)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,51 @@
+import functools
+import os
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# ジョブキューやキャッシュなどのローカル状態を置くディレクトリ
+# Vercel では /tmp のみ書き込み可能なため、デフォルトは一時ディレクトリ配下
+STATE_DIR_ENV = "NIKKEIHYOU_STATE_DIR"
+
+
+def state_path(filename):
+    """ローカル状態ファイルのパスを返す（ディレクトリは必要に応じて作成）"""
+    directory = os.environ.get(STATE_DIR_ENV) or os.path.join(tempfile.gettempdir(), "nikkeihyou")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, filename)
+
+
+@contextmanager
+def connect(path, row_factory=None):
+    """ローカル状態の SQLite に接続する（autocommit。トランザクションは各ストアが明示する）"""
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    if row_factory is not None:
+        conn.row_factory = row_factory
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+class lazy_singleton:
+    """最初の呼び出しで factory の戻り値を作り、以後はプロセス内で同じものを返す
+
+    テストは instance を差し替える（None に戻すと次の呼び出しで作り直す）。
+    """
+
+    def __init__(self, factory):
+        functools.update_wrapper(self, factory)
+        self._factory = factory
+        self._lock = threading.Lock()
+        self.instance = None
+
+    def __call__(self, *args, **kwargs):
+        instance = self.instance
+        if instance is not None:
+            return instance
+        with self._lock:
+            if self.instance is None:
+                self.instance = self._factory(*args, **kwargs)
+            return self.instance
@@ -0,0 +1,203 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from .local_state import lazy_singleton
+
+# プロセス内のメトリクス（カウンターとレイテンシのヒストグラム）
+#
+# - 記録はスレッドごとの shard（dict）に書くだけでロックを取らない。
+#   ロックは新しいスレッドが最初に記録するときと、snapshot で shard を集めるときだけ
+# - 終了したスレッドの shard は、そのとき（新しいスレッドの登録時・snapshot 時）に共有の shard へまとめて外す。
+#   リクエストごとのスレッドプールが作るスレッドの数だけ shard が増え続けることはない
+# - ローカルサーバーでは /api/metrics（utils/metrics_api.py）で Prometheus のテキスト形式を返す
+# - サーバーレス（Vercel）では METRICS_LOG=1 にすると、呼び出しごとの値を JSON で 1 行ログに出す
+# - PDF 解析をプロセスプールで実行した場合、子プロセスで記録した値（parse_stage_seconds）は集計されない
+
+# ヒストグラムのバケット（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRICS_LOG = os.environ.get("METRICS_LOG", "") not in ("", "0")
+
+# メトリクス名 -> (種類, 説明)
+METRICS = {
+    "api_requests_total": ("counter", "API リクエスト数"),
+    "api_request_seconds": ("histogram", "API リクエストの処理時間（ストリーミングは最初の行まで）"),
+    "parse_stage_seconds": ("histogram", "PDF 解析の段階ごとの所要時間"),
+    "notion_requests_total": ("counter", "Notion API の呼び出し数（リトライを含まない）"),
+    "notion_request_seconds": ("histogram", "Notion API の呼び出しの所要時間（レート制限の待ちとリトライを含む）"),
+    "notion_rate_limit_wait_seconds": ("histogram", "レート制限による送信待ち時間"),
+    "notion_retries_total": ("counter", "Notion API のリトライ回数"),
+    "cache_lookups_total": ("counter", "ローカルキャッシュの参照数（result=hit/miss）"),
+    "jobs_total": ("counter", "バックグラウンドジョブの実行数（result=done/retry/failed）"),
+    "idempotent_requests_total": ("counter", "重複を判定したアップロード数（result=computed/coalesced/replayed）"),
+}
+
+
+class MetricsRegistry:
+    """カウンターとヒストグラムの集計
+
+    ラベルはキーワード引数で渡す（例: inc("cache_lookups_total", cache="upload", result="hit")）。
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        # [(スレッド, shard)]
+        self._shards = []
+        # 終了したスレッドの値をまとめた shard（_lock の中でだけ書き換える）
+        self._retired = ({}, {})
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        counters = self._shard()[0]
+        key = (name, tuple(sorted(labels.items())))
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        histograms = self._shard()[1]
+        key = (name, tuple(sorted(labels.items())))
+        values = histograms.get(key)
+        if values is None:
+            # [バケットごとの件数..., +Inf の件数, 合計秒数]
+            values = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        values[bisect.bisect_left(self.buckets, seconds)] += 1
+        values[-1] += seconds
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """with ブロックの所要時間をヒストグラムに記録する"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self, reset=False):
+        """全スレッドの値を合計して JSON にできる dict で返す
+
+        reset=True なら集計後に値を 0 に戻す（サーバーレスの呼び出しごとのログ用。
+        同時に記録中の値は失われることがある）。
+        """
+        total = ({}, {})
+        with self._lock:
+            self._retire_finished_threads()
+            _merge(total, self._retired)
+            if reset:
+                self._retired = ({}, {})
+            shards = [shard for _, shard in self._shards]
+        for shard_counters, shard_histograms in shards:
+            # dict.copy は GIL の下で一度に行われるため、記録中のスレッドと競合しない
+            copied = shard_counters.copy(), shard_histograms.copy()
+            if reset:
+                shard_counters.clear()
+                shard_histograms.clear()
+            _merge(total, copied)
+        counters, histograms = total
+
+        result = {"counters": {}, "histograms": {}}
+        for (name, labels), value in sorted(counters.items(), key=_sort_key):
+            result["counters"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+        for (name, labels), values in sorted(histograms.items(), key=_sort_key):
+            cumulative, buckets = 0, {}
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                buckets[format_number(bound)] = cumulative
+            result["histograms"].setdefault(name, []).append({
+                "labels": dict(labels),
+                "count": cumulative + values[-2],
+                "sum": round(values[-1], 6),
+                "buckets": buckets,
+            })
+        return result
+
+    def prometheus(self):
+        """Prometheus のテキスト形式（text/plain; version=0.0.4）"""
+        snapshot = self.snapshot()
+        lines = []
+        for name, series in snapshot["counters"].items():
+            lines += _metric_header(name, "counter")
+            for item in series:
+                lines.append(f"{name}{format_labels(item['labels'])} {format_number(item['value'])}")
+        for name, series in snapshot["histograms"].items():
+            lines += _metric_header(name, "histogram")
+            for item in series:
+                for bound, count in item["buckets"].items():
+                    lines.append(f"{name}_bucket{format_labels({**item['labels'], 'le': bound})} {count}")
+                lines.append(f"{name}_bucket{format_labels({**item['labels'], 'le': '+Inf'})} {item['count']}")
+                lines.append(f"{name}_sum{format_labels(item['labels'])} {format_number(item['sum'])}")
+                lines.append(f"{name}_count{format_labels(item['labels'])} {item['count']}")
+        return "\n".join(lines) + "\n"
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = ({}, {})
+            with self._lock:
+                self._retire_finished_threads()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_finished_threads(self):
+        """終了したスレッドの shard を _retired にまとめて外す（_lock を取ってから呼ぶ）"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                # 終了したスレッドはもう書き込まないため、そのまま足してよい
+                _merge(self._retired, shard)
+        self._shards = alive
+
+
+def _merge(target, shard):
+    """shard（counters, histograms）の値を target に足す"""
+    counters, histograms = target
+    for key, value in shard[0].items():
+        counters[key] = counters.get(key, 0) + value
+    for key, values in shard[1].items():
+        merged = histograms.setdefault(key, [0] * len(values[:-1]) + [0.0])
+        for i, value in enumerate(values):
+            merged[i] += value
+
+
+def _sort_key(item):
+    name, labels = item[0]
+    return name, [(key, str(value)) for key, value in labels]
+
+
+def _metric_header(name, default_kind):
+    kind, help_text = METRICS.get(name, (default_kind, ""))
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_number(value):
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+@lazy_singleton
+def get_metrics_registry():
+    """プロセス共有のメトリクスを返す"""
+    return MetricsRegistry()
+
+
+def log_snapshot():
+    """この呼び出しで記録した値を JSON で 1 行ログに出して 0 に戻す（METRICS_LOG=1 のとき）"""
+    if METRICS_LOG:
+        print("[Metrics] " + json.dumps(get_metrics_registry().snapshot(reset=True), ensure_ascii=False,
+                                         separators=(",", ":")))
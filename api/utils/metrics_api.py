@@ -0,0 +1,18 @@
+from .app_core import ApiResponse, Endpoint
+from .metrics import get_metrics_registry
+
+# GET /api/metrics（ローカルサーバー専用、app_core.LOCAL_API_ROUTES）
+#
+# Prometheus のテキスト形式で返す。?format=json なら MetricsRegistry.snapshot の JSON。
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def handle_metrics_request(request):
+    registry = get_metrics_registry()
+    if request.query.get("format") == "json":
+        return ApiResponse(200, registry.snapshot())
+    return ApiResponse(200, body=registry.prometheus().encode(), headers={"Content-Type": PROMETHEUS_CONTENT_TYPE})
+
+
+ENDPOINT = Endpoint({"GET": handle_metrics_request})
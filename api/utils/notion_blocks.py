@@ -0,0 +1,83 @@
+# Notion ブロックのテンプレート
+# ヘッダー行やラベルセルなど毎回同じになる部分はモジュール読み込み時に一度だけ作り、
+# ページ生成時は患者ごとに変わるセルだけを埋める。テンプレートの dict は
+# 複数のブロックから共有されるため、生成後のブロックを書き換えてはいけない。
+
+# 同じ文字列のセル（"¥0"、保険種別など）を共有するキャッシュの上限
+_CELL_CACHE_MAX = 4096
+_cell_cache = {}
+
+
+def text(content):
+    """rich_text の要素を 1 つ作る"""
+    return {"type": "text", "text": {"content": content}}
+
+
+def cell(content):
+    """テキスト 1 つだけのテーブルセル（同じ文字列のセルは共有する）"""
+    c = _cell_cache.get(content)
+    if c is None:
+        if len(_cell_cache) >= _CELL_CACHE_MAX:
+            _cell_cache.clear()
+        c = _cell_cache[content] = [text(content)]
+    return c
+
+
+def table_row(contents):
+    """文字列のリストから table_row を作る"""
+    return {"type": "table_row", "table_row": {"cells": [[text(c)] for c in contents]}}
+
+
+def heading(level, content):
+    return {
+        "object": "block",
+        "type": f"heading_{level}",
+        f"heading_{level}": {"rich_text": [text(content)]},
+    }
+
+
+def table(width, rows, has_column_header=True):
+    return {
+        "object": "block",
+        "type": "table",
+        "table": {
+            "table_width": width,
+            "has_column_header": has_column_header,
+            "children": rows,
+        },
+    }
+
+
+class RowTemplate:
+    """固定セルを事前に作っておき、可変セルだけを埋めて table_row を作る
+
+    labels: 列ごとの固定文字列。None の列が fill() の引数で埋まる。
+    """
+
+    def __init__(self, labels):
+        self._cells = [None if label is None else [text(label)] for label in labels]
+        self._slots = [i for i, label in enumerate(labels) if label is None]
+        self._all_slots = len(self._slots) == len(labels)
+
+    def fill(self, *values):
+        if self._all_slots:
+            cells = [cell(value) for value in values]
+        else:
+            cells = self._cells.copy()
+            for i, value in zip(self._slots, values):
+                cells[i] = cell(value)
+        return {"type": "table_row", "table_row": {"cells": cells}}
+
+
+def iter_child_blocks(notion, block_id):
+    """ブロック直下の子ブロックを順に返す（100件ごとのページネーションを辿る）"""
+    cursor = None
+    while True:
+        kwargs = {"block_id": block_id, "page_size": 100}
+        if cursor:
+            kwargs["start_cursor"] = cursor
+        response = notion.blocks.children.list(**kwargs)
+        yield from response["results"]
+        if not response.get("has_more"):
+            return
+        cursor = response["next_cursor"]
@@ -0,0 +1,256 @@
+import os
+import random
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+import httpx
+import requests
+from notion_client import Client
+from notion_client.errors import HTTPResponseError
+
+from .deadline import NOTION_MIN_CALL_SECONDS, DeadlineExceeded, current_deadline
+from .metrics import get_metrics_registry
+
+# Notion のレート制限は 1 インテグレーションあたり平均 3 リクエスト/秒
+NOTION_RATE_LIMIT = float(os.environ.get("NOTION_RATE_LIMIT", "3"))
+NOTION_RATE_BURST = int(os.environ.get("NOTION_RATE_BURST", "3"))
+NOTION_MAX_RETRIES = int(os.environ.get("NOTION_MAX_RETRIES", "5"))
+
+# リトライ対象のステータス（429 = レート制限、5xx = Notion 側の一時的な障害）
+#   5xx は Notion 側で処理が済んでから返ることがあるため、冪等な呼び出し（is_idempotent_call）だけリトライする
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# パス中のページ / ブロック / データソースなどの ID（メトリクスのラベルでは :id にまとめる）
+_NOTION_ID = re.compile(r"[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}")
+
+
+class TokenBucket:
+    """スレッドセーフなトークンバケット
+
+    トークンが足りない場合は「予約」として残量をマイナスにし、
+    ロックの外で待機する。待機中も他スレッドは順番に予約を積める。
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを 1 つ取得し、待機した秒数を返す"""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens / self.rate, self._paused_until - now)
+
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        """Retry-After を受け取ったとき、全スレッドの送信を一時停止する"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+
+class RetryPolicy:
+    """429 は Retry-After を優先し、5xx はジッター付き指数バックオフで待つ"""
+
+    def __init__(self, max_retries=NOTION_MAX_RETRIES, base_delay=0.5, max_delay=30.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay_for(self, attempt, status, headers=None, idempotent=True):
+        """リトライまでの待機秒数を返す（リトライしない場合は None）
+
+        idempotent=False の呼び出し（ページ作成など）は、処理されていない 429 だけリトライする。
+        """
+        if status not in RETRYABLE_STATUSES or attempt >= self.max_retries:
+            return None
+        if status != 429 and not idempotent:
+            return None
+
+        retry_after = parse_retry_after((headers or {}).get("Retry-After"))
+        if status == 429 and retry_after is not None:
+            return min(retry_after, self.max_delay)
+
+        # Full jitter: 0 〜 base * 2^attempt の一様乱数
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+def parse_retry_after(value):
+    """Retry-After ヘッダ（秒数）を float に変換。解釈できなければ None"""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+# プロセス全体で共有するリミッター / ポリシー
+bucket = TokenBucket(NOTION_RATE_LIMIT, NOTION_RATE_BURST)
+retry_policy = RetryPolicy()
+
+
+def notion_endpoint_label(method, path):
+    """メトリクス用の呼び出し種別（例: "PATCH pages/:id"）"""
+    segments = [":id" if _NOTION_ID.fullmatch(segment) else segment for segment in path.strip("/").split("/")]
+    return f"{method.upper()} {'/'.join(segments)}"
+
+
+def is_idempotent_call(endpoint):
+    """同じリクエストを繰り返しても結果が変わらない呼び出しか（endpoint は notion_endpoint_label）
+
+    POST のページ作成・ファイルアップロードと PATCH のブロック追加（.../children）は、Notion 側で処理された後に
+    5xx が返るとリトライでページやブロックが重複するため False。POST でも読み取りのクエリ・検索は True。
+    """
+    method, _, path = endpoint.partition(" ")
+    if method in ("GET", "HEAD", "DELETE"):
+        return True
+    if method == "PATCH":
+        return not path.endswith("/children")
+    if method == "POST":
+        return path == "search" or path.endswith("/query")
+    return False
+
+
+def call_with_limits(send, status_of, endpoint="other"):
+    """レート制限とリトライを適用して send() を実行する
+
+    send: 1 回分のリクエストを送信する関数
+    status_of: send の結果または例外から (status, headers) を取り出す関数。
+               リトライ判定が不要な場合は None を返す。
+    endpoint: メトリクスに記録する呼び出し種別（notion_endpoint_label）。5xx をリトライするかの判定にも使う
+
+    現在の Deadline（utils.deadline）の残り時間が足りなければ、送信やリトライの前に
+    DeadlineExceeded を送出する。残り時間がわずかな状態での通信エラー（タイムアウト）も同様。
+    """
+    registry = get_metrics_registry()
+    deadline = current_deadline()
+    idempotent = is_idempotent_call(endpoint)
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        _check_deadline(deadline, endpoint)
+        wait = bucket.acquire()
+        registry.observe("notion_rate_limit_wait_seconds", wait)
+        # レート制限で待っている間に残り時間が尽きることがある
+        _check_deadline(deadline, endpoint)
+        try:
+            result = send()
+            error = None
+        except Exception as e:
+            result = None
+            error = e
+
+        info = status_of(result if error is None else error)
+        delay = retry_policy.delay_for(attempt, *info, idempotent=idempotent) if info else None
+        if error is not None and info is None and deadline.remaining() < NOTION_MIN_CALL_SECONDS:
+            # 残り時間に合わせて短くしたタイムアウトで打ち切られた
+            registry.inc("notion_requests_total", endpoint=endpoint, outcome="deadline")
+            raise DeadlineExceeded(f"Notion request timed out near the deadline ({endpoint}): {error}") from error
+        if delay is None:
+            if info and info[0] >= 400:
+                outcome = str(info[0])
+            else:
+                outcome = "error" if error is not None else "ok"
+            registry.inc("notion_requests_total", endpoint=endpoint, outcome=outcome)
+            registry.observe("notion_request_seconds", time.perf_counter() - started, endpoint=endpoint)
+            if error is not None:
+                raise error
+            return result
+
+        status = info[0]
+        if deadline.remaining() < delay + NOTION_MIN_CALL_SECONDS:
+            registry.inc("notion_requests_total", endpoint=endpoint, outcome="deadline")
+            raise DeadlineExceeded(
+                f"Notion API returned {status}; no time left to retry ({endpoint})") from error
+        print(f"[WARNING] Notion API returned {status}. Retrying in {delay:.2f}s (attempt {attempt + 1})")
+        registry.inc("notion_retries_total", endpoint=endpoint, status=str(status))
+        if status == 429:
+            # 他スレッドも含めて送信を止める（次の acquire で待機する）
+            bucket.pause(delay)
+        else:
+            time.sleep(delay)
+        attempt += 1
+
+
+def _check_deadline(deadline, endpoint):
+    try:
+        deadline.check(NOTION_MIN_CALL_SECONDS, endpoint)
+    except DeadlineExceeded:
+        get_metrics_registry().inc("notion_requests_total", endpoint=endpoint, outcome="deadline")
+        raise
+
+
+def notion_request(method, url, **kwargs):
+    """requests.request をレート制限・リトライ付きで実行（File Upload API 用）
+
+    ファイルオブジェクトを送る場合、リトライ前に先頭へ巻き戻す。
+    タイムアウトは現在の Deadline の残り時間に合わせる。
+    """
+    deadline = current_deadline()
+    default_timeout = kwargs.pop("timeout", None)
+
+    def send():
+        for f in _file_objects(kwargs.get("files")):
+            f.seek(0)
+        return requests.request(method, url, timeout=deadline.timeout(default_timeout), **kwargs)
+
+    def status_of(resp):
+        if isinstance(resp, requests.Response):
+            return resp.status_code, resp.headers
+        return None
+
+    path = urlparse(url).path.split("/v1/", 1)[-1]
+    return call_with_limits(send, status_of, notion_endpoint_label(method, path))
+
+
+def _file_objects(files):
+    if not files:
+        return []
+    objs = []
+    for value in files.values():
+        f = value[1] if isinstance(value, tuple) else value
+        if hasattr(f, "seek"):
+            objs.append(f)
+    return objs
+
+
+class RateLimitedClient(Client):
+    """すべてのエンドポイント呼び出しにレート制限とリトライを適用する Notion クライアント
+
+    リクエストごとのタイムアウトは、現在の Deadline の残り時間に合わせて短くする。
+    """
+
+    def _build_request(self, method, path, query=None, body=None, auth=None):
+        request = super()._build_request(method, path, query, body, auth)
+        deadline = current_deadline()
+        if deadline.limited:
+            timeout = deadline.timeout(self.options.timeout_ms / 1000)
+            request.extensions["timeout"] = httpx.Timeout(timeout).as_dict()
+        return request
+
+    def request(self, path, method, query=None, body=None, auth=None):
+        def send():
+            return super(RateLimitedClient, self).request(path, method, query, body, auth)
+
+        def status_of(result):
+            if isinstance(result, HTTPResponseError):
+                return result.status, result.headers
+            return None
+
+        return call_with_limits(send, status_of, notion_endpoint_label(method, path))
@@ -1,6 +1,9 @@
 import os
 import io
-import requests
+import math
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # .envファイルを読み込む（ローカル開発時のみ）
 try:
@@ -10,46 +13,178 @@ except ImportError:
     # Vercel環境では不要（環境変数は自動的に設定される）
     pass
 
+from .deadline import current_deadline, deadline_scope
+from .notion_rate_limit import notion_request
+from .buffer_reader import BufferReader
+from .upload_cache import get_upload_cache
+
 NOTION_TOKEN = os.environ["NOTION_TOKEN"]
 # File Upload API は 2025-05-20 以降のバージョンが必要
 NOTION_VERSION = "2025-09-03"
+NOTION_API_BASE = "https://api.notion.com/v1"
+
+# single_part で送れる上限（これを超えると multi_part を使う）
+SINGLE_PART_MAX_BYTES = 20 * 1024 * 1024
+# multi_part の 1 パートのサイズ（Notion の制約: 最後以外は 5〜20MB）
+MULTI_PART_CHUNK_BYTES = int(os.environ.get("NOTION_UPLOAD_PART_BYTES", 10 * 1024 * 1024))
+# 並列に送信するパート数（実際の送信ペースは共有レートリミッターに従う）
+MULTI_PART_CONCURRENCY = int(os.environ.get("NOTION_UPLOAD_CONCURRENCY", "3"))
+
+
+def upload_file_to_notion(file_data, filename: str, content_type: str, reuse: bool = True) -> str:
+    """Notion File Upload API でファイルをアップロードし file_upload_id を返す
 
+    file_data には bytes / bytearray / memoryview、ファイルパス、
+    またはシーク可能なファイルオブジェクトを渡せる。
+    サイズが SINGLE_PART_MAX_BYTES を超える場合は multi_part モードで分割送信する。
+    reuse=True の場合、同じ内容のファイルが添付期限内にアップロード済みならその ID を返す。
+    """
+    source = UploadSource(file_data)
+
+    digest = source.sha256() if reuse else None
+    if digest:
+        cached_id = get_upload_cache().get(digest, content_type)
+        if cached_id:
+            print(f"[DEBUG] Reusing uploaded file: {filename} (File ID: {cached_id})")
+            return cached_id
+
+    if source.size > SINGLE_PART_MAX_BYTES:
+        file_upload_id = _upload_multi_part(source, filename, content_type)
+    else:
+        file_upload_id = _upload_single_part(source, filename, content_type)
+
+    if digest:
+        get_upload_cache().put(digest, content_type, file_upload_id)
+    return file_upload_id
 
-def upload_file_to_notion(file_bytes: bytes, filename: str, content_type: str) -> str:
-    """Notion File Upload API でファイルをアップロードし file_upload_id を返す"""
 
-    headers_base = {
+def _headers():
+    return {
         "Authorization": f"Bearer {NOTION_TOKEN}",
         "Notion-Version": NOTION_VERSION,
     }
 
-    # Step 1: File Upload オブジェクト作成
-    create_resp = requests.post(
-        "https://api.notion.com/v1/file_uploads",
-        headers={**headers_base, "Content-Type": "application/json"},
-        json={
-            "filename": filename,
-            "content_type": content_type,
-        },
+
+def _create_file_upload(body):
+    """Step 1: File Upload オブジェクト作成"""
+    create_resp = notion_request(
+        "post",
+        f"{NOTION_API_BASE}/file_uploads",
+        headers={**_headers(), "Content-Type": "application/json"},
+        json=body,
     )
     if create_resp.status_code != 200:
         raise Exception(
             f"File upload creation failed ({create_resp.status_code}): {create_resp.text}"
         )
+    return create_resp.json()["id"]
 
-    file_upload_id = create_resp.json()["id"]
 
-    # Step 2: ファイル本体を送信
-    send_resp = requests.post(
-        f"https://api.notion.com/v1/file_uploads/{file_upload_id}/send",
-        headers=headers_base,
+def _send_part(file_upload_id, filename, content_type, fileobj, part_number=None):
+    """Step 2: ファイル本体（または 1 パート）を送信"""
+    send_resp = notion_request(
+        "post",
+        f"{NOTION_API_BASE}/file_uploads/{file_upload_id}/send",
+        headers=_headers(),
         files={
-            "file": (filename, io.BytesIO(file_bytes), content_type),
+            "file": (filename, fileobj, content_type),
         },
+        data={"part_number": str(part_number)} if part_number is not None else None,
     )
     if send_resp.status_code != 200:
+        label = f"Part {part_number} send" if part_number is not None else "File send"
         raise Exception(
-            f"File send failed ({send_resp.status_code}): {send_resp.text}"
+            f"{label} failed ({send_resp.status_code}): {send_resp.text}"
         )
 
+
+def _upload_single_part(source, filename, content_type):
+    file_upload_id = _create_file_upload({
+        "filename": filename,
+        "content_type": content_type,
+    })
+    _send_part(file_upload_id, filename, content_type, source.open_range(0, source.size))
     return file_upload_id
+
+
+def _upload_multi_part(source, filename, content_type):
+    number_of_parts = math.ceil(source.size / MULTI_PART_CHUNK_BYTES)
+    print(f"[DEBUG] Multi-part upload: {filename} ({source.size} bytes, {number_of_parts} parts)")
+
+    file_upload_id = _create_file_upload({
+        "mode": "multi_part",
+        "number_of_parts": number_of_parts,
+        "filename": filename,
+        "content_type": content_type,
+    })
+
+    # 送信スレッドにも呼び出し元のリクエストの Deadline を引き継ぐ
+    deadline = current_deadline()
+
+    def send(part_number):
+        offset = (part_number - 1) * MULTI_PART_CHUNK_BYTES
+        length = min(MULTI_PART_CHUNK_BYTES, source.size - offset)
+        with deadline_scope(deadline):
+            _send_part(file_upload_id, filename, content_type, source.open_range(offset, length), part_number)
+
+    with ThreadPoolExecutor(max_workers=MULTI_PART_CONCURRENCY) as pool:
+        # list() で例外を呼び出し元に伝える
+        list(pool.map(send, range(1, number_of_parts + 1)))
+
+    # Step 3: 全パート送信後に完了を通知
+    complete_resp = notion_request(
+        "post",
+        f"{NOTION_API_BASE}/file_uploads/{file_upload_id}/complete",
+        headers={**_headers(), "Content-Type": "application/json"},
+        json={},
+    )
+    if complete_resp.status_code != 200:
+        raise Exception(
+            f"File upload completion failed ({complete_resp.status_code}): {complete_resp.text}"
+        )
+    return file_upload_id
+
+
+class UploadSource:
+    """アップロード対象のデータを範囲ごとに読み出す
+
+    bytes 系はコピーせず memoryview のスライスで、ファイルは必要な範囲だけを読み出す。
+    """
+
+    def __init__(self, data):
+        self._path = None
+        self._file = None
+        self._view = None
+        self._lock = threading.Lock()
+
+        if isinstance(data, (str, os.PathLike)):
+            self._path = os.fspath(data)
+            self.size = os.path.getsize(self._path)
+        elif hasattr(data, "read"):
+            self._file = data
+            self._file.seek(0, io.SEEK_END)
+            self.size = self._file.tell()
+        else:
+            self._view = memoryview(data).cast("B")
+            self.size = self._view.nbytes
+
+    def sha256(self, chunk_size=1024 * 1024):
+        """内容の SHA-256（ファイルは範囲ごとに読み出して計算）"""
+        if self._view is not None:
+            return hashlib.sha256(self._view).hexdigest()
+        digest = hashlib.sha256()
+        for offset in range(0, self.size, chunk_size):
+            digest.update(self.open_range(offset, min(chunk_size, self.size - offset)).read())
+        return digest.hexdigest()
+
+    def open_range(self, offset, length):
+        """offset から length バイトを読み出すファイルオブジェクトを返す"""
+        if self._view is not None:
+            return BufferReader(self._view[offset:offset + length])
+        if self._path is not None:
+            with open(self._path, "rb") as f:
+                f.seek(offset)
+                return io.BytesIO(f.read(length))
+        with self._lock:
+            self._file.seek(offset)
+            return io.BytesIO(self._file.read(length))
@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+
+from .local_state import connect, lazy_singleton, state_path
+from .metrics import get_metrics_registry
+
+# 索引を Notion から作り直す間隔（秒）。この間に他の経路で作られたページは
+# 索引に載らないため、Notion 側で直接ページを作る運用なら短くする。
+PAGE_INDEX_REFRESH_SECONDS = int(os.environ.get("NOTION_PAGE_INDEX_REFRESH_SECONDS", 6 * 60 * 60))
+
+# 日計表データベースの日付プロパティ
+DATE_PROPERTY = "日付"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    date TEXT PRIMARY KEY,
+    page_id TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+
+class PageIndex:
+    """日付 → 日計表ページ ID の索引（メモリ + SQLite）
+
+    初回（と PAGE_INDEX_REFRESH_SECONDS ごと）に日付プロパティで絞り込んだ
+    データソースクエリで索引を作り、以降のアップロードはメモリ上の dict を引くだけで
+    同じ日付の既存ページを見つける。自分で作成・更新したページは remember で即座に反映する。
+
+    query にはデータソースクエリのリクエストボディを受け取り、
+    Notion のレスポンス（results / has_more / next_cursor）を返す関数を渡す。
+    """
+
+    def __init__(self, query, path=None, refresh_seconds=PAGE_INDEX_REFRESH_SECONDS, clock=time.time):
+        self.path = path or state_path("page_index.sqlite3")
+        self.refresh_seconds = refresh_seconds
+        self._query = query
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pages = None
+        self._seeded_at = 0
+        with connect(self.path) as conn:
+            conn.executescript(_SCHEMA)
+
+    def lookup(self, date):
+        """日付のページ ID を返す（なければ None）"""
+        with self._lock:
+            self._ensure_fresh()
+            page_id = self._pages.get(date)
+        get_metrics_registry().inc("cache_lookups_total", cache="page_index", result="hit" if page_id else "miss")
+        return page_id
+
+    def remember(self, date, page_id):
+        """作成・更新したページを索引に登録"""
+        with self._lock:
+            if self._pages is None:
+                self._load()
+            self._pages[date] = page_id
+            with connect(self.path) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO pages (date, page_id, updated_at) VALUES (?, ?, ?)",
+                    (date, page_id, self._clock()),
+                )
+
+    def forget(self, date):
+        """削除・アーカイブされたページを索引から外す"""
+        with self._lock:
+            if self._pages is not None:
+                self._pages.pop(date, None)
+            with connect(self.path) as conn:
+                conn.execute("DELETE FROM pages WHERE date = ?", (date,))
+
+    def refresh(self):
+        """Notion から索引を作り直す"""
+        with self._lock:
+            self._seed()
+
+    # --- internal ---
+    def _ensure_fresh(self):
+        if self._pages is None:
+            self._load()
+        if self._clock() - self._seeded_at >= self.refresh_seconds:
+            self._seed()
+
+    def _load(self):
+        with connect(self.path) as conn:
+            rows = conn.execute("SELECT date, page_id FROM pages").fetchall()
+            seeded = conn.execute("SELECT value FROM meta WHERE key = 'seeded_at'").fetchone()
+        self._pages = dict(rows)
+        self._seeded_at = seeded[0] if seeded else 0
+
+    def _seed(self):
+        pages = {}
+        for page in self._query_all():
+            date = (page["properties"].get(DATE_PROPERTY, {}).get("date") or {}).get("start")
+            if date:
+                # 作成日時の昇順で取得しているので、同じ日付が重複していれば新しいページが残る
+                pages[date[:10]] = page["id"]
+
+        now = self._clock()
+        with connect(self.path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM pages")
+            conn.executemany(
+                "INSERT INTO pages (date, page_id, updated_at) VALUES (?, ?, ?)",
+                [(date, page_id, now) for date, page_id in pages.items()],
+            )
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('seeded_at', ?)", (now,))
+            conn.execute("COMMIT")
+        self._pages = pages
+        self._seeded_at = now
+        print(f"[DEBUG] Page index refreshed: {len(pages)} dates")
+
+    def _query_all(self):
+        body = {
+            "filter": {"property": DATE_PROPERTY, "date": {"is_not_empty": True}},
+            "sorts": [{"timestamp": "created_time", "direction": "ascending"}],
+            "page_size": 100,
+        }
+        while True:
+            response = self._query(body)
+            yield from response["results"]
+            if not response.get("has_more"):
+                return
+            body = {**body, "start_cursor": response["next_cursor"]}
+
+
+@lazy_singleton
+def get_page_index(query):
+    """プロセス共有の索引を返す（query は初回作成時のみ使われる）"""
+    return PageIndex(query)
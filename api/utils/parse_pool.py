@@ -0,0 +1,45 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from .warmup import warm_parse_process
+
+# PDF 解析（pdfplumber、CPU 処理）をプロセスプールで実行する
+#
+# スレッドで並行にリクエストを受け付けても、GIL のため解析は 1 件ずつしか進まない。
+# configure_parse_pool でプールを用意したプロセス（ローカルサーバー）だけ子プロセスに振り分け、
+# Vercel など未設定の環境では呼び出し元のスレッドでそのまま実行する。
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure_parse_pool(processes):
+    """解析用のプロセスプールを作る（0 以下ならプールを使わない）"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+        if processes > 0:
+            # サーバーのスレッドが動いている状態で fork しないよう spawn で起動する
+            # 子プロセスは起動時に CMap の読み込みとサンプルの解析を済ませる（最初の解析が遅くならないよう）
+            _pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=warm_parse_process)
+        return _pool
+
+
+def shutdown_parse_pool():
+    configure_parse_pool(0)
+
+
+def run_parsing(func, data):
+    """func(data) をプールで実行して結果を返す（プールがなければこのスレッドで実行）
+
+    func はモジュールレベルの関数（子プロセスに渡すため pickle できるもの）。
+    data は memoryview でもよい（プールに渡すときだけ bytes にコピーする）。
+    """
+    pool = _pool
+    if pool is None:
+        return func(data)
+    return pool.submit(func, bytes(data)).result()
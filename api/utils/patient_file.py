@@ -0,0 +1,119 @@
+import csv
+import io
+import json
+
+import requests
+
+from .notion_blocks import iter_child_blocks
+
+# 患者データファイルの列（parse_patient_row が返す dict のキー）
+PATIENT_FIELDS = [
+    "number", "patient_id", "name", "insurance_type", "points", "burden_amount",
+    "kaigo_units", "kaigo_burden", "jihi", "bushan", "zenkai_sagaku",
+    "receipt_amount", "sagaku", "remarks",
+]
+_TEXT_FIELDS = {"patient_id", "name", "insurance_type", "remarks"}
+
+# 形式 → Content-Type
+PATIENT_FILE_FORMATS = {
+    "csv": "text/csv",
+    "json": "application/json",
+}
+
+
+def patients_filename(date, fmt):
+    return f"患者データ_{date}.{fmt}"
+
+
+def dump_patients(patients, fmt="csv"):
+    """患者データのリストを CSV / JSON のバイト列にする
+
+    CSV は Excel で文字化けしないよう BOM 付き UTF-8。
+    JSON は列名を 1 回だけ持つ {"fields": [...], "rows": [[...], ...]} 形式。
+    """
+    rows = [[patient.get(field, "" if field in _TEXT_FIELDS else 0) for field in PATIENT_FIELDS]
+            for patient in patients]
+    if fmt == "csv":
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(PATIENT_FIELDS)
+        writer.writerows(rows)
+        return out.getvalue().encode("utf-8-sig")
+    if fmt == "json":
+        return json.dumps({"fields": PATIENT_FIELDS, "rows": rows},
+                          ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    raise ValueError(f"Unknown patient file format: {fmt}")
+
+
+def load_patients(data, fmt="csv"):
+    """dump_patients で作ったバイト列を患者データのリストに戻す"""
+    if fmt == "csv":
+        reader = csv.reader(io.StringIO(bytes(data).decode("utf-8-sig")))
+        fields = next(reader, [])
+        rows = list(reader)
+    elif fmt == "json":
+        payload = json.loads(bytes(data).decode("utf-8"))
+        fields, rows = payload["fields"], payload["rows"]
+    else:
+        raise ValueError(f"Unknown patient file format: {fmt}")
+
+    patients = []
+    for row in rows:
+        patient = {}
+        for field, value in zip(fields, row):
+            if field in _TEXT_FIELDS:
+                patient[field] = str(value)
+            else:
+                patient[field] = int(value) if value not in ("", None) else 0
+        patients.append(patient)
+    return patients
+
+
+def patients_to_columns(patients):
+    """患者データのリストを列ごとの配列 {field: [値, ...]} にする（API の columnar 形式）
+
+    行ごとの dict と違い、キー名が患者数ぶん繰り返されない。
+    """
+    return {
+        field: [patient.get(field, "" if field in _TEXT_FIELDS else 0) for patient in patients]
+        for field in PATIENT_FIELDS
+    }
+
+
+def columns_to_patients(columns):
+    """patients_to_columns の逆変換"""
+    fields = list(columns)
+    return [dict(zip(fields, values)) for values in zip(*(columns[field] for field in fields))]
+
+
+def find_patients_file(blocks):
+    """ページのブロックから患者データファイルを探し (url, format) を返す（なければ None）"""
+    for block in blocks:
+        if block.get("type") != "file":
+            continue
+        file = block["file"]
+        name = file.get("name") or ""
+        fmt = name.rsplit(".", 1)[-1].lower()
+        if name.startswith("患者データ_") and fmt in PATIENT_FILE_FORMATS:
+            hosted = file.get(file.get("type"), {})
+            return hosted.get("url"), fmt
+    return None
+
+
+def load_patients_from_page(notion, page_id, fetch=None):
+    """Notion ページに添付された患者データファイルを読み込む
+
+    fetch にはダウンロード関数（url -> bytes）を渡せる。省略時は requests で取得する。
+    """
+    found = find_patients_file(iter_child_blocks(notion, page_id))
+    if found is None:
+        raise ValueError(f"No patient data file attached to page {page_id}")
+    url, fmt = found
+    return load_patients((fetch or _download)(url), fmt)
+
+
+def _download(url):
+    response = requests.get(url, timeout=30)
+    if response.status_code != 200:
+        raise Exception(f"Patient file download failed ({response.status_code}): {response.text}")
+    return response.content
@@ -0,0 +1,117 @@
+import zlib
+
+# B5 横（pt）: クライアントの jsPDF('l', 'mm', 'b5') と同じ用紙
+PAGE_B5_LANDSCAPE = (728.5, 515.9)
+
+# フォントを埋め込まない標準の日本語 CID フォント（Acrobat・ブラウザの PDF ビューアで表示できる）
+FONT_NAME = "HeiseiKakuGo-W5"
+FONT_ENCODING = "UniJIS-UCS2-H"
+
+
+def char_width(ch):
+    """文字送り（1000 単位）。ASCII と半角カナは半角、それ以外は全角"""
+    code = ord(ch)
+    if code < 0x80 or 0xFF61 <= code <= 0xFF9F:
+        return 500
+    return 1000
+
+
+class PdfCanvas:
+    """日本語テキスト・矩形・線だけを描ける最小限のベクター PDF ライター
+
+    座標は左上原点（y は下向き）、単位は pt。ページごとの描画命令は FlateDecode で圧縮する。
+    """
+
+    def __init__(self, size=PAGE_B5_LANDSCAPE):
+        self.width, self.height = size
+        self._pages = []
+        self.new_page()
+
+    def new_page(self):
+        self._ops = []
+        self._pages.append(self._ops)
+
+    # --- 描画 ---
+    def rect(self, x, y, w, h, fill=None, stroke=(0, 0, 0), line_width=0.5):
+        ops = []
+        if fill:
+            ops.append(f"{_rgb(fill)} rg")
+        if stroke:
+            ops.append(f"{_rgb(stroke)} RG {_num(line_width)} w")
+        ops.append(f"{_num(x)} {_num(self.height - y - h)} {_num(w)} {_num(h)} re")
+        ops.append("B" if fill and stroke else "f" if fill else "S")
+        self._ops.append(" ".join(ops))
+
+    def line(self, x1, y1, x2, y2, color=(0, 0, 0), line_width=0.5):
+        self._ops.append(
+            f"{_rgb(color)} RG {_num(line_width)} w "
+            f"{_num(x1)} {_num(self.height - y1)} m {_num(x2)} {_num(self.height - y2)} l S"
+        )
+
+    def text(self, x, y, s, size, align="left", color=(0, 0, 0)):
+        """y はベースラインの位置。align は left / center / right（x が基準点）"""
+        s = "".join(ch if ord(ch) <= 0xFFFF else "?" for ch in str(s))
+        if not s:
+            return
+        if align == "right":
+            x -= self.text_width(s, size)
+        elif align == "center":
+            x -= self.text_width(s, size) / 2
+        self._ops.append(
+            f"BT /F1 {_num(size)} Tf {_rgb(color)} rg {_num(x)} {_num(self.height - y)} Td "
+            f"<{s.encode('utf-16-be').hex()}> Tj ET"
+        )
+
+    @staticmethod
+    def text_width(s, size):
+        return sum(char_width(ch) for ch in s) * size / 1000
+
+    # --- 出力 ---
+    def to_bytes(self):
+        objects = [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            None,  # Pages（ページオブジェクトの番号が決まってから埋める）
+            (f"<< /Type /Font /Subtype /Type0 /BaseFont /{FONT_NAME} /Encoding /{FONT_ENCODING} "
+             f"/DescendantFonts [4 0 R] >>").encode(),
+            (f"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /{FONT_NAME} "
+             f"/CIDSystemInfo << /Registry (Adobe) /Ordering (Japan1) /Supplement 2 >> "
+             f"/FontDescriptor 5 0 R /DW 1000 /W [1 95 500 231 632 500] >>").encode(),
+            (f"<< /Type /FontDescriptor /FontName /{FONT_NAME} /Flags 4 "
+             f"/FontBBox [-92 -250 1010 922] /ItalicAngle 0 /Ascent 752 /Descent -221 "
+             f"/CapHeight 737 /StemV 114 >>").encode(),
+        ]
+
+        page_refs = []
+        for ops in self._pages:
+            content = zlib.compress("\n".join(ops).encode("ascii"))
+            objects.append(
+                f"<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n".encode()
+                + content + b"\nendstream"
+            )
+            content_ref = len(objects)
+            objects.append(
+                (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {_num(self.width)} {_num(self.height)}] "
+                 f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_ref} 0 R >>").encode()
+            )
+            page_refs.append(f"{len(objects)} 0 R")
+        objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>".encode()
+
+        out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(out))
+            out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+        xref = len(out)
+        out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+        for offset in offsets:
+            out += f"{offset:010d} 00000 n \n".encode()
+        out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+        return bytes(out)
+
+
+def _num(value):
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+
+def _rgb(color):
+    return " ".join(_num(c) for c in color)
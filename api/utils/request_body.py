@@ -0,0 +1,274 @@
+import mmap
+import os
+import tempfile
+from email.parser import HeaderParser
+
+# リクエストボディの上限（超えたら読み込む前に 413 で断る）
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+
+# これより大きいファイルパートはメモリではなく一時ファイルに書き出す
+UPLOAD_SPOOL_THRESHOLD = int(os.environ.get("UPLOAD_SPOOL_THRESHOLD", 1024 * 1024))
+
+CHUNK_SIZE = 64 * 1024
+MAX_PART_HEADER_BYTES = 16 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """リクエストボディが MAX_UPLOAD_BYTES を超えた"""
+    status = 413
+
+
+class UploadedFile:
+    """multipart のファイルパート
+
+    data はパートのバッファ、または一時ファイル（SpooledBody ならボディのファイル）の mmap への memoryview。
+    """
+
+    def __init__(self, filename, content_type, data):
+        self.filename = filename
+        self.content_type = content_type
+        self.data = data
+
+    def __len__(self):
+        return self.data.nbytes
+
+
+class SpooledBody:
+    """サーバーが一時ファイルに読み込み済みのリクエストボディ
+
+    read_multipart はこのボディのファイルパートを一時ファイルに書き直さず、
+    ボディのファイルの mmap への memoryview として返す。
+    """
+
+    def __init__(self, file):
+        self._file = file
+        self._mapped = None
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readinto(self, b):
+        return self._file.readinto(b)
+
+    def mapped(self):
+        """ボディ全体の mmap（最初に呼ばれたときに作る）"""
+        if self._mapped is None:
+            self._file.flush()
+            self._mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mapped
+
+    def close(self):
+        # mmap はファイルを閉じても有効（参照がなくなったときに解放される）
+        self._file.close()
+
+
+def read_body(rfile, content_length):
+    """リクエストボディを 1 つの bytearray に直接読み込む
+
+    rfile.read() は bytes を返し、その後の BytesIO などでさらにコピーが発生するため、
+    確保済みのバッファへ readinto で書き込む。
+    """
+    buf = bytearray(content_length)
+    view = memoryview(buf)
+    pos = 0
+    while pos < content_length:
+        n = rfile.readinto(view[pos:])
+        if not n:
+            break
+        pos += n
+    view.release()
+    if pos < content_length:
+        del buf[pos:]
+    return buf
+
+
+def get_boundary(content_type):
+    """Content-Type ヘッダから multipart の boundary を取り出す"""
+    msg = HeaderParser().parsestr(f"Content-Type: {content_type}\r\n\r\n")
+    boundary = msg.get_param("boundary")
+    if not boundary:
+        raise ValueError("No boundary in Content-Type")
+    return boundary.encode("latin-1")
+
+
+# ============================================================
+# ストリーミング multipart
+# ============================================================
+
+def read_multipart(rfile, content_type, content_length,
+                   max_bytes=MAX_UPLOAD_BYTES, spool_threshold=UPLOAD_SPOOL_THRESHOLD, multiple=False):
+    """ソケットから multipart/form-data を少しずつ読みながらパースして (fields, files) を返す
+
+    ボディ全体をバッファに読み込まず、保持するのは
+    CHUNK_SIZE 程度の読み込みバッファとパートの中身だけ。spool_threshold を超えるファイルパートは
+    一時ファイルに書き出し、data はその mmap への memoryview になる（プロセスのヒープを使わない）。
+    rfile が SpooledBody ならファイルパートは書き出さず、ボディのファイルの mmap を参照する。
+    Content-Length が max_bytes を超える場合は何も読まずに UploadTooLarge を送出する。
+    multiple=True なら files の値は同じ名前のファイルパートのリスト（送信順）になる。
+    """
+    if max_bytes is not None and content_length > max_bytes:
+        raise UploadTooLarge(f"Request body too large ({content_length} bytes > {max_bytes} bytes)")
+
+    # 先頭の boundary も "\r\n--boundary" で見つけられるように CRLF を補う
+    delimiter = b"\r\n--" + get_boundary(content_type)
+    stream = _BodyStream(rfile, content_length, initial=b"\r\n")
+    fields, files = {}, {}
+
+    # プリアンブルを読み飛ばす
+    if not stream.read_until(delimiter, _discard):
+        raise ValueError("Malformed multipart body: boundary not found")
+
+    while True:
+        if not stream.ensure(2):
+            raise ValueError("Malformed multipart body: closing boundary not found")
+        if stream.buf[:2] == b"--":
+            break
+        if stream.buf[:2] != b"\r\n":
+            raise ValueError("Malformed multipart body: invalid boundary line")
+        stream.consume(2)
+
+        raw_headers = bytearray()
+        if not stream.read_until(b"\r\n\r\n", raw_headers.extend, limit=MAX_PART_HEADER_BYTES):
+            raise ValueError("Malformed multipart body: incomplete part headers")
+        headers = HeaderParser().parsestr(raw_headers.decode("utf-8", "replace"))
+        name = headers.get_param("name", header="content-disposition")
+        filename = headers.get_filename()
+
+        if filename is not None:
+            if isinstance(rfile, SpooledBody):
+                sink = _BodySlice(rfile, stream.offset)
+            else:
+                sink = _SpoolSink(spool_threshold)
+            if not stream.read_until(delimiter, sink.write):
+                raise ValueError("Malformed multipart body: closing boundary not found")
+            if name is not None:
+                uploaded = UploadedFile(filename, headers.get_content_type(), sink.finish())
+                if multiple:
+                    files.setdefault(name, []).append(uploaded)
+                else:
+                    files[name] = uploaded
+        else:
+            value = bytearray()
+            if not stream.read_until(delimiter, value.extend):
+                raise ValueError("Malformed multipart body: closing boundary not found")
+            if name is not None:
+                fields[name] = value.decode("utf-8")
+
+    # keep-alive の次のリクエストと混ざらないよう、エピローグも読み切る
+    stream.drain()
+    return fields, files
+
+
+def _discard(data):
+    pass
+
+
+class _BodyStream:
+    """Content-Length の範囲だけ rfile から読む、先頭を消費できるバッファ
+
+    offset は buf の先頭がボディの何バイト目か（initial の分だけ負から始まる）。
+    """
+
+    def __init__(self, rfile, content_length, initial=b""):
+        self.buf = bytearray(initial)
+        self.offset = -len(initial)
+        self._rfile = rfile
+        self._remaining = content_length
+
+    def fill(self):
+        """最大 CHUNK_SIZE バイトを読み足し、読んだバイト数を返す（終端なら 0）"""
+        if self._remaining <= 0:
+            return 0
+        chunk = self._rfile.read(min(CHUNK_SIZE, self._remaining))
+        if not chunk:
+            self._remaining = 0
+            return 0
+        self._remaining -= len(chunk)
+        self.buf += chunk
+        return len(chunk)
+
+    def consume(self, n):
+        del self.buf[:n]
+        self.offset += n
+
+    def ensure(self, n):
+        while len(self.buf) < n:
+            if not self.fill():
+                return False
+        return True
+
+    def read_until(self, marker, write, limit=None):
+        """marker の手前までを write に渡し、marker まで消費する（見つからなければ False）"""
+        keep = len(marker) - 1
+        written = 0
+        while True:
+            index = self.buf.find(marker)
+            if index >= 0:
+                written += index
+                if limit is not None and written > limit:
+                    return False
+                write(self.buf[:index])
+                self.consume(index + len(marker))
+                return True
+            # marker の途中までが末尾にあるかもしれないので、その分は残す
+            if len(self.buf) > keep:
+                n = len(self.buf) - keep
+                written += n
+                if limit is not None and written > limit:
+                    return False
+                write(self.buf[:n])
+                self.consume(n)
+            if not self.fill():
+                return False
+
+    def drain(self):
+        self.buf.clear()
+        while self.fill():
+            self.buf.clear()
+
+
+class _SpoolSink:
+    """ファイルパートの書き込み先。threshold を超えたら一時ファイルに切り替える"""
+
+    def __init__(self, threshold):
+        self._threshold = threshold
+        self._buf = bytearray()
+        self._file = None
+
+    def write(self, data):
+        if self._file is None and len(self._buf) + len(data) > self._threshold:
+            self._file = tempfile.TemporaryFile(prefix="upload-")
+            self._file.write(self._buf)
+            self._buf = None
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._buf += data
+
+    def finish(self):
+        """パートの中身への memoryview を返す"""
+        if self._file is None:
+            return memoryview(self._buf)
+        self._file.flush()
+        # mmap は一時ファイルを閉じても有効（参照がなくなったときに解放される）
+        mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._file.close()
+        return memoryview(mapped)
+
+
+class _BodySlice:
+    """SpooledBody のファイルパートの書き込み先。コピーせずボディ内の範囲だけを記録する"""
+
+    def __init__(self, body, start):
+        self._body = body
+        self._start = start
+        self._length = 0
+
+    def write(self, data):
+        self._length += len(data)
+
+    def finish(self):
+        """パートの中身への memoryview（ボディの mmap の一部）を返す"""
+        if not self._length:
+            return memoryview(b"")
+        return memoryview(self._body.mapped())[self._start:self._start + self._length]
@@ -0,0 +1,58 @@
+import time
+
+from .local_state import connect, lazy_singleton, state_path
+from .metrics import get_metrics_registry
+
+# Notion の file_upload は作成から1時間以内にページへ添付しないと失効する。
+# 余裕をみて少し短めに扱う。
+FILE_UPLOAD_REUSE_SECONDS = 55 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    digest TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    file_upload_id TEXT NOT NULL,
+    uploaded_at REAL NOT NULL,
+    PRIMARY KEY (digest, content_type)
+)
+"""
+
+
+class UploadCache:
+    """ファイル内容のハッシュ → Notion file_upload_id の永続キャッシュ
+
+    同じバイト列の再アップロードや、ページ書き込み失敗後のリトライで
+    同じファイルを何度も Notion に送らないようにする。
+    """
+
+    def __init__(self, path=None, ttl=FILE_UPLOAD_REUSE_SECONDS, clock=time.time):
+        self.path = path or state_path("uploads.sqlite3")
+        self.ttl = ttl
+        self._clock = clock
+        with connect(self.path) as conn:
+            conn.execute(_SCHEMA)
+
+    def get(self, digest, content_type):
+        """有効期限内の file_upload_id を返す（なければ None）"""
+        with connect(self.path) as conn:
+            conn.execute("DELETE FROM uploads WHERE uploaded_at < ?", (self._clock() - self.ttl,))
+            row = conn.execute(
+                "SELECT file_upload_id FROM uploads WHERE digest = ? AND content_type = ?",
+                (digest, content_type),
+            ).fetchone()
+        get_metrics_registry().inc("cache_lookups_total", cache="upload", result="hit" if row else "miss")
+        return row[0] if row else None
+
+    def put(self, digest, content_type, file_upload_id):
+        with connect(self.path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO uploads (digest, content_type, file_upload_id, uploaded_at)"
+                " VALUES (?, ?, ?, ?)",
+                (digest, content_type, file_upload_id, self._clock()),
+            )
+
+
+@lazy_singleton
+def get_upload_cache():
+    """プロセス共有のアップロードキャッシュを返す"""
+    return UploadCache()
@@ -0,0 +1,111 @@
+import json
+import os
+import time
+
+from .local_state import connect, lazy_singleton, state_path
+
+# 日計表ページに残す照合結果（見出し + PDF、またはメモ）の件数。0 以下なら削除しない
+VERIFICATION_HISTORY_LIMIT = int(os.environ.get("NOTION_VERIFICATION_HISTORY_LIMIT", 3))
+
+# update_verification が追加するブロックの目印
+VERIFICATION_HEADING = "✅ 照合画面PDF"
+VERIFICATION_NOTE_PREFIX = "照合結果:"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    page_id TEXT NOT NULL,
+    block_ids TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attempts_page ON attempts (page_id, id);
+"""
+
+
+class VerificationHistory:
+    """日計表ページごとの照合結果ブロック ID の索引（SQLite）
+
+    インスタンスごとのローカルな状態（Vercel では /tmp）のため、他のインスタンスが追加した照合結果や
+    コールドスタート前の照合結果は含まない。正しい一覧はページ自体にあるので、呼び出し側は照合のたびに
+    ページのブロックを走査して seed で置き換え、limit を超えた古い照合結果のブロック ID を trim で受け取る
+    （呼び出し側が Notion から削除する）。
+    """
+
+    def __init__(self, path=None, limit=VERIFICATION_HISTORY_LIMIT, clock=time.time):
+        self.path = path or state_path("verification_history.sqlite3")
+        self.limit = limit
+        self._clock = clock
+        with connect(self.path) as conn:
+            conn.executescript(_SCHEMA)
+
+    def attempts(self, page_id):
+        """照合結果ごとのブロック ID のリスト（古い順）"""
+        with connect(self.path) as conn:
+            rows = conn.execute(
+                "SELECT block_ids FROM attempts WHERE page_id = ? ORDER BY id", (page_id,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def seed(self, page_id, attempts):
+        """ページを走査して見つけた照合結果（古い順）で索引を置き換える"""
+        now = self._clock()
+        with connect(self.path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM attempts WHERE page_id = ?", (page_id,))
+            conn.executemany(
+                "INSERT INTO attempts (page_id, block_ids, created_at) VALUES (?, ?, ?)",
+                [(page_id, json.dumps(block_ids), now) for block_ids in attempts],
+            )
+            conn.execute("COMMIT")
+
+    def trim(self, page_id):
+        """limit を超えた古い照合結果を索引から外し、そのブロック ID のリストを返す"""
+        if self.limit <= 0:
+            return []
+        with connect(self.path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id, block_ids FROM attempts WHERE page_id = ? ORDER BY id DESC LIMIT -1 OFFSET ?",
+                (page_id, self.limit),
+            ).fetchall()
+            conn.executemany("DELETE FROM attempts WHERE id = ?", [(row[0],) for row in rows])
+            conn.execute("COMMIT")
+        return [json.loads(row[1]) for row in reversed(rows)]
+
+    def forget(self, page_id):
+        """ページのブロックを作り直したときに索引から外す"""
+        with connect(self.path) as conn:
+            conn.execute("DELETE FROM attempts WHERE page_id = ?", (page_id,))
+
+
+def find_verification_attempts(blocks):
+    """ページのブロック一覧から照合結果のブロック ID を古い順に取り出す
+
+    見出し「✅ 照合画面PDF」とその直後のファイル、または「照合結果:」で始まるメモを 1 件とする。
+    """
+    attempts = []
+    heading = None  # 直前のブロックが照合結果の見出しなら、その照合結果
+    for block in blocks:
+        block_type = block.get("type")
+        text = _plain_text(block.get(block_type, {}).get("rich_text", []))
+        if block_type == "file" and heading is not None:
+            heading.append(block["id"])
+            heading = None
+        elif block_type == "heading_2" and text == VERIFICATION_HEADING:
+            heading = [block["id"]]
+            attempts.append(heading)
+        else:
+            heading = None
+            if block_type == "callout" and text.startswith(VERIFICATION_NOTE_PREFIX):
+                attempts.append([block["id"]])
+    return attempts
+
+
+def _plain_text(rich_text):
+    return "".join(t.get("plain_text") or t.get("text", {}).get("content", "") for t in rich_text)
+
+
+@lazy_singleton
+def get_verification_history():
+    """プロセス共有の照合結果の索引を返す"""
+    return VerificationHistory()
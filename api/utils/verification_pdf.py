@@ -0,0 +1,184 @@
+# 照合画面 PDF をサーバー側でベクター描画する
+#
+# ブラウザの html2canvas + JPEG の代わりに、クライアントから受け取った値（照合結果・入力金額・
+# 院長へ・日計表 PDF の集計、画面の表）だけで B5 横の PDF を組み立てる。
+# sheet の形式:
+#   {"sections": [{"title": "窓口現金出納", "column": 1, "header": [...],
+#                  "rows": [["前日の繰越", "30000"], ...], "totals": [3]}]}
+#   column は 0=左列 / 1=右列、totals は合計行として強調する行の番号
+from .pdf_canvas import PdfCanvas, PAGE_B5_LANDSCAPE
+
+MARGIN = 28
+COLUMN_GAP = 16
+ROW_HEIGHT = 13
+FONT_SIZE = 7.5
+MIN_FONT_SIZE = 5
+SECTION_GAP = 8
+
+HEADER_FILL = (0.9, 0.9, 0.9)
+TOTAL_FILL = (0.96, 0.96, 0.96)
+MATCH_COLOR = (0.13, 0.55, 0.13)
+MISMATCH_COLOR = (0.8, 0.1, 0.1)
+
+# 日計表 PDF の集計（parse_daily_report の summary）の表示項目
+SUMMARY_ROWS = [
+    ("社保", "shaho"),
+    ("国保", "kokuho"),
+    ("後期", "kouki"),
+    ("自費", "jihi"),
+    ("保険なし", "hoken_nashi"),
+    ("合計", "total"),
+]
+SUMMARY_EXTRA_ROWS = [
+    ("物販", "bushan_amount"),
+    ("介護", "kaigo_amount"),
+    ("前回差額", "zenkai_sagaku"),
+    ("当日差額", "today_difference"),
+]
+
+
+def format_yen(value):
+    """12345 → "12,345円"（フォントに ¥ が無い環境でも崩れないよう円表記にする）"""
+    try:
+        return f"{int(value):,}円"
+    except (TypeError, ValueError):
+        return str(value or "")
+
+
+def summary_section(summary):
+    """日計表 PDF の集計を sheet のセクション形式にする"""
+    rows = [
+        [label, f"{summary.get(key + '_count', 0)}名", format_yen(summary.get(key + "_amount", 0))]
+        for label, key in SUMMARY_ROWS
+    ]
+    rows += [
+        [label, "", format_yen(summary[key])]
+        for label, key in SUMMARY_EXTRA_ROWS
+        if key in summary
+    ]
+    return {
+        "title": "日計表PDFの集計",
+        "column": 1,
+        "header": ["区分", "人数", "金額"],
+        "rows": rows,
+        "totals": [len(SUMMARY_ROWS) - 1],
+    }
+
+
+def verification_section(is_matched, cash_input, expense_director, verified_at=None):
+    rows = [
+        ["照合状態", "一致" if is_matched else "不一致"],
+        ["入力金額", format_yen(cash_input)],
+        ["院長へ", format_yen(expense_director)],
+    ]
+    if verified_at:
+        rows.append(["照合日時", verified_at])
+    return {"title": "照合結果", "column": 1, "header": [], "rows": rows, "totals": []}
+
+
+def render_verification_pdf(is_matched, cash_input, expense_director=0, date="",
+                            summary=None, sheet=None, verified_at=None):
+    """照合画面の PDF（bytes）を返す
+
+    sheet があれば画面の表をそのまま左右 2 列で描き、末尾に照合結果と日計表 PDF の集計を加える。
+    """
+    canvas = PdfCanvas(PAGE_B5_LANDSCAPE)
+    sections = list((sheet or {}).get("sections", []))
+    sections.append(verification_section(is_matched, cash_input, expense_director, verified_at))
+    if summary:
+        sections.append(summary_section(summary))
+
+    top = _draw_title(canvas, is_matched, date or (summary or {}).get("date", ""))
+    column_width = (canvas.width - 2 * MARGIN - COLUMN_GAP) / 2
+    cursors = [top, top]
+
+    for section in sections:
+        column = 1 if section.get("column") else 0
+        height = _section_height(section)
+        # 指定の列に入らなければもう一方の列、どちらにも入らなければ改ページ
+        if cursors[column] + height > canvas.height - MARGIN:
+            other = 1 - column
+            if cursors[other] + height <= canvas.height - MARGIN:
+                column = other
+            elif cursors != [top, top]:
+                canvas.new_page()
+                top = cursors[0] = cursors[1] = MARGIN
+        x = MARGIN + column * (column_width + COLUMN_GAP)
+        _draw_section(canvas, x, cursors[column], column_width, section)
+        cursors[column] += height + SECTION_GAP
+
+    return canvas.to_bytes()
+
+
+def _draw_title(canvas, is_matched, date):
+    """タイトル行を描き、本文の開始位置（y）を返す"""
+    canvas.text(MARGIN, MARGIN + 14, "歯科医院 日計表", 14)
+    if date:
+        canvas.text(MARGIN + 130, MARGIN + 14, f"日付: {date}", 10)
+
+    label = "一致" if is_matched else "不一致"
+    color = MATCH_COLOR if is_matched else MISMATCH_COLOR
+    box_width = 90
+    x = canvas.width - MARGIN - box_width
+    canvas.rect(x, MARGIN, box_width, 20, fill=None, stroke=color, line_width=1.5)
+    canvas.text(x + box_width / 2, MARGIN + 14.5, f"照合: {label}", 10, align="center", color=color)
+
+    y = MARGIN + 28
+    canvas.line(MARGIN, y, canvas.width - MARGIN, y, line_width=0.8)
+    return y + 8
+
+
+def _section_height(section):
+    rows = 1 + (1 if section.get("header") else 0) + len(section.get("rows", []))
+    return rows * ROW_HEIGHT
+
+
+def _column_count(section):
+    return max([len(section.get("header") or [])] + [len(row) for row in section.get("rows", [])] + [1])
+
+
+def _draw_section(canvas, x, y, width, section):
+    columns = _column_count(section)
+    cell_width = width / columns
+
+    # タイトル行（全列結合）
+    canvas.rect(x, y, width, ROW_HEIGHT, fill=HEADER_FILL)
+    canvas.text(x + width / 2, y + ROW_HEIGHT - 3.5, section.get("title", ""), FONT_SIZE + 0.5, align="center")
+    y += ROW_HEIGHT
+
+    if section.get("header"):
+        _draw_row(canvas, x, y, cell_width, columns, section["header"], fill=HEADER_FILL, align="center")
+        y += ROW_HEIGHT
+
+    totals = set(section.get("totals", []))
+    for index, row in enumerate(section.get("rows", [])):
+        _draw_row(canvas, x, y, cell_width, columns, row, fill=TOTAL_FILL if index in totals else None)
+        y += ROW_HEIGHT
+
+
+def _draw_row(canvas, x, y, cell_width, columns, cells, fill=None, align=None):
+    cells = list(cells) + [""] * (columns - len(cells))
+    for i, value in enumerate(cells):
+        left = x + i * cell_width
+        canvas.rect(left, y, cell_width, ROW_HEIGHT, fill=fill)
+        value = str(value if value is not None else "")
+        if not value:
+            continue
+        size = _fit_font_size(canvas, value, cell_width - 4)
+        cell_align = align or ("right" if _is_amount(value) else "left")
+        anchor = {"left": left + 2, "center": left + cell_width / 2, "right": left + cell_width - 3}[cell_align]
+        canvas.text(anchor, y + ROW_HEIGHT - 3.5, value, size, align=cell_align)
+
+
+def _fit_font_size(canvas, value, available):
+    """セル幅に収まるまでフォントを小さくする"""
+    size = FONT_SIZE
+    while size > MIN_FONT_SIZE and canvas.text_width(value, size) > available:
+        size -= 0.5
+    return size
+
+
+def _is_amount(value):
+    """金額・枚数などの数値セルは右寄せにする"""
+    stripped = value.replace(",", "").rstrip("円枚名点").lstrip("+-")
+    return stripped.isdigit()
@@ -0,0 +1,123 @@
+import importlib
+import io
+import json
+import os
+import threading
+import time
+
+from .app_core import API_ROUTES
+from .pdf_canvas import PdfCanvas
+
+# 新しいプロセスの最初のリクエストだけが遅くならないよう、初回に読み込まれるものを先に読み込む
+#
+# - pdfminer は日本語の CMap（UniJIS-UCS2-H など）と Adobe-Japan1 の to-unicode 表を、
+#   最初に使われたときに pickle.gz から読み込む
+# - 小さな日本語 PDF（表を含む）を 1 回解析して、pdfminer / pdfplumber のコードを通しておく
+# - API モジュールの import（pdfplumber・Notion クライアントの作成を含む）
+#
+# ローカルサーバーは起動時に別スレッドで、解析用の子プロセスは起動時に warm_pdfminer を実行する。
+# Vercel では GET /api/warmup（parse_daily_report と同じ関数）を定期的に呼ぶ。
+
+WARMUP_ROUTE = "/api/warmup"
+
+# 先に読み込む CMap（カンマ区切り）
+WARMUP_CMAPS = tuple(
+    name for name in os.environ.get("WARMUP_CMAPS", "UniJIS-UCS2-H,UniJIS-UTF16-H,90ms-RKSJ-H,90msp-RKSJ-H").split(",")
+    if name
+)
+WARMUP_UNICODE_MAPS = ("Adobe-Japan1",)
+
+_done = {}
+_running = set()
+_lock = threading.Lock()
+
+
+def sample_pdf():
+    """日本語のテキストと罫線の表を含む 1 ページの PDF"""
+    canvas = PdfCanvas()
+    canvas.text(40, 40, "令和7年1月15日　日計表", 12)
+    rows = [("番号", "患者名", "保険"), ("1", "山田　太郎", "社本"), ("2", "鈴木　花子", "国本")]
+    for i, row in enumerate(rows):
+        for j, value in enumerate(row):
+            x, y = 40 + j * 120, 60 + i * 20
+            canvas.rect(x, y, 120, 20)
+            canvas.text(x + 4, y + 15, value, 10)
+    return canvas.to_bytes()
+
+
+def warm_pdfminer(cmaps=WARMUP_CMAPS):
+    """CMap を読み込み、サンプルの PDF を解析する（解析用の子プロセスの initializer にも使う）"""
+    import pdfplumber
+    from pdfminer.cmapdb import CMapDB
+
+    for name in cmaps:
+        try:
+            CMapDB.get_cmap(name)
+        except CMapDB.CMapNotFound:
+            print(f"[Warmup] CMap not found: {name}")
+    for name in WARMUP_UNICODE_MAPS:
+        CMapDB.get_unicode_map(name)
+
+    with pdfplumber.open(io.BytesIO(sample_pdf())) as pdf:
+        for page in pdf.pages:
+            page.extract_text()
+            page.extract_tables()
+
+
+def warm_parse_process():
+    """解析用の子プロセスの initializer（失敗してもプールを壊さないよう例外は出さない）"""
+    try:
+        warm_pdfminer()
+    except Exception as e:
+        print(f"[Warmup] pdfminer warm-up failed: {e}")
+
+
+def import_api_modules():
+    """API モジュールを import する（モジュールレベルで Notion クライアントが作られる）"""
+    for module_name in set(API_ROUTES.values()):
+        importlib.import_module(module_name)
+
+
+def warm_up(steps):
+    """steps（(名前, 関数) のリスト）をプロセスごとに 1 回ずつ実行する
+
+    {"warm": 実行前から全ステップ済みだったか, "timings": {今回実行した名前: ミリ秒}, "errors": {名前: メッセージ}}
+    を返す。失敗したステップは次の呼び出しで再実行する。
+    ロックは実行中の印を付ける間だけ取る（Notion の索引作りなどを待つ間、他のリクエストを止めない）。
+    同時に来た別の呼び出しが実行中のステップは飛ばす（warm は False になる）。
+    """
+    timings, errors = {}, {}
+    warm = True
+    for name, func in steps:
+        with _lock:
+            if name in _done:
+                continue
+            warm = False
+            if name in _running:
+                continue
+            _running.add(name)
+        started = time.perf_counter()
+        try:
+            func()
+            elapsed = round((time.perf_counter() - started) * 1000, 1)
+        except Exception as e:
+            errors[name] = str(e)
+        else:
+            timings[name] = _done[name] = elapsed
+        finally:
+            with _lock:
+                _running.discard(name)
+    return {"warm": warm, "timings": timings, "errors": errors}
+
+
+def warm_up_in_background(notion=True):
+    """ローカルサーバーの起動時に呼ぶ: /api/warmup と同じ処理を別スレッドで行う"""
+
+    def run():
+        module = importlib.import_module(API_ROUTES[WARMUP_ROUTE])
+        result = module.warm_up_process(notion=notion)
+        print(f"[Warmup] {json.dumps(result, ensure_ascii=False)}")
+
+    thread = threading.Thread(target=run, name="warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,135 @@
+"""multipart の読み込み: ボディ全体を読む方式とストリーミング方式の比較
+
+PDF サイズごとに、リクエストを読み込んで PDF を取り出し、解析と同じように先頭から読み切るまでの
+所要時間とピークメモリ（tracemalloc、Python ヒープ）を計測する（Notion には接続しない）。
+
+- buffered:  read_body + parse_multipart（ボディ全体を 1 つのバッファに読み込む。比較用にこのスクリプトに残した以前の方式）
+- streaming: read_multipart（少しずつ読み、閾値を超えるパートは一時ファイルの mmap）
+
+使用方法:
+    python scripts/bench_multipart_stream.py [--sizes 1 10 50]   # MB 単位
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+from email.parser import HeaderParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from utils.buffer_reader import BufferReader
+from utils.request_body import UploadedFile, get_boundary, read_body, read_multipart
+
+BOUNDARY = "----bench-boundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def write_body(f, pdf_size):
+    """ソケットの代わりに一時ファイルへリクエストボディを書き、その長さを返す"""
+    f.write(
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"mode\"\r\n\r\njob\r\n"
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"report.pdf\"\r\n"
+        f"Content-Type: application/pdf\r\n\r\n".encode()
+    )
+    remaining = pdf_size
+    while remaining:
+        chunk = os.urandom(min(remaining, 1024 * 1024))
+        f.write(chunk)
+        remaining -= len(chunk)
+    f.write(f"\r\n--{BOUNDARY}--\r\n".encode())
+    f.flush()
+    return f.tell()
+
+
+def parse_multipart(content_type, body):
+    """ボディ全体のバッファから multipart/form-data をパースして (fields, files) を返す（以前の方式）
+
+    fields: フィールド名 -> 文字列
+    files:  フィールド名 -> UploadedFile（ボディをコピーせず memoryview で参照）
+    """
+    delimiter = b"--" + get_boundary(content_type)
+    view = memoryview(body)
+    fields, files = {}, {}
+
+    pos = body.find(delimiter)
+    if pos < 0:
+        raise ValueError("Malformed multipart body: boundary not found")
+    pos += len(delimiter)
+
+    while body[pos:pos + 2] != b"--":
+        # boundary 行の残り（CRLF）を読み飛ばす
+        line_end = body.find(b"\r\n", pos)
+        header_end = body.find(b"\r\n\r\n", line_end)
+        if line_end < 0 or header_end < 0:
+            raise ValueError("Malformed multipart body: incomplete part headers")
+
+        headers = HeaderParser().parsestr(
+            bytes(body[line_end + 2:header_end]).decode("utf-8", "replace")
+        )
+        data_start = header_end + 4
+        data_end = body.find(b"\r\n" + delimiter, data_start)
+        if data_end < 0:
+            raise ValueError("Malformed multipart body: closing boundary not found")
+
+        name = headers.get_param("name", header="content-disposition")
+        filename = headers.get_filename()
+        if name is not None:
+            if filename is not None:
+                files[name] = UploadedFile(
+                    filename,
+                    headers.get_content_type(),
+                    view[data_start:data_end],
+                )
+            else:
+                fields[name] = bytes(body[data_start:data_end]).decode("utf-8")
+
+        pos = data_end + 2 + len(delimiter)
+
+    return fields, files
+
+
+def buffered(rfile, length):
+    return parse_multipart(CONTENT_TYPE, read_body(rfile, length))
+
+
+def streaming(rfile, length):
+    return read_multipart(rfile, CONTENT_TYPE, length, max_bytes=None)
+
+
+def measure(read, path, length):
+    with open(path, "rb", buffering=64 * 1024) as rfile:
+        tracemalloc.start()
+        started = time.perf_counter()
+        _, files = read(rfile, length)
+        # pdfplumber と同じように先頭から読み切る
+        reader = BufferReader(files["file"].data)
+        while reader.read(64 * 1024):
+            pass
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="multipart 読み込みのベンチマーク")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 10, 50])
+    args = parser.parse_args()
+
+    print(f"{'PDF[MB]':>8} {'方式':<10} {'時間[ms]':>10} {'ピークメモリ[bytes]':>20} {'PDF比':>6}")
+    for size_mb in args.sizes:
+        pdf_size = int(size_mb * 1024 * 1024)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            length = write_body(f, pdf_size)
+        try:
+            for label, read in [("buffered", buffered), ("streaming", streaming)]:
+                elapsed, peak = measure(read, f.name, length)
+                print(f"{size_mb:>8g} {label:<10} {elapsed * 1000:>10.1f} {peak:>20,} {peak / pdf_size:>6.2f}")
+        finally:
+            os.unlink(f.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Notion ページブロック生成のベンチマーク
+
+レイアウトと患者数ごとに build_page_blocks の生成時間、JSON シリアライズ時間、
+ブロック数、ペイロードサイズ、書き込みリクエスト数を計測する（Notion には接続しない）。
+
+  上位ブロック: ページ直下のブロック数（再アップロード時の削除リクエスト数）
+  リクエスト:   pages.create + blocks.children.append の回数
+
+使用方法:
+    python scripts/bench_page_blocks.py [--patients 50 500 5000] [--layout standard compact] [--repeat 5]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+# --- parse_daily_report をインポートするための準備 ---
+os.environ.setdefault("NOTION_TOKEN", "test-token")
+os.environ.setdefault("NOTION_DATABASE_ID", "test-db-id")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from parse_daily_report import build_page_blocks
+from utils.append_planner import plan_append_batches, count_blocks
+
+SUMMARY = {
+    "date": "2025-01-15",
+    "shaho_count": 25, "shaho_amount": 360000,
+    "kokuho_count": 10, "kokuho_amount": 135000,
+    "kouki_count": 15, "kouki_amount": 240000,
+    "jihi_count": 2, "jihi_amount": 12000,
+    "hoken_nashi_count": 3, "hoken_nashi_amount": 15000,
+    "total_count": 53, "total_points": 250000, "total_amount": 750000,
+    "bushan_amount": 12500, "kaigo_amount": 30000, "zenkai_sagaku": -500,
+}
+
+
+def make_patients(n):
+    """n 人分の患者データ（5 人に 1 人は差額などの詳細あり）"""
+    patients = []
+    for i in range(1, n + 1):
+        detail = i % 5 == 0
+        patients.append({
+            "number": i,
+            "patient_id": f"{100000 + i}",
+            "name": f"患者 {i:05d}",
+            "insurance_type": ["社本", "国本", "後期"][i % 3],
+            "points": 100 + i % 700,
+            "burden_amount": 300 + (i % 700) * 3,
+            "kaigo_units": 120 if detail else 0,
+            "kaigo_burden": 1200 if detail else 0,
+            "jihi": 500 if detail else 0,
+            "bushan": 0,
+            "zenkai_sagaku": -100 if detail else 0,
+            "receipt_amount": 300 + (i % 700) * 3,
+            "sagaku": 10 if detail else 0,
+            "remarks": "",
+        })
+    return patients
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Notion ページブロック生成のベンチマーク")
+    parser.add_argument("--patients", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--layout", nargs="+", default=["standard", "compact"])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{'レイアウト':<10} {'患者数':>6} {'生成[ms]':>10} {'JSON化[ms]':>10} "
+        f"{'ブロック':>8} {'上位ブロック':>10} {'バイト数':>12} {'リクエスト':>8}"
+    )
+    for layout in args.layout:
+        for n in args.patients:
+            patients = make_patients(n)
+            build_time, blocks = measure(
+                lambda: build_page_blocks(SUMMARY, patients, 10, "file-id", layout=layout), args.repeat
+            )
+            dump_time, payload = measure(
+                lambda: json.dumps({"children": blocks}, ensure_ascii=False).encode("utf-8"), args.repeat
+            )
+            total_blocks = sum(count_blocks(block) for block in blocks)
+            batches = plan_append_batches(blocks)
+            print(
+                f"{layout:<10} {n:>6} {build_time * 1000:>10.2f} {dump_time * 1000:>10.2f} "
+                f"{total_blocks:>8} {len(blocks):>10} {len(payload):>12,} {len(batches):>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
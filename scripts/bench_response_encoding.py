@@ -0,0 +1,115 @@
+"""解析 API のレスポンス: JSON の書き方・患者データの形式・圧縮ごとのサイズと所要時間
+
+患者数ごとに、/api/parse_daily_report と同じ形のレスポンスを作り、
+書き出し（json.dumps + 圧縮）の所要時間と送信バイト数を計測する（Notion には接続しない）。
+
+- pretty:   indent=2（以前の test_server.send_json_response）
+- default:  json.dumps の既定の区切り（", " / ": "、以前の api ハンドラ）
+- compact:  区切りの空白なし（ApiResponse.encode）
+- columnar: compact + 患者データをフィールドごとの配列にしたもの（patients_format=columnar）
+
+それぞれ圧縮なし / gzip / deflate で計測する。
+
+使用方法:
+    python scripts/bench_response_encoding.py [--patients 100 300 600] [--repeat 20]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from utils.app_core import compress
+from utils.patient_file import patients_to_columns
+
+SURNAMES = ["山田", "鈴木", "佐藤", "田中", "高橋", "伊藤", "渡辺", "中村", "小林", "加藤"]
+GIVEN_NAMES = ["太郎", "花子", "一郎", "美咲", "健太", "由美", "翔", "陽子", "大輔", "真由美"]
+INSURANCE_TYPES = ["社本", "社家", "国本", "国家", "後期", "再初診 社本", "保険なし"]
+
+
+def make_patients(count, seed=0):
+    """日計表の患者行に近いダミーデータ"""
+    rng = random.Random(seed)
+    patients = []
+    for i in range(count):
+        points = rng.randint(50, 3000)
+        burden = points * 3 if rng.random() < 0.8 else points
+        jihi = rng.choice([0] * 9 + [rng.randint(1, 50) * 1000])
+        bushan = rng.choice([0] * 9 + [rng.randint(1, 20) * 100])
+        zenkai = rng.choice([0] * 19 + [-rng.randint(1, 20) * 100])
+        receipt = burden + jihi + bushan
+        patients.append({
+            "number": i + 1,
+            "patient_id": f"No.{rng.randint(1000, 99999)}",
+            "name": f"{rng.choice(SURNAMES)}　{rng.choice(GIVEN_NAMES)}",
+            "insurance_type": rng.choice(INSURANCE_TYPES),
+            "points": points,
+            "burden_amount": burden,
+            "kaigo_units": 0,
+            "kaigo_burden": 0,
+            "jihi": jihi,
+            "bushan": bushan,
+            "zenkai_sagaku": zenkai,
+            "receipt_amount": receipt,
+            "sagaku": zenkai,
+            "remarks": rng.choice([""] * 9 + ["訪問"]),
+        })
+    return patients
+
+
+def make_response(patients, columnar):
+    data = {"date": "2025-01-15", "total_count": len(patients),
+            "total_amount": sum(p["receipt_amount"] for p in patients)}
+    response = {"success": True, "data": data, "notion_page_id": "page-1", "updated_existing": False}
+    if columnar:
+        response.update(patients=patients_to_columns(patients), patients_format="columnar")
+    else:
+        response["patients"] = patients
+    return response
+
+
+WRITERS = {
+    "pretty": lambda data: json.dumps(data, ensure_ascii=False, indent=2).encode(),
+    "default": lambda data: json.dumps(data, ensure_ascii=False).encode(),
+    "compact": lambda data: json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode(),
+}
+
+
+def measure(write, encoding, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        body = write()
+        if encoding:
+            body = compress(body, encoding)
+    return len(body), (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="レスポンスのエンコードのベンチマーク")
+    parser.add_argument("--patients", type=int, nargs="+", default=[100, 300, 600])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'患者数':>6} {'形式':<9} {'圧縮':<8} {'バイト数':>10} {'時間[ms]':>9} {'pretty比':>8}")
+    for count in args.patients:
+        patients = make_patients(count)
+        cases = [
+            ("pretty", make_response(patients, False), WRITERS["pretty"]),
+            ("default", make_response(patients, False), WRITERS["default"]),
+            ("compact", make_response(patients, False), WRITERS["compact"]),
+            ("columnar", make_response(patients, True), WRITERS["compact"]),
+        ]
+        baseline = None
+        for label, response, writer in cases:
+            for encoding in (None, "gzip", "deflate"):
+                size, seconds = measure(lambda: writer(response), encoding, args.repeat)
+                baseline = baseline or size
+                print(f"{count:>6} {label:<9} {encoding or '-':<8} {size:>10,} {seconds * 1000:>9.2f} "
+                      f"{size / baseline:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
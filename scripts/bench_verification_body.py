@@ -0,0 +1,90 @@
+"""照合結果リクエスト（/api/update_verification）の JSON と multipart の比較
+
+PDF サイズごとにリクエストボディのサイズと、サーバー側でリクエストを読み込むときの
+ピークメモリ（tracemalloc）を計測する（Notion には接続しない）。
+
+使用方法:
+    python scripts/bench_verification_body.py [--sizes 1 4 10]   # MB 単位
+"""
+import os
+import sys
+import io
+import json
+import base64
+import argparse
+import tracemalloc
+
+# --- update_verification をインポートするための準備 ---
+os.environ.setdefault("NOTION_TOKEN", "test-token")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from update_verification import read_verification_request
+
+BOUNDARY = "----bench-boundary"
+FIELDS = {
+    "notion_page_id": "page-id",
+    "is_matched": "true",
+    "cash_input": "12345",
+    "date": "2025-01-15",
+    "expense_director": "0",
+}
+
+
+def json_request(pdf):
+    body = json.dumps({
+        **FIELDS,
+        "is_matched": True,
+        "cash_input": 12345,
+        "expense_director": 0,
+        "frontend_pdf_base64": base64.b64encode(pdf).decode("ascii"),
+    }).encode("utf-8")
+    return "application/json", body
+
+
+def multipart_request(pdf):
+    parts = []
+    for name, value in FIELDS.items():
+        parts.append(
+            f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode()
+        )
+    parts.append(
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"frontend_pdf\"; filename=\"verification.pdf\"\r\n"
+        f"Content-Type: application/pdf\r\n\r\n".encode()
+    )
+    parts.append(pdf)
+    parts.append(f"\r\n--{BOUNDARY}--\r\n".encode())
+    return f"multipart/form-data; boundary={BOUNDARY}", b"".join(parts)
+
+
+def measure_read(content_type, body):
+    """リクエストを読み込んで PDF を取り出すまでのピークメモリ（バイト）"""
+    rfile = io.BytesIO(body)
+    headers = {"Content-Type": content_type, "Content-Length": str(len(body))}
+    tracemalloc.start()
+    request = read_verification_request(headers, rfile)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(request["frontend_pdf"]) > 0
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="照合結果リクエストの JSON / multipart 比較")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 10])
+    args = parser.parse_args()
+
+    print(f"{'PDF[MB]':>8} {'形式':<10} {'ボディ[bytes]':>14} {'PDF比':>6} {'ピークメモリ[bytes]':>18} {'PDF比':>6}")
+    for size_mb in args.sizes:
+        pdf = os.urandom(int(size_mb * 1024 * 1024))
+        for label, build in [("json", json_request), ("multipart", multipart_request)]:
+            content_type, body = build(pdf)
+            peak = measure_read(content_type, body)
+            print(
+                f"{size_mb:>8g} {label:<10} {len(body):>14,} {len(body) / len(pdf):>6.2f} "
+                f"{peak:>18,} {peak / len(pdf):>6.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""サーバー側で描画する照合画面 PDF のサイズと描画時間の計測
+
+index.html の照合画面と同じ構成の表（本日の残高金種・入金・出金・出納）と日計表 PDF の集計から
+PDF を描画し、サイズと描画時間（中央値）を表示する。--out を指定すると PDF を保存する。
+
+使用方法:
+    python scripts/bench_verification_pdf.py [--repeat 50] [--out verification.pdf]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from utils.verification_pdf import render_verification_pdf
+
+SUMMARY = {
+    "date": "2025-01-15",
+    "shaho_count": 42, "shaho_amount": 98760,
+    "kokuho_count": 18, "kokuho_amount": 45210,
+    "kouki_count": 9, "kouki_amount": 8120,
+    "jihi_count": 2, "jihi_amount": 55000,
+    "hoken_nashi_count": 0, "hoken_nashi_amount": 0,
+    "total_count": 71, "total_points": 40213, "total_amount": 207090,
+    "bushan_amount": 3300, "kaigo_amount": 1200, "zenkai_sagaku": -150,
+    "today_difference": 300,
+}
+
+DENOMINATIONS = [10000, 5000, 2000, 1000, 500, 100, 50, 10, 5, 1]
+
+SHEET = {
+    "sections": [
+        {
+            "title": "本日の残高金種",
+            "column": 0,
+            "header": ["金種", "残高", "ストック", "合計", "金額"],
+            "rows": [[f"{d}円", "3", "" if d >= 1000 else "10", "13", str(13 * d)] for d in DENOMINATIONS]
+            + [["合計", "30", "60", "130", "254300"]],
+            "totals": [len(DENOMINATIONS)],
+        },
+        {
+            "title": "窓口現金入金の記録",
+            "column": 1,
+            "header": ["科目", "入金先", "摘要", "負担額", "当日差額", "入金額"],
+            "rows": [
+                ["前回差額", "繰越", "+", "150", "—", "150"],
+                ["当日差額", "調整", "+", "300", "—", "—"],
+                ["社保", "窓口収入合計", "", "98760", "0", "98760"],
+                ["国保", "窓口収入合計", "", "45210", "0", "45210"],
+                ["後期", "窓口収入合計", "", "8120", "0", "8120"],
+                ["自費", "窓口収入合計", "", "55000", "0", "55000"],
+                ["保険なし", "窓口収入合計", "", "0", "0", "0"],
+                ["物販", "窓口収入合計", "", "3300", "0", "3300"],
+                ["", "", "", "", "", ""],
+                ["", "", "", "", "", ""],
+                ["合計", "71名 40213点", "", "210390", "0", "210840"],
+            ],
+            "totals": [10],
+        },
+        {
+            "title": "窓口現金出金の記録",
+            "column": 1,
+            "header": ["科目", "出金先", "摘要", "出金額"],
+            "rows": [
+                ["消耗品", "薬局", "", "1200"],
+                ["", "", "", ""],
+                ["", "", "", ""],
+                ["院長へ", "", "", "5000"],
+                ["合計", "", "", "6200"],
+            ],
+            "totals": [4],
+        },
+        {
+            "title": "窓口現金出納",
+            "column": 1,
+            "header": [],
+            "rows": [
+                ["前日の繰越", "49660"],
+                ["本日の現金入金", "210840"],
+                ["本日の現金出金", "6200"],
+                ["本日の残高", "254300"],
+            ],
+            "totals": [3],
+        },
+    ]
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="照合画面 PDF の描画ベンチマーク")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--out", help="描画した PDF の保存先")
+    args = parser.parse_args()
+
+    cases = [
+        ("集計のみ", {"summary": SUMMARY}),
+        ("画面の表 + 集計", {"summary": SUMMARY, "sheet": SHEET}),
+    ]
+    print(f"{'内容':<16} {'サイズ[bytes]':>14} {'描画[ms]':>10}")
+    pdf = b""
+    for label, kwargs in cases:
+        durations = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            pdf = render_verification_pdf(True, 254300, 5000, date="2025-01-15",
+                                          verified_at="2025-01-15 18:30", **kwargs)
+            durations.append(time.perf_counter() - started)
+        print(f"{label:<16} {len(pdf):>14,} {statistics.median(durations) * 1000:>10.2f}")
+
+    if args.out:
+        with open(args.out, "wb") as f:
+            f.write(pdf)
+        print(f"保存しました: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
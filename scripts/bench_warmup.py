@@ -0,0 +1,86 @@
+"""新しいプロセスでの最初の PDF 解析と、2 回目以降の解析の所要時間（ウォームアップの有無）
+
+ケースごとに新しい Python プロセスを起動し、parse_daily_report.parse_pdf_bytes の所要時間を計測する
+（Notion には接続しない）。
+
+- cold:   何もせずに解析する（import 直後の最初のリクエストに相当）
+- warmup: 先に warm_pdfminer（CMap の読み込み + サンプル PDF の解析）を実行してから解析する
+
+使用方法:
+    python scripts/bench_warmup.py [--pdf total_d.pdf] [--runs 5] [--repeat 5]
+
+--pdf を省略した場合は utils.warmup.sample_pdf と同じ形の日本語 PDF（表 40 行）で計測する。
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api')
+
+CHILD = """
+import json, os, sys, time
+sys.path.insert(0, {api_dir!r})
+os.environ.setdefault("NOTION_TOKEN", "bench-token")
+os.environ.setdefault("NOTION_DATABASE_ID", "bench-database-id")
+
+started = time.perf_counter()
+import parse_daily_report
+from utils.warmup import warm_pdfminer
+import_ms = (time.perf_counter() - started) * 1000
+
+pdf_path = {pdf_path!r}
+if pdf_path:
+    with open(pdf_path, "rb") as f:
+        data = f.read()
+else:
+    from utils.pdf_canvas import PdfCanvas
+    canvas = PdfCanvas()
+    canvas.text(40, 30, "令和7年1月15日　日計表", 12)
+    for i in range(40):
+        for j, value in enumerate((str(i + 1), "山田　太郎", "社本", "1,500")):
+            canvas.rect(40 + j * 120, 40 + i * 11, 120, 11)
+            canvas.text(44 + j * 120, 49 + i * 11, value, 8)
+    data = canvas.to_bytes()
+
+warmup_ms = 0.0
+if {warmup!r}:
+    started = time.perf_counter()
+    warm_pdfminer()
+    warmup_ms = (time.perf_counter() - started) * 1000
+
+timings = []
+for _ in range({repeat}):
+    started = time.perf_counter()
+    parse_daily_report.parse_pdf_bytes(data)
+    timings.append((time.perf_counter() - started) * 1000)
+print(json.dumps({{"import": import_ms, "warmup": warmup_ms, "parses": timings}}))
+"""
+
+
+def run_child(pdf_path, warmup, repeat):
+    code = CHILD.format(api_dir=API_DIR, pdf_path=pdf_path, warmup=warmup, repeat=repeat)
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ウォームアップの効果のベンチマーク")
+    parser.add_argument("--pdf", default=None, help="計測に使う日計表 PDF（省略時は生成した PDF）")
+    parser.add_argument("--runs", type=int, default=5, help="ケースごとに起動するプロセス数")
+    parser.add_argument("--repeat", type=int, default=5, help="1 プロセスで解析する回数")
+    args = parser.parse_args()
+
+    print(f"{'ケース':<8} {'import[ms]':>10} {'warmup[ms]':>10} {'初回[ms]':>9} {'2回目以降[ms]':>13}")
+    for label, warmup in (("cold", False), ("warmup", True)):
+        results = [run_child(args.pdf, warmup, args.repeat) for _ in range(args.runs)]
+        first = statistics.median(r["parses"][0] for r in results)
+        steady = statistics.median(t for r in results for t in r["parses"][1:])
+        print(f"{label:<8} {statistics.median(r['import'] for r in results):>10.1f} "
+              f"{statistics.median(r['warmup'] for r in results):>10.1f} {first:>9.1f} {steady:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
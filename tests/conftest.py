@@ -7,6 +7,8 @@ os.environ["NOTION_TOKEN"] and imports notion_client at module load time.
 """
 import sys
 import os
+import io
+import http.client
 from unittest.mock import MagicMock
 
 import pytest
@@ -17,10 +19,14 @@ import pytest
 os.environ.setdefault("NOTION_TOKEN", "test-token")
 os.environ.setdefault("NOTION_DATABASE_ID", "test-db-id")
 
-# 2. External modules that are imported at module level
-sys.modules.setdefault("notion_client", MagicMock())
-sys.modules.setdefault("utils", MagicMock())
-sys.modules.setdefault("utils.notion_uploader", MagicMock())
+# 2. External modules that are imported at module level.
+#    notion_client / requests are real dependencies (requirements.txt) and the
+#    api/utils helpers are exercised directly, so only mock notion_client when
+#    it is not installed.
+try:
+    import notion_client  # noqa: F401
+except ModuleNotFoundError:
+    sys.modules["notion_client"] = MagicMock()
 
 # 3. The 'cgi' module was removed in Python 3.13; mock it if unavailable
 try:
@@ -68,3 +74,208 @@ def realistic_first_page():
 def realistic_last_page():
     """Return realistic last-page text with all financial categories."""
     return REALISTIC_LAST_PAGE
+
+
+# ---- Local state isolation ----
+
+@pytest.fixture(autouse=True)
+def isolated_state_dir(tmp_path, monkeypatch):
+    """Keep job queues, checkpoints and caches of each test in its own directory."""
+    monkeypatch.setenv("NIKKEIHYOU_STATE_DIR", str(tmp_path / "state"))
+    for module_name, getter in [
+        ("utils.job_queue", "get_job_queue"),
+        ("utils.checkpoint", "get_checkpoint_store"),
+        ("utils.upload_cache", "get_upload_cache"),
+        ("utils.page_index", "get_page_index"),
+        ("utils.verification_history", "get_verification_history"),
+        ("utils.metrics", "get_metrics_registry"),
+        ("utils.idempotency", "get_idempotency_store"),
+    ]:
+        module = sys.modules.get(module_name)
+        if module is not None:
+            monkeypatch.setattr(getattr(module, getter), "instance", None)
+
+
+# ---- Local Notion stand-in ----
+
+class FakeNotion:
+    """In-memory stand-in for notion_client.Client used by the save/job tests.
+
+    Only the endpoints used by the api modules are implemented. Every call is
+    recorded in ``calls`` as ``(endpoint, kwargs)``, e.g.
+    ``("pages.create", {...})``.
+    """
+
+    def __init__(self):
+        self.pages_by_id = {}
+        self.children = {}
+        self.calls = []
+        self._next_id = 0
+        self.pages = _FakeEndpoint(self, "pages", {"create": self._pages_create, "update": self._pages_update})
+        self.blocks = _FakeEndpoint(self, "blocks", {"delete": self._blocks_delete})
+        self.blocks.children = _FakeEndpoint(
+            self, "blocks.children", {"append": self._children_append, "list": self._children_list}
+        )
+
+    def request(self, path, method, query=None, body=None, auth=None):
+        """Only ``data_sources/<id>/query`` is supported (date filter + pagination)."""
+        self.calls.append(("request", {"path": path, "method": method, "body": body}))
+        assert path.startswith("data_sources/") and path.endswith("/query"), path
+        body = body or {}
+        date_property = body.get("filter", {}).get("property")
+        pages = [
+            {"id": page_id, "properties": page["properties"]}
+            for page_id, page in self.pages_by_id.items()
+            if not date_property or page["properties"].get(date_property)
+        ]
+        start = int(body.get("start_cursor") or 0)
+        size = body.get("page_size", 100)
+        has_more = start + size < len(pages)
+        return {
+            "results": pages[start:start + size],
+            "has_more": has_more,
+            "next_cursor": str(start + size) if has_more else None,
+        }
+
+    def _new_id(self, prefix):
+        self._next_id += 1
+        return f"{prefix}-{self._next_id}"
+
+    def _pages_create(self, parent=None, properties=None, children=None):
+        page_id = self._new_id("page")
+        self.pages_by_id[page_id] = {"parent": parent, "properties": dict(properties or {})}
+        self.children[page_id] = []
+        self._children_append(page_id, children or [])
+        return {"id": page_id}
+
+    def _pages_update(self, page_id, properties=None):
+        self.pages_by_id.setdefault(page_id, {"properties": {}})["properties"].update(properties or {})
+        return {"id": page_id}
+
+    def _children_append(self, block_id, children):
+        results = []
+        for block in children:
+            block = {**block, "id": self._new_id("block")}
+            self.children.setdefault(block_id, []).append(block)
+            results.append(block)
+        return {"results": results}
+
+    def _children_list(self, block_id, page_size=100, start_cursor=None):
+        blocks = self.children.get(block_id, [])
+        start = int(start_cursor or 0)
+        page = blocks[start:start + page_size]
+        has_more = start + page_size < len(blocks)
+        return {
+            "results": page,
+            "has_more": has_more,
+            "next_cursor": str(start + page_size) if has_more else None,
+        }
+
+    def _blocks_delete(self, block_id):
+        for blocks in self.children.values():
+            blocks[:] = [b for b in blocks if b["id"] != block_id]
+        return {"id": block_id, "archived": True}
+
+
+class _FakeEndpoint:
+    def __init__(self, owner, prefix, methods):
+        for name, func in methods.items():
+            setattr(self, name, self._recorded(owner, f"{prefix}.{name}", func))
+
+    @staticmethod
+    def _recorded(owner, name, func):
+        def call(**kwargs):
+            owner.calls.append((name, kwargs))
+            return func(**kwargs)
+        return call
+
+
+@pytest.fixture
+def fake_notion():
+    """Return a fresh in-memory Notion stand-in."""
+    return FakeNotion()
+
+
+# ---- In-process HTTP handler calls ----
+
+@pytest.fixture
+def call_handler():
+    """Run a BaseHTTPRequestHandler subclass without a socket.
+
+    Returns a function ``call(handler_cls, method, path="/", headers=None, body=b"")``
+    that gives back ``(status, response_headers, response_body)``.
+    """
+
+    def call(handler_cls, method, path="/", headers=None, body=b""):
+        headers = dict(headers or {})
+        headers.setdefault("Content-Length", str(len(body)))
+        raw_headers = "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+
+        h = handler_cls.__new__(handler_cls)
+        h.rfile = io.BytesIO(body)
+        h.wfile = io.BytesIO()
+        h.headers = http.client.parse_headers(io.BytesIO(raw_headers.encode("latin-1")))
+        h.command = method
+        h.path = path
+        h.request_version = "HTTP/1.1"
+        h.requestline = f"{method} {path} HTTP/1.1"
+        h.client_address = ("127.0.0.1", 0)
+        h.close_connection = True
+        h.log_message = lambda *args: None
+
+        getattr(h, f"do_{method}")()
+
+        raw = h.wfile.getvalue()
+        head, _, payload = raw.partition(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split()[1])
+        response_headers = {}
+        for line in lines[1:]:
+            key, _, value = line.partition(":")
+            response_headers[key.strip().lower()] = value.strip()
+        return status, response_headers, payload
+
+    return call
+
+
+# ---- Fake clock ----
+
+class FakeClock:
+    """A clock that only moves when a test (or sleep) advances it; sleeps are recorded."""
+
+    def __init__(self, now=0.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+# ---- multipart/form-data bodies ----
+
+BOUNDARY = "----test-boundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def pdf_part(data=b"%PDF-1.4", name="file", filename="report.pdf"):
+    """A file part for ``multipart_body(files=...)``."""
+    return name, filename, "application/pdf", data
+
+
+def multipart_body(fields=None, files=()):
+    """Build a multipart body from ``{name: value}`` fields and ``(name, filename, content_type, data)`` files."""
+    parts = [
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode()
+        for name, value in (fields or {}).items()
+    ]
+    parts.extend(
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"{name}\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: {content_type}\r\n\r\n".encode() + data + b"\r\n"
+        for name, filename, content_type, data in files
+    )
+    parts.append(f"--{BOUNDARY}--\r\n".encode())
+    return b"".join(parts)
@@ -0,0 +1,233 @@
+"""
+Tests for the transport-independent API core (api/utils/app_core.py).
+"""
+import gzip
+import http.client
+import io
+import json
+import zlib
+
+import pytest
+
+import job_status
+import parse_daily_report
+import update_verification
+from utils.app_core import ApiRequest, ApiResponse, Endpoint, find_endpoint, negotiate_encoding
+
+from .conftest import CONTENT_TYPE, multipart_body, pdf_part
+
+
+def request(method, path="/", headers=None, body=b""):
+    raw = "".join(f"{k}: {v}\r\n" for k, v in (headers or {}).items()) + "\r\n"
+    return ApiRequest(method, path, http.client.parse_headers(io.BytesIO(raw.encode())), io.BytesIO(body))
+
+
+class TestEndpoint:
+
+    def test_options_returns_cors_headers(self):
+        endpoint = Endpoint({"POST": lambda r: ApiResponse(200, {})}, allow_headers="Content-Type, Prefer")
+        response = endpoint.handle(request("OPTIONS"))
+        assert response.status == 200
+        assert response.headers["Access-Control-Allow-Methods"] == "POST, OPTIONS"
+        assert response.headers["Access-Control-Allow-Headers"] == "Content-Type, Prefer"
+
+    def test_unknown_method_closes_connection(self):
+        response = Endpoint({"GET": lambda r: ApiResponse(200, {})}).handle(request("POST"))
+        assert response.status == 405
+        header_items, _ = response.encode()
+        assert ("Connection", "close") in header_items
+
+    def test_exception_becomes_500(self):
+        def fail(r):
+            raise RuntimeError("boom")
+
+        response = Endpoint({"GET": fail}).handle(request("GET"))
+        assert response.status == 500
+        assert json.loads(response.encode()[1]) == {"success": False, "error": "boom"}
+
+    def test_response_headers_keep_handler_values(self):
+        endpoint = Endpoint({"GET": lambda r: ApiResponse(200, {"ok": 1}, {"Server-Timing": "x;dur=1"})},
+                            expose_headers="Server-Timing")
+        response = endpoint.handle(request("GET"))
+        header_items, body = response.encode()
+        items = dict(header_items)
+        assert items["Server-Timing"] == "x;dur=1"
+        assert items["Access-Control-Expose-Headers"] == "Server-Timing"
+        assert items["Content-Length"] == str(len(body))
+
+
+class TestRouting:
+
+    def test_api_paths_map_to_module_endpoints(self):
+        assert find_endpoint("/api/parse_daily_report") is parse_daily_report.ENDPOINT
+        assert find_endpoint("/api/update_verification") is update_verification.ENDPOINT
+        assert find_endpoint("/api/job_status?id=1") is job_status.ENDPOINT
+        assert find_endpoint("/index.html") is None
+
+    def test_query_parameters(self):
+        response = job_status.ENDPOINT.handle(request("GET", "/api/job_status?id=missing"))
+        assert response.status == 404
+        assert response.data["error"] == "Job not found"
+
+
+class TestCompression:
+
+    PAYLOAD = {"patients": [{"number": i, "name": "山田太郎", "points": 500} for i in range(100)]}
+
+    @pytest.mark.parametrize("accept, expected", [
+        ("gzip, deflate, br", "gzip"),
+        ("deflate", "deflate"),
+        ("gzip;q=0.5, deflate", "deflate"),
+        ("gzip;q=0, *", "deflate"),
+        ("br", None),
+        ("", None),
+        (None, None),
+    ])
+    def test_negotiate_encoding(self, accept, expected):
+        assert negotiate_encoding(accept) == expected
+
+    @pytest.mark.parametrize("encoding, decompress", [
+        ("gzip", gzip.decompress),
+        ("deflate", zlib.decompress),
+    ])
+    def test_large_json_is_compressed(self, encoding, decompress):
+        endpoint = Endpoint({"GET": lambda r: ApiResponse(200, self.PAYLOAD)})
+        response = endpoint.handle(request("GET", headers={"Accept-Encoding": encoding}))
+        header_items, body = response.encode()
+        items = dict(header_items)
+        assert items["Content-Encoding"] == encoding
+        assert items["Vary"] == "Accept-Encoding"
+        assert items["Content-Length"] == str(len(body))
+        raw = decompress(body)
+        assert json.loads(raw) == self.PAYLOAD
+        assert b", " not in raw and b": " not in raw  # 区切りの空白なし
+
+    def test_small_json_is_not_compressed(self):
+        endpoint = Endpoint({"GET": lambda r: ApiResponse(200, {"success": True})})
+        response = endpoint.handle(request("GET", headers={"Accept-Encoding": "gzip"}))
+        header_items, body = response.encode()
+        assert "Content-Encoding" not in dict(header_items)
+        assert body == b'{"success":true}'
+
+    def test_handler_sends_compressed_body(self, call_handler):
+        status, headers, payload = call_handler(
+            job_status.handler, "GET", path="/api/job_status?id=missing",
+            headers={"Accept-Encoding": "gzip"},
+        )
+        assert status == 404
+        assert "content-encoding" not in headers  # 小さいレスポンスはそのまま
+        assert json.loads(payload)["error"] == "Job not found"
+
+
+class TestPatientsFormat:
+
+    PATIENTS = [
+        {"number": 1, "patient_id": "No.1", "name": "山田太郎", "insurance_type": "社本", "points": 500},
+        {"number": 2, "patient_id": "No.2", "name": "鈴木花子", "insurance_type": "国本", "points": 300},
+    ]
+
+    @pytest.fixture
+    def parse(self, call_handler, monkeypatch):
+        summary = {"date": "2025-01-15", "zenkai_sagaku": 0}
+        monkeypatch.setattr(parse_daily_report, "parse_pdf",
+                            lambda f: {"summary": {**summary}, "patients": [dict(p) for p in self.PATIENTS]})
+        monkeypatch.setattr(parse_daily_report, "upsert_daily_report", lambda *args: ("page-1", False))
+
+        def parse(fields):
+            body = multipart_body(fields, [pdf_part()])
+            status, _, payload = call_handler(
+                parse_daily_report.handler, "POST", path="/api/parse_daily_report",
+                headers={"Content-Type": CONTENT_TYPE}, body=body,
+            )
+            return status, json.loads(payload)
+
+        return parse
+
+    def test_rows_by_default(self, parse):
+        status, result = parse({})
+        assert status == 200
+        assert [p["name"] for p in result["patients"]] == ["山田太郎", "鈴木花子"]
+        assert "patients_format" not in result
+
+    def test_columnar(self, parse):
+        status, result = parse({"patients_format": "columnar"})
+        assert status == 200
+        assert result["patients_format"] == "columnar"
+        assert result["patients"]["name"] == ["山田太郎", "鈴木花子"]
+        assert result["patients"]["points"] == [500, 300]
+        assert result["patients"]["remarks"] == ["", ""]
+
+    def test_unknown_format_is_bad_request(self, parse):
+        status, result = parse({"patients_format": "xml"})
+        assert status == 400
+
+
+class TestParseStream:
+
+    SUMMARY = {"date": "2025-01-15", "zenkai_sagaku": -100}
+    PAGES = [
+        [{"number": 1, "name": "山田太郎", "insurance_type": "社本", "sagaku": 0}],
+        [],
+        [{"number": 2, "name": "鈴木花子", "insurance_type": "国本", "sagaku": -100}],
+    ]
+
+    @pytest.fixture
+    def stream(self, call_handler, monkeypatch):
+        def fake_iter_parse_pdf(pdf_file):
+            yield "summary", dict(self.SUMMARY)
+            for page in self.PAGES:
+                yield "patients", [dict(p) for p in page]
+
+        monkeypatch.setattr(parse_daily_report, "iter_parse_pdf", fake_iter_parse_pdf)
+        monkeypatch.setattr(parse_daily_report, "upsert_daily_report", lambda *args: ("page-1", True))
+
+        def stream(path="/api/parse_daily_report", headers=None, fields=None):
+            return call_handler(
+                parse_daily_report.handler, "POST", path=path,
+                headers={"Content-Type": CONTENT_TYPE, **(headers or {})}, body=multipart_body(fields, [pdf_part()]),
+            )
+
+        return stream
+
+    @staticmethod
+    def records(payload):
+        return [json.loads(line) for line in payload.decode().splitlines()]
+
+    @pytest.mark.parametrize("path, headers", [
+        ("/api/parse_daily_report", {"Accept": "application/x-ndjson"}),
+        ("/api/parse_daily_report?stream=1", {}),
+    ])
+    def test_records_in_order(self, stream, path, headers):
+        status, response_headers, payload = stream(path, headers)
+        assert status == 200
+        assert response_headers["content-type"] == "application/x-ndjson"
+        records = self.records(payload)
+        assert [r["type"] for r in records] == ["summary", "patients", "patients", "data", "result"]
+        assert records[0]["data"]["previous_difference"] == -100
+        assert records[2]["patients"][0]["name"] == "鈴木花子"
+        assert records[3]["data"]["today_difference"] == -100
+        assert records[4]["notion_page_id"] == "page-1"
+        assert records[4]["updated_existing"] is True
+        assert set(records[4]["timings"]) == {"summary", "parse", "notion", "total"}
+
+    def test_job_mode(self, stream, monkeypatch):
+        monkeypatch.setattr(parse_daily_report, "enqueue_save_job", lambda *args: "job-1")
+        _, _, payload = stream(fields={"mode": "job"}, headers={"Accept": "application/x-ndjson"})
+        result = self.records(payload)[-1]
+        assert result["notion_page_id"] is None
+        assert result["job_status_url"] == "/api/job_status?id=job-1"
+
+    def test_failure_is_reported_in_stream(self, stream, monkeypatch):
+        def fail(*args):
+            raise RuntimeError("Notion is down")
+
+        monkeypatch.setattr(parse_daily_report, "upsert_daily_report", fail)
+        _, _, payload = stream(headers={"Accept": "application/x-ndjson"})
+        records = self.records(payload)
+        assert records[-2]["type"] == "data"
+        assert records[-1] == {"type": "error", "success": False, "error": "Notion is down"}
+
+    def test_compressed_stream_can_be_decoded_line_by_line(self, stream):
+        _, headers, payload = stream(headers={"Accept": "application/x-ndjson", "Accept-Encoding": "gzip"})
+        assert headers["content-encoding"] == "gzip"
+        assert [r["type"] for r in self.records(gzip.decompress(payload))][-1] == "result"
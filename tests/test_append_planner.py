@@ -0,0 +1,153 @@
+"""
+Tests for the Notion append planner (api/utils/append_planner.py) and its
+use in save_to_notion / update_notion_page.
+"""
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import parse_daily_report
+from parse_daily_report import build_page_blocks, save_to_notion, update_notion_page
+from utils.append_planner import (
+    MAX_CHILDREN_PER_REQUEST,
+    block_payload_size,
+    count_blocks,
+    plan_append_batches,
+)
+
+
+def make_patient(number, sagaku=0):
+    return {
+        "number": number,
+        "patient_id": f"No.{10000 + number}",
+        "name": f"患者{number}",
+        "insurance_type": "社本",
+        "points": 100,
+        "burden_amount": 300,
+        "kaigo_units": 0,
+        "kaigo_burden": 0,
+        "jihi": 0,
+        "bushan": 0,
+        "zenkai_sagaku": 0,
+        "receipt_amount": 300,
+        "sagaku": sagaku,
+        "remarks": "",
+    }
+
+
+SUMMARY = {
+    "date": "2025-01-15",
+    "shaho_count": 0, "shaho_amount": 0,
+    "kokuho_count": 0, "kokuho_amount": 0,
+    "kouki_count": 0, "kouki_amount": 0,
+    "jihi_count": 0, "jihi_amount": 0,
+    "hoken_nashi_count": 0, "hoken_nashi_amount": 0,
+    "total_count": 0, "total_points": 0, "total_amount": 0,
+    "bushan_amount": 0, "kaigo_amount": 0, "zenkai_sagaku": 0,
+}
+
+
+def paragraph(text):
+    return {
+        "object": "block",
+        "type": "paragraph",
+        "paragraph": {"rich_text": [{"type": "text", "text": {"content": text}}]},
+    }
+
+
+# ============================================================
+# plan_append_batches
+# ============================================================
+
+class TestPlanAppendBatches:
+
+    def test_empty(self):
+        assert plan_append_batches([]) == []
+
+    def test_splits_at_children_limit_and_keeps_order(self):
+        blocks = [paragraph(str(i)) for i in range(250)]
+        batches = plan_append_batches(blocks)
+
+        assert [len(b) for b in batches] == [100, 100, 50]
+        assert [b for batch in batches for b in batch] == blocks
+
+    def test_counts_nested_table_rows(self):
+        """A table with 10 rows counts as 11 blocks toward the 1000-block limit."""
+        blocks = build_page_blocks(SUMMARY, [make_patient(i) for i in range(10)], 0, "f")
+        table = next(b for b in blocks if b["type"] == "table" and b["table"]["table_width"] == 7)
+        assert count_blocks(table) == 12  # table + header + 10 rows
+
+        batches = plan_append_batches([table] * 200, max_blocks=100)
+        assert all(sum(count_blocks(b) for b in batch) <= 100 for batch in batches)
+
+    def test_respects_byte_budget(self):
+        blocks = [paragraph("x" * 1000) for _ in range(20)]
+        batches = plan_append_batches(blocks, max_bytes=5000)
+        assert len(batches) > 1
+        assert all(len(batch) <= 4 for batch in batches)
+
+    def test_reserved_bytes_only_shrink_first_batch(self):
+        blocks = [paragraph("x" * 1000) for _ in range(20)]
+        batches = plan_append_batches(blocks, reserved_bytes=3000, max_bytes=5000)
+        assert len(batches[0]) < len(batches[1])
+
+    def test_first_block_too_large_for_page_create_gets_its_own_batch(self):
+        blocks = [paragraph("x" * 4000), paragraph("y")]
+        assert block_payload_size(blocks[0]) > 5000 - 3000
+
+        batches = plan_append_batches(blocks, reserved_bytes=3000, max_bytes=5000)
+        assert batches == [[], blocks]
+
+    def test_oversized_block_raises(self):
+        with pytest.raises(ValueError):
+            plan_append_batches([paragraph("x" * 1000)], max_bytes=100)
+
+
+# ============================================================
+# save_to_notion / update_notion_page
+# ============================================================
+
+class TestSaveToNotionBatching:
+
+    @patch("parse_daily_report.upload_file_to_notion", return_value="file-1")
+    def test_first_batch_sent_with_page_create(self, _upload):
+        notion = MagicMock()
+        notion.pages.create.return_value = {"id": "page-1"}
+        patients = [make_patient(i, sagaku=10) for i in range(1, 121)]
+
+        with patch.object(parse_daily_report, "notion", notion):
+            page_id = save_to_notion(b"%PDF", SUMMARY, patients, 0)
+
+        assert page_id == "page-1"
+        blocks = build_page_blocks(SUMMARY, patients, 0, "file-1")
+        assert len(blocks) > MAX_CHILDREN_PER_REQUEST
+
+        first = notion.pages.create.call_args.kwargs["children"]
+        appended = [c.kwargs["children"] for c in notion.blocks.children.append.call_args_list]
+        assert all(len(batch) <= MAX_CHILDREN_PER_REQUEST for batch in [first] + appended)
+        assert first + [b for batch in appended for b in batch] == blocks
+
+    @patch("parse_daily_report.upload_file_to_notion", return_value="file-1")
+    def test_small_report_needs_no_append(self, _upload):
+        notion = MagicMock()
+        notion.pages.create.return_value = {"id": "page-1"}
+
+        with patch.object(parse_daily_report, "notion", notion):
+            save_to_notion(b"%PDF", SUMMARY, [make_patient(1)], 0)
+
+        notion.blocks.children.append.assert_not_called()
+
+    @patch("parse_daily_report.upload_file_to_notion", return_value="file-1")
+    def test_update_deletes_all_pages_of_children(self, _upload):
+        notion = MagicMock()
+        notion.blocks.children.list.side_effect = [
+            {"results": [{"id": "a"}, {"id": "b"}], "has_more": True, "next_cursor": "c1"},
+            {"results": [{"id": "c"}], "has_more": False, "next_cursor": None},
+        ]
+
+        with patch.object(parse_daily_report, "notion", notion):
+            update_notion_page("page-1", b"%PDF", SUMMARY, [make_patient(1)], 0)
+
+        deleted = [c.kwargs["block_id"] for c in notion.blocks.delete.call_args_list]
+        assert deleted == ["a", "b", "c"]
+        assert notion.blocks.children.list.call_args_list[1].kwargs["start_cursor"] == "c1"
@@ -0,0 +1,182 @@
+"""
+Tests for the asyncio local server (api/utils/async_server.py).
+"""
+import asyncio
+import http.client
+import json
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+import job_status
+import parse_daily_report
+import update_verification
+from utils.async_server import AsyncServer
+
+
+@pytest.fixture
+def server():
+    loop = asyncio.new_event_loop()
+    server = AsyncServer(api_workers=4, keepalive=2)
+    loop.run_until_complete(server.start("127.0.0.1", 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield server
+    asyncio.run_coroutine_threadsafe(server.close(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    loop.close()
+
+
+def connect(server):
+    return http.client.HTTPConnection(*server.sockets[0].getsockname()[:2], timeout=5)
+
+
+class TestAsyncServer:
+
+    def test_keep_alive_for_static_and_api(self, server):
+        conn = connect(server)
+
+        conn.request("GET", "/")
+        response = conn.getresponse()
+        assert response.status == 200
+        assert response.getheader("Content-Type") == "text/html"
+        assert b"<html" in response.read().lower()
+        sock = conn.sock
+
+        conn.request("GET", "/api/job_status?id=missing")
+        response = conn.getresponse()
+        assert response.status == 404
+        assert json.loads(response.read())["error"] == "Job not found"
+        assert response.getheader("Access-Control-Allow-Origin") == "*"
+        assert conn.sock is sock  # 同じ接続が再利用された
+        conn.close()
+
+    def test_path_outside_public_is_not_found(self, server):
+        conn = connect(server)
+        conn.request("GET", "/../api/job_status.py")
+        assert conn.getresponse().status == 404
+        conn.close()
+
+    def test_slow_api_does_not_block_other_requests(self, server, monkeypatch):
+        def slow_status(job_id):
+            time.sleep(0.5)
+            return 404, {"success": False, "error": "Job not found"}
+
+        monkeypatch.setattr(job_status, "job_status_response", slow_status)
+
+        def get(path):
+            conn = connect(server)
+            started = time.perf_counter()
+            conn.request("GET", path)
+            conn.getresponse().read()
+            conn.close()
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            slow = [pool.submit(get, "/api/job_status?id=x") for _ in range(2)]
+            time.sleep(0.05)
+            static = pool.submit(get, "/index.html")
+            assert static.result() < 0.3
+            # 2 件の遅い API は並行して処理される
+            assert all(0.5 <= f.result() < 0.9 for f in slow)
+
+    def test_posts_verification(self, server, fake_notion, monkeypatch):
+        monkeypatch.setattr(update_verification, "notion", fake_notion)
+        body = json.dumps({
+            "notion_page_id": "page-1",
+            "is_matched": True,
+            "cash_input": 12000,
+            "date": "2025-01-15",
+            "summary": {"date": "2025-01-15", "total_amount": 812000},
+        }).encode()
+
+        with patch("update_verification.upload_file_to_notion", return_value="file-1"):
+            conn = connect(server)
+            conn.request("POST", "/api/update_verification", body=body,
+                         headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            assert response.status == 200
+            assert json.loads(response.read()) == {"success": True}
+            assert "render" in response.getheader("Server-Timing")
+            conn.close()
+
+    def test_large_upload_is_spooled_once(self, server, fake_notion, monkeypatch):
+        """The body is written to one temporary file and the PDF part is read straight from it."""
+        monkeypatch.setattr("utils.async_server.UPLOAD_SPOOL_THRESHOLD", 1000)
+        monkeypatch.setattr(parse_daily_report, "notion", fake_notion)
+        pdf = b"%PDF-1.4\n" + bytes(range(256)) * 40
+        seen = {}
+
+        def fake_parse_pdf(pdf_file):
+            seen["pdf"] = pdf_file.read()
+            raise ValueError("not a daily report")
+
+        boundary = "async-boundary"
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.pdf\"\r\n"
+                f"Content-Type: application/pdf\r\n\r\n").encode() + pdf + f"\r\n--{boundary}--\r\n".encode()
+        with patch("utils.request_body._SpoolSink", side_effect=AssertionError("spooled twice")), \
+                patch("parse_daily_report.parse_pdf", side_effect=fake_parse_pdf), \
+                patch("parse_daily_report.iter_parse_pdf", side_effect=fake_parse_pdf):
+            conn = connect(server)
+            conn.request("POST", "/api/parse_daily_report", body=body,
+                         headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+        assert seen["pdf"] == pdf
+
+    def test_too_large_body_is_rejected_without_reading(self, server, monkeypatch):
+        monkeypatch.setattr("utils.async_server.MAX_UPLOAD_BYTES", 1000)
+        sock = socket.create_connection(server.sockets[0].getsockname()[:2], timeout=5)
+        sock.sendall(b"POST /api/parse_daily_report HTTP/1.1\r\nHost: x\r\n"
+                     b"Content-Type: multipart/form-data; boundary=b\r\n"
+                     b"Content-Length: 999999999\r\n\r\n")
+        response = http.client.HTTPResponse(sock)
+        response.begin()
+        assert response.status == 413
+        assert response.getheader("Connection") == "close"
+        sock.close()
+
+    def test_unknown_post_path(self, server):
+        conn = connect(server)
+        conn.request("POST", "/api/unknown", body=b"{}")
+        response = conn.getresponse()
+        assert response.status == 404
+        assert response.getheader("Connection") == "close"
+        conn.close()
+
+    def test_streams_records_as_they_are_produced(self, server, monkeypatch):
+        release = threading.Event()
+
+        def fake_iter_parse_pdf(pdf_file):
+            yield "summary", {"date": "2025-01-15", "zenkai_sagaku": 0}
+            assert release.wait(5)  # 表の抽出に時間がかかる
+            yield "patients", [{"number": 1, "name": "山田太郎", "insurance_type": "社本", "sagaku": 0}]
+
+        monkeypatch.setattr(parse_daily_report, "iter_parse_pdf", fake_iter_parse_pdf)
+        monkeypatch.setattr(parse_daily_report, "upsert_daily_report", lambda *args: ("page-1", False))
+        body = (b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"r.pdf\"\r\n\r\n"
+                b"%PDF-1.4\r\n--b--\r\n")
+
+        conn = connect(server)
+        conn.request("POST", "/api/parse_daily_report?stream=1", body=body,
+                     headers={"Content-Type": "multipart/form-data; boundary=b"})
+        response = conn.getresponse()
+        assert response.getheader("Transfer-Encoding") == "chunked"
+        # 解析が終わる前に集計データが届く
+        assert json.loads(response.readline())["type"] == "summary"
+        release.set()
+        records = [json.loads(line) for line in response.read().splitlines()]
+        assert [r["type"] for r in records] == ["patients", "data", "result"]
+
+        # chunked で終わりが分かるので同じ接続を使い続けられる
+        sock = conn.sock
+        conn.request("GET", "/api/job_status?id=missing")
+        assert conn.getresponse().status == 404
+        assert conn.sock is sock
+        conn.close()
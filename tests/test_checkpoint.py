@@ -0,0 +1,217 @@
+"""
+Tests for resumable save_to_notion / update_notion_page
+(api/utils/checkpoint.py), using the in-memory Notion stand-in.
+"""
+import sqlite3
+from unittest.mock import patch
+
+import httpx
+import pytest
+from notion_client.errors import APIErrorCode, APIResponseError
+
+import parse_daily_report
+from parse_daily_report import save_to_notion, update_notion_page
+from utils.checkpoint import (
+    FILE_UPLOAD_REUSE_SECONDS,
+    CheckpointStore,
+    content_hash,
+    get_checkpoint_store,
+    reusable_file_upload_id,
+)
+
+
+SUMMARY = {
+    "date": "2025-01-15",
+    "shaho_count": 0, "shaho_amount": 0,
+    "kokuho_count": 0, "kokuho_amount": 0,
+    "kouki_count": 0, "kouki_amount": 0,
+    "jihi_count": 0, "jihi_amount": 0,
+    "hoken_nashi_count": 0, "hoken_nashi_amount": 0,
+    "total_count": 0, "total_points": 0, "total_amount": 0,
+    "bushan_amount": 0, "kaigo_amount": 0, "zenkai_sagaku": 0,
+}
+
+
+def make_patients(n):
+    return [
+        {
+            "number": i, "patient_id": f"No.{i}", "name": f"患者{i}", "insurance_type": "国本",
+            "points": 10, "burden_amount": 30, "kaigo_units": 0, "kaigo_burden": 0,
+            "jihi": 0, "bushan": 0, "zenkai_sagaku": 0, "receipt_amount": 30,
+            "sagaku": 5, "remarks": "",
+        }
+        for i in range(1, n + 1)
+    ]
+
+
+class FlakyAppend:
+    """Make blocks.children.append fail once on the given call number."""
+
+    def __init__(self, notion, fail_on_call):
+        self.original = notion.blocks.children.append
+        self.fail_on_call = fail_on_call
+        self.count = 0
+        notion.blocks.children.append = self
+
+    def __call__(self, **kwargs):
+        self.count += 1
+        if self.count == self.fail_on_call:
+            raise RuntimeError("Notion timeout")
+        return self.original(**kwargs)
+
+
+def endpoint_calls(notion, name):
+    return [kwargs for endpoint, kwargs in notion.calls if endpoint == name]
+
+
+# ============================================================
+# CheckpointStore
+# ============================================================
+
+class TestCheckpointStore:
+
+    def test_update_merges_fields(self, tmp_path):
+        store = CheckpointStore(str(tmp_path / "cp.sqlite3"))
+        store.update("k", file_upload_id="f")
+        store.update("k", page_id="p")
+        assert store.get("k") == {"file_upload_id": "f", "page_id": "p"}
+
+        store.clear("k")
+        assert store.get("k") == {}
+
+    def test_old_checkpoints_are_pruned(self, tmp_path):
+        path = str(tmp_path / "cp.sqlite3")
+        now = [1000.0]
+        store = CheckpointStore(path, retention=3600, clock=lambda: now[0])
+        store.update("old", page_id="p1")
+        now[0] += 1800
+        store.update("old", appended=2)  # updating does not extend the retention
+        store.update("new", page_id="p2")
+
+        now[0] += 1801
+        reopened = CheckpointStore(path, retention=3600, clock=lambda: now[0])
+        assert reopened.get("old") == {}
+        assert reopened.get("new") == {"page_id": "p2"}
+
+    def test_old_checkpoint_file_is_migrated(self, tmp_path):
+        path = str(tmp_path / "cp.sqlite3")
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE checkpoints (key TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)")
+            conn.execute("INSERT INTO checkpoints VALUES ('recent', '{\"page_id\": \"p\"}', 4000.0)")
+            conn.execute("INSERT INTO checkpoints VALUES ('stale', '{}', 1.0)")
+        conn.close()
+
+        store = CheckpointStore(path, retention=3600, clock=lambda: 5000.0)
+        assert store.get("recent") == {"page_id": "p"}
+        with sqlite3.connect(path) as conn:
+            assert [row[0] for row in conn.execute("SELECT key FROM checkpoints")] == ["recent"]
+        conn.close()
+
+    def test_expired_file_upload_is_not_reused(self):
+        checkpoint = {"file_upload_id": "f", "file_uploaded_at": 1000.0}
+        assert reusable_file_upload_id(checkpoint, now=1000.0 + 60) == "f"
+        assert reusable_file_upload_id(checkpoint, now=1000.0 + FILE_UPLOAD_REUSE_SECONDS) is None
+
+
+# ============================================================
+# save_to_notion
+# ============================================================
+
+class TestResumableSave:
+
+    @patch("parse_daily_report.upload_file_to_notion", return_value="file-1")
+    def test_retry_resumes_after_failed_append(self, mock_upload, fake_notion, monkeypatch):
+        monkeypatch.setattr(parse_daily_report, "notion", fake_notion)
+        patients = make_patients(300)  # pages.create + 3 appends
+        flaky = FlakyAppend(fake_notion, fail_on_call=2)
+
+        with pytest.raises(RuntimeError):
+            save_to_notion(b"%PDF-1", SUMMARY, patients, 0)
+
+        page_id = save_to_notion(b"%PDF-1", SUMMARY, patients, 0)
+
+        assert mock_upload.call_count == 1
+        assert len(endpoint_calls(fake_notion, "pages.create")) == 1
+        expected = parse_daily_report.build_page_blocks(SUMMARY, patients, 0, "file-1")
+        stored = [{k: v for k, v in b.items() if k != "id"} for b in fake_notion.children[page_id]]
+        assert stored == expected
+        assert flaky.count == 4  # 1 ok + 1 failed, then only the 2 remaining batches
+
+    @patch("parse_daily_report.upload_file_to_notion", return_value="file-1")
+    def test_retry_after_failed_create_reuses_upload(self, mock_upload, fake_notion, monkeypatch):
+        monkeypatch.setattr(parse_daily_report, "notion", fake_notion)
+        original_create = fake_notion.pages.create
+        fake_notion.pages.create = lambda **kwargs: (_ for _ in ()).throw(RuntimeError("503"))
+
+        with pytest.raises(Exception):
+            save_to_notion(b"%PDF-2", SUMMARY, make_patients(3), 0)
+
+        fake_notion.pages.create = original_create
+        save_to_notion(b"%PDF-2", SUMMARY, make_patients(3), 0)
+        assert mock_upload.call_count == 1
+
+    @pytest.mark.parametrize("error", [
+        APIResponseError(httpx.Response(404), "Could not find block with ID", APIErrorCode.ObjectNotFound),
+        APIResponseError(httpx.Response(400), "Can't edit block that is archived.", APIErrorCode.ValidationError),
+    ])
+    @patch("parse_daily_report.upload_file_to_notion", side_effect=["file-1", "file-2"])
+    def test_deleted_checkpoint_page_is_recreated(self, mock_upload, fake_notion, monkeypatch, error):
+        monkeypatch.setattr(parse_daily_report, "notion", fake_notion)
+        patients = make_patients(300)
+        FlakyAppend(fake_notion, fail_on_call=2)
+        with pytest.raises(RuntimeError):
+            save_to_notion(b"%PDF-5", SUMMARY, patients, 0)
+        [stale_id] = fake_notion.pages_by_id
+
+        append = fake_notion.blocks.children.append
+
+        def append_or_missing(**kwargs):
+            if kwargs["block_id"] == stale_id:
+                raise error
+            return append(**kwargs)
+
+        fake_notion.blocks.children.append = append_or_missing
+        page_id = save_to_notion(b"%PDF-5", SUMMARY, patients, 0)
+
+        assert page_id != stale_id
+        assert mock_upload.call_count == 2  # 削除されたページに添付したファイルは使い回さない
+        expected = parse_daily_report.build_page_blocks(SUMMARY, patients, 0, "file-2")
+        assert [{k: v for k, v in b.items() if k != "id"} for b in fake_notion.children[page_id]] == expected
+        assert get_checkpoint_store().get(f"save:{content_hash(b'%PDF-5')}") == {}
+
+    @patch("parse_daily_report.upload_file_to_notion", side_effect=["file-1", "file-2"])
+    def test_checkpoint_cleared_after_success(self, mock_upload, fake_notion, monkeypatch):
+        monkeypatch.setattr(parse_daily_report, "notion", fake_notion)
+
+        first = save_to_notion(b"%PDF-3", SUMMARY, make_patients(1), 0)
+        second = save_to_notion(b"%PDF-3", SUMMARY, make_patients(1), 0)
+
+        assert first != second
+        assert mock_upload.call_count == 2
+
+
+# ============================================================
+# update_notion_page
+# ============================================================
+
+class TestResumableUpdate:
+
+    @patch("parse_daily_report.upload_file_to_notion", return_value="file-9")
+    def test_retry_does_not_delete_newly_appended_blocks(self, mock_upload, fake_notion, monkeypatch):
+        monkeypatch.setattr(parse_daily_report, "notion", fake_notion)
+        fake_notion.children["page-x"] = [{"id": "old-1", "type": "paragraph"}]
+        patients = make_patients(150)
+        FlakyAppend(fake_notion, fail_on_call=2)
+
+        with pytest.raises(RuntimeError):
+            update_notion_page("page-x", b"%PDF-4", SUMMARY, patients, 0)
+
+        update_notion_page("page-x", b"%PDF-4", SUMMARY, patients, 0)
+
+        assert mock_upload.call_count == 1
+        assert len(endpoint_calls(fake_notion, "pages.update")) == 1
+        assert len(endpoint_calls(fake_notion, "blocks.delete")) == 1
+        expected = parse_daily_report.build_page_blocks(SUMMARY, patients, 0, "file-9")
+        stored = [{k: v for k, v in b.items() if k != "id"} for b in fake_notion.children["page-x"]]
+        assert stored == expected
+        assert get_checkpoint_store().get(f"update:page-x:{content_hash(b'%PDF-4')}") == {}
@@ -0,0 +1,246 @@
+"""
+Tests for the request time budget (api/utils/deadline.py): the deadline checks
+and per-call timeouts of the Notion rate limiter, and deferring the rest of a
+Notion save to a job when /api/parse_daily_report runs out of time.
+"""
+import json
+from unittest.mock import patch
+
+import httpx
+import pytest
+import requests
+
+import parse_daily_report
+from utils import job_queue, notion_rate_limit
+from utils.deadline import UNLIMITED, Deadline, DeadlineExceeded, current_deadline, deadline_scope
+from utils.job_queue import DONE, JobQueue
+from utils.notion_rate_limit import RateLimitedClient, RetryPolicy, TokenBucket, call_with_limits, notion_request
+
+from .conftest import CONTENT_TYPE, FakeClock, multipart_body, pdf_part
+
+
+SUMMARY = {
+    "date": "2025-01-15",
+    "shaho_count": 1, "shaho_amount": 300,
+    "kokuho_count": 0, "kokuho_amount": 0,
+    "kouki_count": 0, "kouki_amount": 0,
+    "jihi_count": 0, "jihi_amount": 0,
+    "hoken_nashi_count": 0, "hoken_nashi_amount": 0,
+    "total_count": 1, "total_points": 100, "total_amount": 300,
+    "bushan_amount": 0, "kaigo_amount": 0, "zenkai_sagaku": 0,
+}
+
+PATIENT = {
+    "number": 1, "patient_id": "No.1", "name": "山田太郎", "insurance_type": "社本",
+    "points": 100, "burden_amount": 300, "kaigo_units": 0, "kaigo_burden": 0,
+    "jihi": 0, "bushan": 0, "zenkai_sagaku": 0, "receipt_amount": 300,
+    "sagaku": 0, "remarks": "",
+}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Drive the deadline, the rate limiter and retry sleeps from one fake clock."""
+    clock = FakeClock()
+    monkeypatch.setattr(notion_rate_limit, "bucket", TokenBucket(1000, 1000, clock=clock, sleep=clock.sleep))
+    monkeypatch.setattr(notion_rate_limit, "retry_policy", RetryPolicy(max_retries=3))
+    monkeypatch.setattr(notion_rate_limit.time, "sleep", clock.sleep)
+    return clock
+
+
+# ============================================================
+# Deadline
+# ============================================================
+
+class TestDeadline:
+
+    def test_remaining_and_check(self, clock):
+        deadline = Deadline(10, reserve=2, clock=clock)
+        assert deadline.remaining() == 8
+        clock.now = 7.5
+        assert deadline.remaining() == 0.5
+        deadline.check(0.5)
+        with pytest.raises(DeadlineExceeded, match="before saving"):
+            deadline.check(1.0, "saving")
+
+    def test_timeout_is_capped_by_remaining_time(self, clock):
+        deadline = Deadline(10, reserve=0, clock=clock)
+        clock.now = 7
+        assert deadline.timeout(60) == 3
+        assert deadline.timeout(2) == 2
+        assert deadline.timeout() == 3
+
+    def test_unlimited(self):
+        assert not UNLIMITED.limited
+        UNLIMITED.check(1e9)
+        assert UNLIMITED.timeout(60) == 60 and UNLIMITED.timeout() is None
+        assert not Deadline(0).limited
+
+    def test_scope(self, clock):
+        deadline = Deadline(10, clock=clock)
+        assert current_deadline() is UNLIMITED
+        with deadline_scope(deadline):
+            assert current_deadline() is deadline
+        assert current_deadline() is UNLIMITED
+
+
+# ============================================================
+# Notion calls
+# ============================================================
+
+class TestNotionCalls:
+
+    def test_call_is_not_started_without_enough_time(self, clock):
+        sent = []
+        with deadline_scope(Deadline(1.5, reserve=0, clock=clock)):
+            clock.now = 1.0
+            with pytest.raises(DeadlineExceeded):
+                call_with_limits(lambda: sent.append(1), lambda result: None, "PATCH pages/:id")
+        assert sent == []
+
+    def test_retry_that_does_not_fit_is_abandoned(self, clock):
+        responses = iter([(429, {"Retry-After": "5"})])
+        with deadline_scope(Deadline(4, reserve=0, clock=clock)):
+            with pytest.raises(DeadlineExceeded, match="no time left to retry"):
+                call_with_limits(lambda: next(responses), lambda info: info, "POST pages")
+
+    def test_timeout_near_the_deadline_is_deferred(self, clock):
+        def send():
+            clock.now = 2.5
+            raise requests.Timeout("read timed out")
+
+        with deadline_scope(Deadline(3, reserve=0, clock=clock)):
+            with pytest.raises(DeadlineExceeded) as error:
+                call_with_limits(send, lambda result: None, "POST pages")
+        assert isinstance(error.value.__cause__, requests.Timeout)
+
+    @patch("utils.notion_rate_limit.requests.request")
+    def test_notion_request_timeout_follows_the_deadline(self, mock_request, clock):
+        mock_request.return_value = requests.Response()
+        mock_request.return_value.status_code = 200
+
+        notion_request("post", "https://api.notion.com/v1/file_uploads", timeout=30)
+        assert mock_request.call_args.kwargs["timeout"] == 30
+
+        with deadline_scope(Deadline(10, reserve=0, clock=clock)):
+            clock.now = 6
+            notion_request("post", "https://api.notion.com/v1/file_uploads", timeout=30)
+        assert mock_request.call_args.kwargs["timeout"] == 4
+
+    def test_notion_client_timeout_follows_the_deadline(self, clock):
+        timeouts = []
+
+        def respond(request):
+            timeouts.append(request.extensions["timeout"]["read"])
+            return httpx.Response(200, json={"object": "page", "id": "page-1"})
+
+        client = RateLimitedClient(auth="test", client=httpx.Client(transport=httpx.MockTransport(respond)))
+        with deadline_scope(Deadline(10, reserve=0, clock=clock)):
+            clock.now = 3
+            client.pages.retrieve(page_id="page-1")
+        client.pages.retrieve(page_id="page-1")
+        assert timeouts == [7, 60]
+
+
+# ============================================================
+# /api/parse_daily_report
+# ============================================================
+
+@pytest.fixture
+def slow_notion(fake_notion, clock, tmp_path, monkeypatch):
+    """FakeNotion behind call_with_limits where every page / block write takes one second."""
+    for endpoint, name in [(fake_notion.pages, "create"), (fake_notion.blocks.children, "append")]:
+        func = getattr(endpoint, name)
+
+        def call(func=func, name=name, **kwargs):
+            def send():
+                clock.now += 1
+                return func(**kwargs)
+            return call_with_limits(send, lambda result: None, name)
+
+        setattr(endpoint, name, call)
+
+    jobs = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(job_queue.get_job_queue, "instance", jobs)
+    monkeypatch.setattr(jobs, "start", lambda: None)  # run the worker inline
+    monkeypatch.setattr(parse_daily_report, "notion", fake_notion)
+    monkeypatch.setattr(parse_daily_report, "upload_file_to_notion", lambda *args: "file-1")
+    monkeypatch.setattr(parse_daily_report, "DEFER_SAVES_TO_JOBS", True)
+    return fake_notion
+
+
+class TestDeferredSave:
+
+    # 300 patients -> the page is created with the first batch and one more batch is appended
+    PATIENTS = [dict(PATIENT, number=i, sagaku=-100 if i % 3 == 0 else 0) for i in range(300)]
+
+    def post(self, call_handler, monkeypatch, clock, budget, headers=None):
+        monkeypatch.setattr(parse_daily_report, "parse_pdf",
+                            lambda pdf_file: {"summary": dict(SUMMARY), "patients": [dict(p) for p in self.PATIENTS]})
+        monkeypatch.setattr(parse_daily_report, "iter_parse_pdf",
+                            lambda pdf_file: iter([("summary", dict(SUMMARY)), ("patients", self.PATIENTS)]))
+        monkeypatch.setattr(parse_daily_report, "request_deadline",
+                            lambda: Deadline(budget, reserve=0, clock=clock))
+        return call_handler(
+            parse_daily_report.handler, "POST", path="/api/parse_daily_report",
+            headers={"Content-Type": CONTENT_TYPE, **(headers or {})},
+            body=multipart_body(files=[pdf_part(b"%PDF-1.4 slow")]),
+        )
+
+    def test_saves_within_the_budget(self, call_handler, slow_notion, clock, monkeypatch):
+        status, _, payload = self.post(call_handler, monkeypatch, clock, budget=10)
+        assert status == 200
+        assert json.loads(payload)["notion_page_id"] in slow_notion.pages_by_id
+
+    def test_rest_of_the_page_is_finished_by_a_job(self, call_handler, slow_notion, clock, monkeypatch):
+        status, _, payload = self.post(call_handler, monkeypatch, clock, budget=1.5)
+        result = json.loads(payload)
+
+        assert status == 202
+        assert result["deferred"] is True and result["notion_page_id"] is None
+        assert result["data"]["date"] == SUMMARY["date"] and len(result["patients"]) == 300
+        [page_id] = slow_notion.pages_by_id
+        expected = len(parse_daily_report.build_page_blocks(SUMMARY, self.PATIENTS, -10000, "file-1"))
+        assert 0 < len(slow_notion.children[page_id]) < expected
+
+        # the job resumes from the checkpoint: no second page, no duplicated blocks
+        job_queue.get_job_queue().run_next()
+        job = job_queue.get_job_queue().get(result["job_id"])
+        assert job["status"] == DONE
+        assert job["result"]["notion_page_id"] == page_id
+        assert list(slow_notion.pages_by_id) == [page_id]
+        assert len(slow_notion.children[page_id]) == expected
+
+    def test_no_notion_call_when_the_budget_is_already_spent(self, call_handler, slow_notion, clock, monkeypatch):
+        status, _, payload = self.post(call_handler, monkeypatch, clock, budget=0.5)
+        assert status == 202
+        assert json.loads(payload)["job_id"]
+        assert slow_notion.calls == []
+
+    def test_stream_reports_the_deferred_save(self, call_handler, slow_notion, clock, monkeypatch):
+        status, _, payload = self.post(call_handler, monkeypatch, clock, budget=1.5,
+                                       headers={"Accept": "application/x-ndjson"})
+        records = [json.loads(line) for line in payload.decode().splitlines()]
+        assert status == 200
+        assert records[-1]["type"] == "result"
+        assert records[-1]["deferred"] is True and records[-1]["job_id"]
+
+    def test_without_jobs_the_next_upload_resumes(self, call_handler, slow_notion, clock, monkeypatch):
+        """On Vercel (no shared job runner) the parsed data comes back as 504 and a re-upload finishes the page."""
+        monkeypatch.setattr(parse_daily_report, "DEFER_SAVES_TO_JOBS", False)
+
+        status, _, payload = self.post(call_handler, monkeypatch, clock, budget=1.5)
+        result = json.loads(payload)
+        assert status == 504
+        assert result["success"] is False and result["resumable"] is True
+        assert result["data"]["date"] == SUMMARY["date"] and "job_id" not in result
+        assert job_queue.get_job_queue().run_next() is False
+        [page_id] = slow_notion.pages_by_id
+
+        # the 504 is not replayed as the result of the same upload
+        status, _, payload = self.post(call_handler, monkeypatch, clock, budget=10)
+        assert status == 200
+        assert json.loads(payload)["notion_page_id"] == page_id
+        assert list(slow_notion.pages_by_id) == [page_id]
+        expected = len(parse_daily_report.build_page_blocks(SUMMARY, self.PATIENTS, -10000, "file-1"))
+        assert len(slow_notion.children[page_id]) == expected
@@ -0,0 +1,199 @@
+"""
+Tests for idempotency keys and single-flight coalescing (api/utils/idempotency.py)
+and their use in /api/parse_daily_report.
+"""
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import parse_daily_report
+from utils.idempotency import (
+    IdempotencyConflict, IdempotencyInProgress, IdempotencyStore, idempotency_key, request_fingerprint,
+)
+
+from .conftest import CONTENT_TYPE, FakeClock, multipart_body, pdf_part
+
+
+@pytest.fixture
+def clock():
+    return FakeClock(now=1000.0)
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+    return IdempotencyStore(path=str(tmp_path / "idempotency.sqlite3"), ttl=60, wait_seconds=5, clock=clock)
+
+
+class ObservedEvent(threading.Event):
+    """threading.Event that records when someone starts waiting on it."""
+
+    def __init__(self):
+        super().__init__()
+        self.waiting = threading.Event()
+
+    def wait(self, timeout=None):
+        self.waiting.set()
+        return super().wait(timeout)
+
+
+class TestIdempotencyStore:
+
+    def test_replays_completed_result(self, store):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return 200, {"notion_page_id": "page-1"}
+
+        assert store.run("k", "fp", compute) == (200, {"notion_page_id": "page-1"}, False)
+        assert store.run("k", "fp", compute) == (200, {"notion_page_id": "page-1"}, True)
+        assert len(calls) == 1
+
+    def test_result_expires(self, store, clock):
+        store.run("k", "fp", lambda: (200, {}))
+        clock.now += 61
+        assert store.get("k", "fp") is None
+        assert store.run("k", "fp", lambda: (200, {"again": True}))[2] is False
+
+    def test_errors_are_not_stored(self, store):
+        assert store.run("k", "fp", lambda: (500, {"success": False}))[2] is False
+        assert store.get("k", "fp") is None
+
+    def test_same_key_different_request_conflicts(self, store):
+        store.run("k", "fp-1", lambda: (200, {}))
+        with pytest.raises(IdempotencyConflict):
+            store.run("k", "fp-2", lambda: (200, {}))
+
+    def test_concurrent_requests_share_one_computation(self, store):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 200, {"notion_page_id": "page-1"}
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            leader = pool.submit(store.run, "k", "fp", compute)
+            started.wait(5)
+            followers = [pool.submit(store.run, "k", "fp", compute) for _ in range(3)]
+            release.set()
+            results = [leader.result()] + [f.result() for f in followers]
+
+        assert len(calls) == 1
+        assert [replayed for _, _, replayed in results] == [False, True, True, True]
+        assert all(body == {"notion_page_id": "page-1"} for _, body, _ in results)
+
+    def test_followers_see_the_leaders_error(self, store):
+        started = threading.Event()
+        release = threading.Event()
+
+        def fail():
+            started.set()
+            release.wait(5)
+            raise RuntimeError("Notion is down")
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            leader = pool.submit(store.run, "k", "fp", fail)
+            started.wait(5)
+            # release the leader only once the follower is waiting for it
+            flight = store._flights["k"]
+            flight.done = ObservedEvent()
+            follower = pool.submit(store.run, "k", "fp", lambda: (200, {}))
+            flight.done.waiting.wait(5)
+            release.set()
+            for future in (leader, follower):
+                with pytest.raises(RuntimeError, match="Notion is down"):
+                    future.result()
+        # 失敗は保存しないので、再送はやり直せる
+        assert store.run("k", "fp", lambda: (200, {}))[2] is False
+
+    def test_follower_gives_up_after_wait(self, store):
+        store.wait_seconds = 0.01
+        replay, flight = store.begin("k", "fp")
+        assert replay is None
+        with pytest.raises(IdempotencyInProgress):
+            store.begin("k", "fp")
+        store.finish("k", flight, (200, {}))
+
+    def test_key_defaults_to_fingerprint(self):
+        fingerprint = request_fingerprint(b"%PDF", None, "sync")
+        assert fingerprint != request_fingerprint(b"%PDF", "page-1", "sync")
+        assert idempotency_key({}, fingerprint) == fingerprint
+        assert idempotency_key({"Idempotency-Key": "abc"}, fingerprint) == "key:abc"
+        with pytest.raises(ValueError):
+            idempotency_key({"Idempotency-Key": "x" * 256}, fingerprint)
+
+
+class TestParseRequest:
+
+    @pytest.fixture
+    def upserts(self, monkeypatch):
+        upserts = []
+        monkeypatch.setattr(parse_daily_report, "parse_pdf",
+                            lambda f: {"summary": {"date": "2025-01-15"}, "patients": [{"name": "山田太郎"}]})
+
+        def fake_iter_parse_pdf(pdf_file):
+            yield "summary", {"date": "2025-01-15"}
+            yield "patients", [{"name": "山田太郎"}]
+
+        monkeypatch.setattr(parse_daily_report, "iter_parse_pdf", fake_iter_parse_pdf)
+
+        def upsert(*args):
+            upserts.append(args)
+            return f"page-{len(upserts)}", False
+
+        monkeypatch.setattr(parse_daily_report, "upsert_daily_report", upsert)
+        return upserts
+
+    @pytest.fixture
+    def post(self, call_handler):
+        def post(pdf=b"%PDF-1.4", headers=None):
+            return call_handler(
+                parse_daily_report.handler, "POST", path="/api/parse_daily_report",
+                headers={"Content-Type": CONTENT_TYPE, **(headers or {})}, body=multipart_body(files=[pdf_part(pdf)]),
+            )
+
+        return post
+
+    def test_duplicate_upload_is_replayed(self, post, upserts):
+        status, headers, payload = post()
+        assert status == 200 and "idempotent-replayed" not in headers
+
+        status, headers, replayed = post()
+        assert status == 200
+        assert headers["idempotent-replayed"] == "true"
+        assert json.loads(replayed) == json.loads(payload)
+        assert len(upserts) == 1
+
+    def test_different_pdf_is_processed(self, post, upserts):
+        post(b"%PDF-1.4 a")
+        post(b"%PDF-1.4 b")
+        assert len(upserts) == 2
+
+    def test_reused_key_with_different_pdf(self, post, upserts):
+        post(b"%PDF-1.4 a", {"Idempotency-Key": "upload-1"})
+        status, _, payload = post(b"%PDF-1.4 b", {"Idempotency-Key": "upload-1"})
+        assert status == 422
+        assert json.loads(payload)["success"] is False
+
+    def test_stream_replays_earlier_result(self, post, upserts):
+        post()
+        status, _, payload = post(headers={"Accept": "application/x-ndjson"})
+        records = [json.loads(line) for line in payload.decode().splitlines()]
+        assert status == 200
+        assert [r["type"] for r in records] == ["summary", "patients", "data", "result"]
+        assert records[-1]["notion_page_id"] == "page-1"
+        assert records[-1]["replayed"] is True
+        assert len(upserts) == 1
+
+    def test_stream_result_is_replayed_as_json(self, post, upserts):
+        post(headers={"Accept": "application/x-ndjson"})
+        status, headers, payload = post()
+        assert status == 200 and headers["idempotent-replayed"] == "true"
+        assert json.loads(payload)["patients"] == [{"name": "山田太郎"}]
+        assert len(upserts) == 1
@@ -0,0 +1,248 @@
+"""
+Tests for the SQLite-backed background job queue (api/utils/job_queue.py)
+and the job mode of /api/parse_daily_report, using the in-memory Notion
+stand-in from conftest.py.
+"""
+import json
+import sqlite3
+import time
+from unittest.mock import patch
+
+import pytest
+
+import parse_daily_report
+from job_status import job_status_response
+from utils import job_queue
+from utils.job_queue import DONE, FAILED, QUEUED, RUNNING, JobQueue
+
+from .conftest import CONTENT_TYPE, FakeClock, multipart_body, pdf_part
+
+
+SUMMARY = {
+    "date": "2025-01-15",
+    "shaho_count": 1, "shaho_amount": 300,
+    "kokuho_count": 0, "kokuho_amount": 0,
+    "kouki_count": 0, "kouki_amount": 0,
+    "jihi_count": 0, "jihi_amount": 0,
+    "hoken_nashi_count": 0, "hoken_nashi_amount": 0,
+    "total_count": 1, "total_points": 100, "total_amount": 300,
+    "bushan_amount": 0, "kaigo_amount": 0, "zenkai_sagaku": 0,
+}
+
+PATIENT = {
+    "number": 1, "patient_id": "No.1", "name": "山田太郎", "insurance_type": "社本",
+    "points": 100, "burden_amount": 300, "kaigo_units": 0, "kaigo_burden": 0,
+    "jihi": 0, "bushan": 0, "zenkai_sagaku": 0, "receipt_amount": 300,
+    "sagaku": 0, "remarks": "",
+}
+
+
+@pytest.fixture
+def queue_path(tmp_path):
+    return str(tmp_path / "jobs.sqlite3")
+
+
+@pytest.fixture
+def clock():
+    return FakeClock(now=1000.0)
+
+
+# ============================================================
+# JobQueue
+# ============================================================
+
+class TestJobQueue:
+
+    def test_enqueue_and_run(self, queue_path):
+        jobs = JobQueue(queue_path)
+        jobs.register("echo", lambda payload, blob: {"value": payload["value"], "size": len(blob)})
+
+        job_id = jobs.enqueue("echo", {"value": 42}, blob=b"abc")
+        assert jobs.get(job_id)["status"] == QUEUED
+
+        assert jobs.run_next() is True
+        job = jobs.get(job_id)
+        assert job["status"] == DONE
+        assert job["result"] == {"value": 42, "size": 3}
+        assert jobs.run_next() is False
+
+    def test_jobs_survive_restart(self, queue_path):
+        """A job enqueued by one process is processed by the next one."""
+        JobQueue(queue_path).enqueue("echo", {"value": 1})
+
+        restarted = JobQueue(queue_path)
+        restarted.register("echo", lambda payload, blob: payload)
+        assert restarted.run_next() is True
+
+    def test_interrupted_job_is_recovered_after_its_lease_expires(self, queue_path, clock):
+        jobs = JobQueue(queue_path, lease_seconds=60, clock=clock)
+        job_id = jobs.enqueue("echo", {})
+        jobs._claim()  # simulate a crash after the job was picked up
+        assert jobs.get(job_id)["status"] == RUNNING
+        assert jobs.get(job_id)["owner"] == jobs.owner
+
+        restarted = JobQueue(queue_path, lease_seconds=60, clock=clock)
+        restarted.register("echo", lambda payload, blob: payload)
+        restarted.recover()
+        assert restarted.get(job_id)["status"] == RUNNING
+        assert restarted.run_next() is False
+
+        clock.now += 61
+        restarted.recover()
+        assert restarted.get(job_id)["status"] == QUEUED
+        assert restarted.run_next() is True
+        assert restarted.get(job_id)["status"] == DONE
+
+    def test_job_running_in_another_process_is_left_alone(self, queue_path, clock):
+        """A live worker keeps renewing its lease; other queues on the same file do not re-run the job."""
+        jobs = JobQueue(queue_path, lease_seconds=60, clock=clock)
+        job_id = jobs.enqueue("echo", {})
+        jobs._claim()
+        other = JobQueue(queue_path, lease_seconds=60, clock=clock)
+
+        for _ in range(3):
+            clock.now += 40
+            assert jobs._renew_lease(job_id)
+            other.recover()
+            assert other._claim() is None
+        assert other.get(job_id)["status"] == RUNNING
+
+    def test_expired_lease_is_claimed_by_another_worker(self, queue_path, clock):
+        jobs = JobQueue(queue_path, lease_seconds=60, clock=clock)
+        job_id = jobs.enqueue("echo", {})
+        jobs._claim()
+
+        clock.now += 61
+        other = JobQueue(queue_path, lease_seconds=60, clock=clock)
+        assert other._claim()["id"] == job_id
+        job = other.get(job_id)
+        assert (job["owner"], job["attempts"]) == (other.owner, 2)
+        # the stale worker can neither renew nor finish the job any more
+        assert not jobs._renew_lease(job_id)
+        jobs._finish(job_id, DONE, result={"stale": True})
+        assert other.get(job_id)["status"] == RUNNING
+
+    def test_expired_lease_without_attempts_left_fails(self, queue_path, clock):
+        jobs = JobQueue(queue_path, max_attempts=1, lease_seconds=60, clock=clock)
+        job_id = jobs.enqueue("echo", {})
+        jobs._claim()
+
+        clock.now += 61
+        assert jobs._claim() is None
+        assert jobs.get(job_id)["status"] == FAILED
+
+    def test_old_queue_file_is_migrated(self, queue_path):
+        with sqlite3.connect(queue_path) as conn:
+            conn.execute(
+                "CREATE TABLE jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, blob BLOB,"
+                " status TEXT NOT NULL, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0,"
+                " created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("INSERT INTO jobs VALUES ('old', 'echo', '{}', NULL, 'running', NULL, NULL, 1, 0, 0)")
+        conn.close()
+
+        jobs = JobQueue(queue_path)
+        jobs.register("echo", lambda payload, blob: {"ok": True})
+        # a running job without a lease was left by a process of the old version
+        assert jobs.run_next() is True
+        assert jobs.get("old")["status"] == DONE
+
+    def test_failed_job_is_retried_with_backoff_then_marked_failed(self, queue_path, clock):
+        jobs = JobQueue(queue_path, max_attempts=3, retry_delay=5, clock=clock)
+
+        def boom(payload, blob):
+            raise RuntimeError("notion down")
+
+        jobs.register("boom", boom)
+        job_id = jobs.enqueue("boom", {})
+
+        jobs.run_next()
+        assert jobs.get(job_id)["status"] == QUEUED
+        assert jobs.run_next() is False  # not before the retry delay
+        clock.now += 5
+        assert jobs.run_next() is True
+        clock.now += 5
+        assert jobs.run_next() is False  # the delay doubles
+        clock.now += 5
+        assert jobs.run_next() is True
+        job = jobs.get(job_id)
+        assert job["status"] == FAILED
+        assert job["attempts"] == 3
+        assert job["error"] == "notion down"
+
+    def test_worker_threads_process_jobs(self, queue_path):
+        jobs = JobQueue(queue_path, workers=2, poll_interval=0.01)
+        jobs.register("echo", lambda payload, blob: payload)
+        jobs.start()
+        try:
+            ids = [jobs.enqueue("echo", {"i": i}) for i in range(5)]
+            deadline = time.time() + 5
+            while time.time() < deadline and any(jobs.get(i)["status"] != DONE for i in ids):
+                time.sleep(0.01)
+            assert [jobs.get(i)["result"] for i in ids] == [{"i": i} for i in range(5)]
+        finally:
+            jobs.stop()
+
+
+# ============================================================
+# Job mode of parse_daily_report
+# ============================================================
+
+@pytest.fixture
+def save_jobs(monkeypatch):
+    monkeypatch.setattr(parse_daily_report, "DEFER_SAVES_TO_JOBS", True)
+
+
+class TestSaveJob:
+
+    def test_wants_job_mode(self, save_jobs):
+        assert parse_daily_report.wants_job_mode({"Prefer": "respond-async"})
+        assert parse_daily_report.wants_job_mode({}, mode="job")
+        assert not parse_daily_report.wants_job_mode({})
+
+    @patch("parse_daily_report.upload_file_to_notion", return_value="file-1")
+    def test_save_job_writes_page_and_reports_status(self, _upload, fake_notion, queue_path, monkeypatch, save_jobs):
+        jobs = JobQueue(queue_path)
+        monkeypatch.setattr(job_queue.get_job_queue, "instance", jobs)
+        monkeypatch.setattr(jobs, "start", lambda: None)  # run the worker inline below
+        monkeypatch.setattr(parse_daily_report, "notion", fake_notion)
+
+        job_id = parse_daily_report.enqueue_save_job(b"%PDF", SUMMARY, [PATIENT], 0)
+        status, body = job_status_response(job_id)
+        assert (status, body["status"], body["notion_page_id"]) == (200, QUEUED, None)
+
+        jobs.run_next()
+
+        status, body = job_status_response(job_id)
+        assert body["status"] == DONE
+        assert body["notion_page_id"] in fake_notion.pages_by_id
+        assert fake_notion.children[body["notion_page_id"]]
+
+    def test_unknown_job(self, queue_path, monkeypatch):
+        monkeypatch.setattr(job_queue.get_job_queue, "instance", JobQueue(queue_path))
+        assert job_status_response("missing")[0] == 404
+        assert job_status_response(None)[0] == 400
+
+    @patch("parse_daily_report.upload_file_to_notion", return_value="file-1")
+    def test_job_mode_is_ignored_on_vercel(self, _upload, fake_notion, queue_path, call_handler, monkeypatch):
+        """Without a shared queue (Vercel) a job_status_url could never resolve, so the page is saved inline."""
+        monkeypatch.setenv("VERCEL", "1")
+        monkeypatch.delenv("DEFER_SAVES_TO_JOBS", raising=False)
+        monkeypatch.setattr(parse_daily_report, "DEFER_SAVES_TO_JOBS", parse_daily_report.save_jobs_configured())
+        monkeypatch.setattr(job_queue.get_job_queue, "instance", JobQueue(queue_path))
+        monkeypatch.setattr(parse_daily_report, "notion", fake_notion)
+        monkeypatch.setattr(parse_daily_report, "parse_pdf",
+                            lambda pdf_file: {"summary": dict(SUMMARY), "patients": [dict(PATIENT)]})
+
+        assert not parse_daily_report.wants_job_mode({"Prefer": "respond-async"}, mode="job")
+        status, _, payload = call_handler(
+            parse_daily_report.handler, "POST", path="/api/parse_daily_report",
+            headers={"Content-Type": CONTENT_TYPE, "Prefer": "respond-async"},
+            body=multipart_body({"mode": "job"}, [pdf_part(b"%PDF-1.4 vercel")]),
+        )
+        result = json.loads(payload)
+        assert status == 200
+        assert "job_id" not in result and result["notion_page_id"] in fake_notion.pages_by_id
+        assert job_queue.get_job_queue().run_next() is False
+        with pytest.raises(RuntimeError, match="DEFER_SAVES_TO_JOBS"):
+            parse_daily_report.enqueue_save_job(b"%PDF", SUMMARY, [PATIENT], 0)
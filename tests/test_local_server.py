@@ -0,0 +1,161 @@
+"""
+Tests for the concurrent local server (api/utils/local_server.py) and the
+PDF parse process pool (api/utils/parse_pool.py).
+"""
+import http.client
+import json
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import job_status
+import parse_daily_report
+from utils.local_server import LocalServerHandler, PooledHTTPServer
+from utils.parse_pool import configure_parse_pool, run_parsing, shutdown_parse_pool
+
+
+@pytest.fixture
+def start_server(monkeypatch):
+    monkeypatch.setattr(LocalServerHandler, "log_message", lambda *args: None, raising=False)
+    servers = []
+
+    def start(workers=4):
+        server = PooledHTTPServer(("127.0.0.1", 0), LocalServerHandler, workers=workers)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def server(start_server):
+    return start_server()
+
+
+def connect(server):
+    return http.client.HTTPConnection(*server.server_address, timeout=5)
+
+
+class TestLocalServer:
+
+    def test_keep_alive_for_static_and_api(self, server):
+        conn = connect(server)
+
+        conn.request("GET", "/index.html")
+        response = conn.getresponse()
+        assert response.status == 200
+        response.read()
+        sock = conn.sock
+
+        conn.request("GET", "/api/job_status?id=missing")
+        response = conn.getresponse()
+        assert response.status == 404
+        assert json.loads(response.read())["error"] == "Job not found"
+        assert conn.sock is sock  # 同じ接続が再利用された
+        conn.close()
+
+    def test_slow_api_does_not_block_static_files(self, server, monkeypatch):
+        def slow_status(job_id):
+            time.sleep(0.5)
+            return 404, {"success": False, "error": "Job not found"}
+
+        monkeypatch.setattr(job_status, "job_status_response", slow_status)
+
+        def get(path):
+            conn = connect(server)
+            started = time.perf_counter()
+            conn.request("GET", path)
+            conn.getresponse().read()
+            conn.close()
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            slow = pool.submit(get, "/api/job_status?id=x")
+            time.sleep(0.05)
+            static = pool.submit(get, "/index.html")
+            assert static.result() < 0.3
+            assert slow.result() >= 0.5
+
+    def test_waits_for_a_free_worker_instead_of_queueing(self, start_server, monkeypatch):
+        server = start_server(workers=1)
+        release = threading.Event()
+
+        def blocked_status(job_id):
+            release.wait(5)
+            return 404, {"success": False, "error": "Job not found"}
+
+        monkeypatch.setattr(job_status, "job_status_response", blocked_status)
+
+        def get(path):
+            conn = connect(server)
+            conn.request("GET", path)
+            status = conn.getresponse().status
+            conn.close()
+            return status
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            busy = pool.submit(get, "/api/job_status?id=x")
+            time.sleep(0.1)
+            waiting = [pool.submit(get, "/index.html") for _ in range(3)]
+            time.sleep(0.2)
+            assert server._pool._work_queue.qsize() == 0
+            assert not any(f.done() for f in waiting)
+
+            release.set()
+            assert busy.result() == 404
+            assert [f.result() for f in waiting] == [200, 200, 200]
+
+    def test_unknown_api_method(self, server):
+        conn = connect(server)
+        conn.request("POST", "/api/job_status", body=b"{}")
+        assert conn.getresponse().status == 405
+        conn.close()
+
+    def test_unknown_post_path(self, server):
+        conn = connect(server)
+        conn.request("POST", "/api/unknown", body=b"{}")
+        response = conn.getresponse()
+        assert response.status == 404
+        assert response.getheader("Connection") == "close"
+        conn.close()
+
+    def test_streams_with_chunked_encoding(self, server, monkeypatch):
+        def fake_iter_parse_pdf(pdf_file):
+            yield "summary", {"date": "2025-01-15", "zenkai_sagaku": 0}
+            yield "patients", []
+
+        monkeypatch.setattr(parse_daily_report, "iter_parse_pdf", fake_iter_parse_pdf)
+        monkeypatch.setattr(parse_daily_report, "upsert_daily_report", lambda *args: ("page-1", False))
+        body = (b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"r.pdf\"\r\n\r\n"
+                b"%PDF-1.4\r\n--b--\r\n")
+
+        conn = connect(server)
+        conn.request("POST", "/api/parse_daily_report", body=body, headers={
+            "Content-Type": "multipart/form-data; boundary=b",
+            "Accept": "application/x-ndjson",
+        })
+        response = conn.getresponse()
+        assert response.getheader("Transfer-Encoding") == "chunked"
+        records = [json.loads(line) for line in response.read().splitlines()]
+        assert [r["type"] for r in records] == ["summary", "data", "result"]
+        conn.close()
+
+
+class TestParsePool:
+
+    def test_runs_inline_without_pool(self):
+        assert run_parsing(zlib.crc32, memoryview(b"abc")) == zlib.crc32(b"abc")
+
+    def test_runs_in_process_pool(self):
+        try:
+            assert configure_parse_pool(1) is not None
+            assert run_parsing(zlib.crc32, memoryview(b"abc")) == zlib.crc32(b"abc")
+        finally:
+            shutdown_parse_pool()
@@ -0,0 +1,181 @@
+"""
+Tests for the in-process metrics registry (api/utils/metrics.py), the
+/api/metrics endpoint and the instrumented call sites.
+"""
+import io
+import json
+import threading
+from unittest.mock import patch
+
+import http.client
+import httpx
+import pytest
+
+import job_status
+from utils import metrics, notion_rate_limit
+from utils.app_core import ApiRequest, find_endpoint
+from utils.metrics import MetricsRegistry, get_metrics_registry
+from utils.notion_rate_limit import RateLimitedClient, RetryPolicy, TokenBucket, notion_endpoint_label
+from utils.upload_cache import UploadCache
+
+
+def request(method, path):
+    return ApiRequest(method, path, http.client.parse_headers(io.BytesIO(b"\r\n")), io.BytesIO())
+
+
+def counter(snapshot, name, **labels):
+    for item in snapshot["counters"].get(name, []):
+        if item["labels"] == labels:
+            return item["value"]
+    return 0
+
+
+class TestRegistry:
+
+    def test_counters_are_merged_across_threads(self):
+        registry = MetricsRegistry()
+
+        def work():
+            for _ in range(1000):
+                registry.inc("hits_total", cache="upload")
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        registry.inc("hits_total", 2, cache="page_index")
+
+        snapshot = registry.snapshot()
+        assert counter(snapshot, "hits_total", cache="upload") == 4000
+        assert counter(snapshot, "hits_total", cache="page_index") == 2
+
+    def test_finished_threads_do_not_accumulate_shards(self):
+        """Per-request thread pools must not grow the shard list; their values are kept."""
+        registry = MetricsRegistry()
+        for _ in range(200):
+            thread = threading.Thread(target=lambda: (registry.inc("hits_total"),
+                                                      registry.observe("stage_seconds", 0.2)))
+            thread.start()
+            thread.join()
+
+        assert len(registry._shards) <= 2
+        snapshot = registry.snapshot(reset=True)
+        assert counter(snapshot, "hits_total") == 200
+        assert snapshot["histograms"]["stage_seconds"][0]["count"] == 200
+        assert registry.snapshot() == {"counters": {}, "histograms": {}}
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = MetricsRegistry(buckets=(0.1, 1.0))
+        for seconds in (0.05, 0.1, 0.5, 3.0):
+            registry.observe("stage_seconds", seconds, stage="text")
+
+        [item] = registry.snapshot()["histograms"]["stage_seconds"]
+        assert item["labels"] == {"stage": "text"}
+        assert item["buckets"] == {"0.1": 2, "1": 3}
+        assert item["count"] == 4
+        assert item["sum"] == pytest.approx(3.65)
+
+    def test_prometheus_text(self):
+        registry = MetricsRegistry(buckets=(0.5,))
+        registry.inc("api_requests_total", route="/api/job_status", status="404")
+        registry.observe("api_request_seconds", 0.2, route='a"b')
+
+        text = registry.prometheus()
+        assert "# TYPE api_requests_total counter\n" in text
+        assert 'api_requests_total{route="/api/job_status",status="404"} 1\n' in text
+        assert "# TYPE api_request_seconds histogram\n" in text
+        assert 'api_request_seconds_bucket{route="a\\"b",le="0.5"} 1\n' in text
+        assert 'api_request_seconds_bucket{route="a\\"b",le="+Inf"} 1\n' in text
+        assert 'api_request_seconds_count{route="a\\"b"} 1\n' in text
+
+    def test_snapshot_reset(self):
+        registry = MetricsRegistry()
+        registry.inc("jobs_total")
+        assert counter(registry.snapshot(reset=True), "jobs_total") == 1
+        assert registry.snapshot() == {"counters": {}, "histograms": {}}
+
+    def test_log_snapshot_per_invocation(self, monkeypatch, capsys, call_handler):
+        monkeypatch.setattr(metrics, "METRICS_LOG", True)
+        call_handler(job_status.handler, "GET", path="/api/job_status?id=missing")
+
+        line = capsys.readouterr().out.strip().splitlines()[-1]
+        assert line.startswith("[Metrics] ")
+        logged = json.loads(line[len("[Metrics] "):])
+        assert counter(logged, "api_requests_total", route="/api/job_status", method="GET", status="404") == 1
+        # ログに出した値は次の呼び出しに持ち越さない
+        assert get_metrics_registry().snapshot()["counters"] == {}
+
+
+class TestMetricsEndpoint:
+
+    def test_only_served_by_local_servers(self):
+        assert find_endpoint("/api/metrics") is None
+        assert find_endpoint("/api/metrics", local=True) is not None
+
+    def test_prometheus_and_json(self):
+        endpoint = find_endpoint("/api/metrics", local=True)
+        job_status.ENDPOINT.handle(request("GET", "/api/job_status?id=missing"))
+
+        header_items, body = endpoint.handle(request("GET", "/api/metrics")).encode()
+        assert dict(header_items)["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert b'api_requests_total{method="GET",route="/api/job_status",status="404"} 1' in body
+
+        _, body = endpoint.handle(request("GET", "/api/metrics?format=json")).encode()
+        assert "api_request_seconds" in json.loads(body)["histograms"]
+
+
+class TestInstrumentation:
+
+    def test_notion_endpoint_label(self):
+        assert notion_endpoint_label("patch", "pages/1c2d3e4f-5a6b-7c8d-9e0f-a1b2c3d4e5f6") == "PATCH pages/:id"
+        assert (notion_endpoint_label("POST", "data_sources/1c2d3e4f5a6b7c8d9e0fa1b2c3d4e5f6/query")
+                == "POST data_sources/:id/query")
+
+    def test_notion_calls_and_retries(self, monkeypatch):
+        monkeypatch.setattr(notion_rate_limit, "bucket", TokenBucket(1000, 1000))
+        monkeypatch.setattr(notion_rate_limit, "retry_policy", RetryPolicy(max_retries=3, base_delay=0))
+        responses = [
+            httpx.Response(503, json={"code": "service_unavailable", "message": "later"}),
+            httpx.Response(200, json={"id": "page-1"}),
+        ]
+        transport = httpx.MockTransport(lambda r: responses.pop(0))
+        client = RateLimitedClient(auth="test", client=httpx.Client(transport=transport))
+
+        client.pages.update(page_id="1c2d3e4f5a6b7c8d9e0fa1b2c3d4e5f6", properties={})
+
+        snapshot = get_metrics_registry().snapshot()
+        assert counter(snapshot, "notion_requests_total", endpoint="PATCH pages/:id", outcome="ok") == 1
+        assert counter(snapshot, "notion_retries_total", endpoint="PATCH pages/:id", status="503") == 1
+        [latency] = snapshot["histograms"]["notion_request_seconds"]
+        assert latency["labels"] == {"endpoint": "PATCH pages/:id"} and latency["count"] == 1
+
+    def test_cache_hits_and_misses(self, tmp_path):
+        cache = UploadCache(path=str(tmp_path / "uploads.sqlite3"))
+        cache.get("digest", "application/pdf")
+        cache.put("digest", "application/pdf", "file-1")
+        cache.get("digest", "application/pdf")
+
+        snapshot = get_metrics_registry().snapshot()
+        assert counter(snapshot, "cache_lookups_total", cache="upload", result="miss") == 1
+        assert counter(snapshot, "cache_lookups_total", cache="upload", result="hit") == 1
+
+    def test_parse_stages(self):
+        from unittest.mock import MagicMock
+        import parse_daily_report
+
+        page = MagicMock()
+        page.extract_text.return_value = "令和7年1月15日"
+        page.extract_tables.return_value = []
+        pdf = MagicMock()
+        pdf.pages = [page, page]
+        pdf.__enter__ = MagicMock(return_value=pdf)
+        pdf.__exit__ = MagicMock(return_value=False)
+
+        with patch("parse_daily_report.pdfplumber") as pdfplumber:
+            pdfplumber.open.return_value = pdf
+            parse_daily_report.parse_pdf(io.BytesIO(b"%PDF"))
+
+        stages = {item["labels"]["stage"]: item["count"]
+                  for item in get_metrics_registry().snapshot()["histograms"]["parse_stage_seconds"]}
+        assert stages == {"open": 1, "text": 1, "summary": 1, "tables": 2}
@@ -0,0 +1,126 @@
+"""
+Tests for the block templates (api/utils/notion_blocks.py), the
+template-based build_page_blocks (standard and compact layouts) and
+the paginated child-block listing.
+"""
+from parse_daily_report import build_page_blocks
+from utils.append_planner import count_blocks
+from utils.notion_blocks import RowTemplate, cell, iter_child_blocks, table_row
+
+
+SUMMARY = {
+    "date": "2025-01-15",
+    "shaho_count": 1, "shaho_amount": 1500,
+    "kokuho_count": 0, "kokuho_amount": 0,
+    "kouki_count": 0, "kouki_amount": 0,
+    "jihi_count": 0, "jihi_amount": 0,
+    "hoken_nashi_count": 0, "hoken_nashi_amount": 0,
+    "total_count": 1, "total_points": 500, "total_amount": 1500,
+    "bushan_amount": 0, "kaigo_amount": 0, "zenkai_sagaku": 0,
+}
+
+
+def make_patients(n, sagaku=0):
+    return [
+        {
+            "number": i, "patient_id": f"No.{i}", "name": f"患者{i}", "insurance_type": "社本",
+            "points": 500, "burden_amount": 1500, "kaigo_units": 0, "kaigo_burden": 0,
+            "jihi": 0, "bushan": 0, "zenkai_sagaku": 0, "receipt_amount": 1500,
+            "sagaku": sagaku, "remarks": "",
+        }
+        for i in range(1, n + 1)
+    ]
+
+
+def cell_texts(row):
+    return [c[0]["text"]["content"] for c in row["table_row"]["cells"]]
+
+
+class TestRowTemplate:
+
+    def test_fill_matches_plain_row(self):
+        template = RowTemplate(["自費", None, None])
+        assert template.fill("2人", "¥1,000") == table_row(["自費", "2人", "¥1,000"])
+
+    def test_identical_cells_are_shared(self):
+        template = RowTemplate([None, None])
+        a = template.fill("¥0", "x")
+        b = template.fill("¥0", "y")
+        assert a["table_row"]["cells"][0] is b["table_row"]["cells"][0]
+        assert cell("¥0") is a["table_row"]["cells"][0]
+
+
+class TestBuildPageBlocks:
+
+    def test_patient_tables_are_chunked_with_header(self):
+        blocks = build_page_blocks(SUMMARY, make_patients(25), 0, "file-1")
+        tables = [b for b in blocks if b["type"] == "table" and b["table"]["table_width"] == 7]
+
+        assert [len(t["table"]["children"]) for t in tables] == [11, 11, 6]
+        assert cell_texts(tables[0]["table"]["children"][0])[:3] == ["No", "患者ID", "氏名"]
+        assert cell_texts(tables[2]["table"]["children"][-1]) == [
+            "25", "No.25", "患者25", "社本", "500", "¥1,500", "¥1,500",
+        ]
+
+    def test_detail_tables_only_for_patients_with_details(self):
+        patients = make_patients(3)
+        patients[1]["sagaku"] = -200
+        blocks = build_page_blocks(SUMMARY, patients, -200, "file-1")
+        details = [b for b in blocks if b["type"] == "table" and b["table"]["table_width"] == 2]
+
+        assert len(details) == 1
+        rows = [cell_texts(r) for r in details[0]["table"]["children"]]
+        assert rows[0] == ["2. 患者2", "No.2"]
+        assert rows[-1] == ["差額", "¥-200"]
+        assert len(rows) == 7
+
+    def test_block_count(self):
+        blocks = build_page_blocks(SUMMARY, make_patients(10, sagaku=1), 10, "file-1")
+        # 見出し・段落・見出し + 内訳表(1+6) + 見出し + 患者表(1+11) + 見出し + 詳細表 10×(1+7) + 見出し・PDF
+        assert sum(count_blocks(b) for b in blocks) == 3 + 7 + 1 + 12 + 1 + 80 + 2
+
+
+class TestCompactLayout:
+
+    def test_patient_tables_use_full_row_limit(self):
+        blocks = build_page_blocks(SUMMARY, make_patients(250), 0, "file-1", layout="compact")
+        tables = [b for b in blocks if b["type"] == "table" and b["table"]["table_width"] == 7]
+        assert [len(t["table"]["children"]) for t in tables] == [100, 100, 53]
+
+    def test_details_in_one_wide_table_without_zero_columns(self):
+        patients = make_patients(5)
+        patients[0]["sagaku"] = -200
+        patients[3]["jihi"] = 1000
+        blocks = build_page_blocks(SUMMARY, patients, -200, "file-1", layout="compact")
+        tables = [b for b in blocks if b["type"] == "table"]
+        detail = tables[-1]["table"]
+
+        assert len(tables) == 3  # 内訳表・患者表・詳細表
+        assert detail["table_width"] == 4
+        rows = [cell_texts(r) for r in detail["children"]]
+        assert rows == [
+            ["患者", "患者ID", "自費", "差額"],
+            ["1. 患者1", "No.1", "¥0", "¥-200"],
+            ["4. 患者4", "No.4", "¥1,000", "¥0"],
+        ]
+
+    def test_fewer_blocks_than_standard(self):
+        patients = make_patients(50, sagaku=1)
+        standard = build_page_blocks(SUMMARY, patients, 50, "file-1", layout="standard")
+        compact = build_page_blocks(SUMMARY, patients, 50, "file-1", layout="compact")
+        assert len(compact) < len(standard)
+        assert sum(map(count_blocks, compact)) < sum(map(count_blocks, standard))
+
+
+class TestIterChildBlocks:
+
+    def test_follows_every_page_of_results(self, fake_notion):
+        fake_notion.children["page-1"] = [{"id": f"b{i}", "type": "paragraph"} for i in range(250)]
+        blocks = list(iter_child_blocks(fake_notion, "page-1"))
+        assert [b["id"] for b in blocks] == [f"b{i}" for i in range(250)]
+        assert len([c for c in fake_notion.calls if c[0] == "blocks.children.list"]) == 3
+
+    def test_stops_listing_when_the_caller_stops(self, fake_notion):
+        fake_notion.children["page-1"] = [{"id": f"b{i}", "type": "paragraph"} for i in range(250)]
+        assert next(iter_child_blocks(fake_notion, "page-1"))["id"] == "b0"
+        assert len([c for c in fake_notion.calls if c[0] == "blocks.children.list"]) == 1
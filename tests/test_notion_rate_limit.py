@@ -0,0 +1,230 @@
+"""
+Tests for the shared Notion rate limiter and retry policy
+(api/utils/notion_rate_limit.py).
+
+No network access: requests.request and the notion_client transport are
+patched, and sleeps are captured instead of performed.
+"""
+import io
+from unittest.mock import patch
+
+import httpx
+import pytest
+import requests
+
+from utils import notion_rate_limit
+from utils.metrics import get_metrics_registry
+from utils.notion_rate_limit import (
+    RateLimitedClient,
+    RetryPolicy,
+    TokenBucket,
+    is_idempotent_call,
+    notion_request,
+    parse_retry_after,
+)
+
+from .conftest import FakeClock
+
+
+def make_response(status, headers=None):
+    resp = requests.Response()
+    resp.status_code = status
+    resp.headers.update(headers or {})
+    resp._content = b"{}"
+    return resp
+
+
+def retries(status=None):
+    """notion_retries_total の合計（status を指定するとそのステータスだけ）"""
+    items = get_metrics_registry().snapshot()["counters"].get("notion_retries_total", [])
+    return sum(item["value"] for item in items if status is None or item["labels"]["status"] == str(status))
+
+
+def rate_limit_waits():
+    """notion_rate_limit_wait_seconds に記録した送信の回数"""
+    return sum(item["count"] for item in get_metrics_registry().snapshot()["histograms"]["notion_rate_limit_wait_seconds"])
+
+
+@pytest.fixture(autouse=True)
+def isolated_limiter(monkeypatch):
+    """Give every test its own bucket/metrics and never really sleep."""
+    clock = FakeClock()
+    monkeypatch.setattr(
+        notion_rate_limit, "bucket", TokenBucket(3, 3, clock=clock, sleep=clock.sleep)
+    )
+    monkeypatch.setattr(notion_rate_limit, "retry_policy", RetryPolicy(max_retries=3))
+    monkeypatch.setattr(notion_rate_limit.time, "sleep", clock.sleep)
+    return clock
+
+
+# ============================================================
+# TokenBucket
+# ============================================================
+
+class TestTokenBucket:
+
+    def test_burst_then_throttle(self):
+        """The first `capacity` calls pass immediately, then calls are spaced by 1/rate."""
+        clock = FakeClock()
+        bucket = TokenBucket(3, 3, clock=clock, sleep=clock.sleep)
+
+        waits = [bucket.acquire() for _ in range(5)]
+        assert waits[:3] == [0, 0, 0]
+        assert waits[3] == pytest.approx(1 / 3)
+        assert waits[4] == pytest.approx(1 / 3)
+
+    def test_pause_blocks_following_acquires(self):
+        """pause() (Retry-After) delays the next acquire even with tokens left."""
+        clock = FakeClock()
+        bucket = TokenBucket(3, 3, clock=clock, sleep=clock.sleep)
+
+        bucket.pause(2.0)
+        assert bucket.acquire() == pytest.approx(2.0)
+
+
+# ============================================================
+# RetryPolicy
+# ============================================================
+
+class TestRetryPolicy:
+
+    def test_retry_after_is_honoured_for_429(self):
+        policy = RetryPolicy(max_retries=3)
+        assert policy.delay_for(0, 429, {"Retry-After": "4"}) == 4.0
+
+    def test_5xx_uses_bounded_jitter(self):
+        policy = RetryPolicy(max_retries=5, base_delay=0.5, max_delay=30)
+        for attempt in range(5):
+            delay = policy.delay_for(attempt, 503, {})
+            assert 0 <= delay <= 0.5 * (2 ** attempt)
+
+    def test_non_retryable_status(self):
+        assert RetryPolicy().delay_for(0, 400, {}) is None
+
+    def test_gives_up_after_max_retries(self):
+        assert RetryPolicy(max_retries=2).delay_for(2, 503, {}) is None
+
+    def test_non_idempotent_call_retries_only_429(self):
+        policy = RetryPolicy(max_retries=3)
+        assert policy.delay_for(0, 503, {}, idempotent=False) is None
+        assert policy.delay_for(0, 429, {"Retry-After": "1"}, idempotent=False) == 1.0
+
+    @pytest.mark.parametrize("endpoint, idempotent", [
+        ("GET blocks/:id/children", True),
+        ("PATCH pages/:id", True),
+        ("DELETE blocks/:id", True),
+        ("POST data_sources/:id/query", True),
+        ("POST pages", False),
+        ("PATCH blocks/:id/children", False),
+        ("POST file_uploads", False),
+        ("POST file_uploads/:id/send", False),
+    ])
+    def test_is_idempotent_call(self, endpoint, idempotent):
+        assert is_idempotent_call(endpoint) is idempotent
+
+    def test_parse_retry_after(self):
+        assert parse_retry_after("1.5") == 1.5
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") is None
+
+
+# ============================================================
+# notion_request (File Upload API via requests)
+# ============================================================
+
+class TestNotionRequest:
+
+    @patch("utils.notion_rate_limit.requests.request")
+    def test_retries_429_then_succeeds(self, mock_request, isolated_limiter):
+        mock_request.side_effect = [
+            make_response(429, {"Retry-After": "2"}),
+            make_response(200),
+        ]
+
+        resp = notion_request("post", "https://api.notion.com/v1/file_uploads")
+
+        assert resp.status_code == 200
+        assert mock_request.call_count == 2
+        assert 2.0 in [pytest.approx(s) for s in isolated_limiter.sleeps]
+        assert rate_limit_waits() == 2
+        assert retries() == 1
+        assert retries(429) == 1
+
+    @patch("utils.notion_rate_limit.requests.request")
+    def test_returns_last_5xx_after_retries_exhausted(self, mock_request):
+        mock_request.return_value = make_response(502)
+
+        resp = notion_request("get", "https://api.notion.com/v1/file_uploads/abc")
+
+        assert resp.status_code == 502
+        assert mock_request.call_count == 4  # 1 + max_retries
+        assert retries(502) == 3
+
+    @patch("utils.notion_rate_limit.requests.request")
+    def test_5xx_on_upload_creation_is_not_retried(self, mock_request):
+        """Notion may have created the upload before failing; retrying would create another one."""
+        mock_request.return_value = make_response(503)
+
+        resp = notion_request("post", "https://api.notion.com/v1/file_uploads")
+
+        assert resp.status_code == 503
+        assert mock_request.call_count == 1
+        assert retries() == 0
+
+    @patch("utils.notion_rate_limit.requests.request")
+    def test_file_object_rewound_before_retry(self, mock_request):
+        seen = []
+
+        def fake_request(method, url, files=None, **kwargs):
+            f = files["file"][1]
+            seen.append(f.read())
+            return make_response(429 if len(seen) == 1 else 200)
+
+        mock_request.side_effect = fake_request
+        notion_request("post", "https://x", files={"file": ("a.pdf", io.BytesIO(b"%PDF"), "application/pdf")})
+
+        assert seen == [b"%PDF", b"%PDF"]
+
+
+# ============================================================
+# RateLimitedClient (notion_client)
+# ============================================================
+
+class TestRateLimitedClient:
+
+    def test_retries_http_429_from_notion_client(self):
+        responses = [
+            httpx.Response(429, headers={"Retry-After": "1"}, json={"code": "rate_limited", "message": "slow down"}),
+            httpx.Response(200, json={"id": "page-1"}),
+        ]
+        transport = httpx.MockTransport(lambda request: responses.pop(0))
+        client = RateLimitedClient(auth="test", client=httpx.Client(transport=transport))
+
+        page = client.pages.create(parent={}, properties={})
+
+        assert page == {"id": "page-1"}
+        assert retries(429) == 1
+
+    def test_non_retryable_error_is_raised(self):
+        transport = httpx.MockTransport(
+            lambda request: httpx.Response(400, json={"code": "validation_error", "message": "bad"})
+        )
+        client = RateLimitedClient(auth="test", client=httpx.Client(transport=transport))
+
+        with pytest.raises(Exception) as exc_info:
+            client.pages.update(page_id="p", properties={})
+        assert exc_info.value.status == 400
+        assert retries() == 0
+
+    def test_5xx_on_page_creation_is_not_retried(self):
+        requests_sent = []
+
+        def respond(request):
+            requests_sent.append(request)
+            return httpx.Response(502, json={"code": "internal_server_error", "message": "bad gateway"})
+
+        client = RateLimitedClient(auth="test", client=httpx.Client(transport=httpx.MockTransport(respond)))
+        with pytest.raises(Exception) as exc_info:
+            client.pages.create(parent={}, properties={})
+        assert exc_info.value.status == 502
+        assert len(requests_sent) == 1
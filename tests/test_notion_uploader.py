@@ -0,0 +1,161 @@
+"""
+Tests for single-part / multi-part uploads and the upload de-duplication
+cache in api/utils/notion_uploader.py.
+
+notion_request is replaced with a fake Notion File Upload API that records
+every call and stores the bytes it receives.
+"""
+import io
+import threading
+
+import pytest
+import requests
+
+from utils import notion_uploader
+from utils.notion_uploader import UploadSource, upload_file_to_notion
+from utils.upload_cache import FILE_UPLOAD_REUSE_SECONDS, UploadCache
+
+
+class FakeFileUploadAPI:
+    def __init__(self):
+        self.calls = []
+        self.parts = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, method, url, headers=None, json=None, files=None, data=None):
+        with self.lock:
+            self.calls.append((url.rsplit("/", 1)[-1], json, data))
+            if files:
+                part_number = int((data or {}).get("part_number", 0))
+                self.parts[part_number] = files["file"][1].read()
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = b'{"id": "upload-1"}'
+        return resp
+
+    def endpoints(self):
+        return [name for name, _, _ in self.calls]
+
+    def received(self):
+        return b"".join(self.parts[k] for k in sorted(self.parts))
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    api = FakeFileUploadAPI()
+    monkeypatch.setattr(notion_uploader, "notion_request", api)
+    return api
+
+
+@pytest.fixture
+def small_parts(monkeypatch):
+    """Shrink the thresholds so multi-part behaviour can be tested with tiny payloads."""
+    monkeypatch.setattr(notion_uploader, "SINGLE_PART_MAX_BYTES", 100)
+    monkeypatch.setattr(notion_uploader, "MULTI_PART_CHUNK_BYTES", 40)
+
+
+PAYLOAD = bytes(range(256))
+
+
+class TestSinglePart:
+
+    def test_small_file_uses_single_part(self, fake_api):
+        assert upload_file_to_notion(b"%PDF-small", "a.pdf", "application/pdf") == "upload-1"
+
+        assert fake_api.endpoints() == ["file_uploads", "send"]
+        assert "mode" not in fake_api.calls[0][1]
+        assert fake_api.parts == {0: b"%PDF-small"}
+
+
+class TestMultiPart:
+
+    def test_large_bytes_are_split_into_parts(self, fake_api, small_parts):
+        upload_file_to_notion(PAYLOAD, "big.pdf", "application/pdf")
+
+        create_body = fake_api.calls[0][1]
+        assert create_body["mode"] == "multi_part"
+        assert create_body["number_of_parts"] == 7  # ceil(256 / 40)
+        assert fake_api.endpoints()[-1] == "complete"
+        assert sorted(fake_api.parts) == list(range(1, 8))
+        assert fake_api.received() == PAYLOAD
+
+    def test_memoryview_input(self, fake_api, small_parts):
+        upload_file_to_notion(memoryview(bytearray(PAYLOAD)), "big.pdf", "application/pdf")
+        assert fake_api.received() == PAYLOAD
+
+    def test_file_path_input(self, fake_api, small_parts, tmp_path):
+        path = tmp_path / "big.pdf"
+        path.write_bytes(PAYLOAD)
+
+        upload_file_to_notion(str(path), "big.pdf", "application/pdf")
+        assert fake_api.received() == PAYLOAD
+
+    def test_file_object_input(self, fake_api, small_parts):
+        upload_file_to_notion(io.BytesIO(PAYLOAD), "big.pdf", "application/pdf")
+        assert fake_api.received() == PAYLOAD
+
+    def test_failed_part_raises(self, fake_api, small_parts, monkeypatch):
+        def failing(method, url, **kwargs):
+            resp = fake_api(method, url, **kwargs)
+            if (kwargs.get("data") or {}).get("part_number") == "3":
+                resp.status_code = 400
+            return resp
+
+        monkeypatch.setattr(notion_uploader, "notion_request", failing)
+        with pytest.raises(Exception, match="Part 3 send failed"):
+            upload_file_to_notion(PAYLOAD, "big.pdf", "application/pdf")
+        assert "complete" not in fake_api.endpoints()
+
+
+class TestUploadSource:
+
+    def test_memoryview_ranges_do_not_copy_source(self):
+        data = bytearray(PAYLOAD)
+        source = UploadSource(data)
+        part = source.open_range(10, 5)
+        assert part.getbuffer().obj is data
+        assert part.read() == PAYLOAD[10:15]
+
+
+# ============================================================
+# Upload de-duplication cache
+# ============================================================
+
+class TestUploadCache:
+
+    def test_identical_bytes_are_uploaded_once(self, fake_api):
+        first = upload_file_to_notion(b"%PDF-same", "a.pdf", "application/pdf")
+        second = upload_file_to_notion(bytearray(b"%PDF-same"), "b.pdf", "application/pdf")
+
+        assert first == second
+        assert fake_api.endpoints() == ["file_uploads", "send"]
+
+    def test_different_bytes_are_uploaded(self, fake_api):
+        upload_file_to_notion(b"%PDF-1", "a.pdf", "application/pdf")
+        upload_file_to_notion(b"%PDF-2", "a.pdf", "application/pdf")
+        assert fake_api.endpoints().count("file_uploads") == 2
+
+    def test_reuse_can_be_disabled(self, fake_api):
+        upload_file_to_notion(b"%PDF-same", "a.pdf", "application/pdf")
+        upload_file_to_notion(b"%PDF-same", "a.pdf", "application/pdf", reuse=False)
+        assert fake_api.endpoints().count("file_uploads") == 2
+
+    def test_file_path_hash_matches_bytes(self, fake_api, tmp_path):
+        path = tmp_path / "a.pdf"
+        path.write_bytes(PAYLOAD)
+
+        upload_file_to_notion(PAYLOAD, "a.pdf", "application/pdf")
+        upload_file_to_notion(str(path), "a.pdf", "application/pdf")
+        assert fake_api.endpoints().count("file_uploads") == 1
+
+    def test_entries_expire_with_the_attachment_window(self, tmp_path):
+        now = [1000.0]
+        cache = UploadCache(str(tmp_path / "uploads.sqlite3"), clock=lambda: now[0])
+        cache.put("digest", "application/pdf", "file-1")
+
+        now[0] += FILE_UPLOAD_REUSE_SECONDS - 1
+        assert cache.get("digest", "application/pdf") == "file-1"
+        assert cache.get("digest", "image/png") is None
+
+        now[0] += 2
+        assert cache.get("digest", "application/pdf") is None
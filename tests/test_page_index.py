@@ -0,0 +1,215 @@
+"""
+Tests for the date -> page_id index (api/utils/page_index.py) and
+upsert_daily_report, using the in-memory Notion stand-in.
+"""
+from unittest.mock import patch
+
+import httpx
+import pytest
+from notion_client.errors import APIErrorCode, APIResponseError
+
+import parse_daily_report
+from parse_daily_report import upsert_daily_report
+from utils.page_index import PageIndex
+
+
+SUMMARY = {
+    "date": "2025-01-15",
+    "shaho_count": 0, "shaho_amount": 0,
+    "kokuho_count": 0, "kokuho_amount": 0,
+    "kouki_count": 0, "kouki_amount": 0,
+    "jihi_count": 0, "jihi_amount": 0,
+    "hoken_nashi_count": 0, "hoken_nashi_amount": 0,
+    "total_count": 0, "total_points": 0, "total_amount": 0,
+    "bushan_amount": 0, "kaigo_amount": 0, "zenkai_sagaku": 0,
+}
+
+
+def report_page(page_id, date):
+    return {"id": page_id, "properties": {"日付": {"date": {"start": date}}}}
+
+
+class FakeQuery:
+    """Data source query returning ``pages`` two results at a time."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.bodies = []
+
+    def __call__(self, body):
+        self.bodies.append(body)
+        start = int(body.get("start_cursor") or 0)
+        has_more = start + 2 < len(self.pages)
+        return {
+            "results": self.pages[start:start + 2],
+            "has_more": has_more,
+            "next_cursor": str(start + 2) if has_more else None,
+        }
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    return str(tmp_path / "page_index.sqlite3")
+
+
+# ============================================================
+# PageIndex
+# ============================================================
+
+class TestPageIndex:
+
+    def test_seeds_from_filtered_query_once(self, index_path):
+        query = FakeQuery([
+            report_page("p1", "2025-01-14"),
+            report_page("p2", "2025-01-15T09:00:00.000+09:00"),
+            report_page("p3", "2025-01-16"),
+        ])
+        index = PageIndex(query, index_path)
+
+        assert index.lookup("2025-01-15") == "p2"
+        assert index.lookup("2025-01-16") == "p3"
+        assert index.lookup("2025-01-17") is None
+
+        # 3 件を 2 件ずつ取得 → 2 リクエスト、以降の lookup ではクエリしない
+        assert len(query.bodies) == 2
+        assert query.bodies[0]["filter"] == {"property": "日付", "date": {"is_not_empty": True}}
+        assert query.bodies[1]["start_cursor"] == "2"
+
+    def test_newest_page_wins_for_duplicate_dates(self, index_path):
+        query = FakeQuery([report_page("old", "2025-01-15"), report_page("new", "2025-01-15")])
+        assert PageIndex(query, index_path).lookup("2025-01-15") == "new"
+
+    def test_index_is_kept_on_disk(self, index_path):
+        query = FakeQuery([report_page("p1", "2025-01-14")])
+        index = PageIndex(query, index_path)
+        index.lookup("2025-01-14")
+        index.remember("2025-01-15", "p2")
+
+        reopened = PageIndex(query, index_path)
+        assert reopened.lookup("2025-01-14") == "p1"
+        assert reopened.lookup("2025-01-15") == "p2"
+        assert len(query.bodies) == 1
+
+    def test_refreshes_after_interval(self, index_path):
+        now = [1000.0]
+        query = FakeQuery([report_page("p1", "2025-01-14")])
+        index = PageIndex(query, index_path, refresh_seconds=60, clock=lambda: now[0])
+        assert index.lookup("2025-01-15") is None
+
+        query.pages.append(report_page("p2", "2025-01-15"))
+        now[0] += 30
+        assert index.lookup("2025-01-15") is None
+
+        now[0] += 31
+        assert index.lookup("2025-01-15") == "p2"
+
+    def test_forget(self, index_path):
+        index = PageIndex(FakeQuery([report_page("p1", "2025-01-14")]), index_path)
+        assert index.lookup("2025-01-14") == "p1"
+        index.forget("2025-01-14")
+        assert index.lookup("2025-01-14") is None
+        assert PageIndex(FakeQuery([]), index_path).lookup("2025-01-14") is None
+
+
+# ============================================================
+# upsert_daily_report
+# ============================================================
+
+@pytest.fixture
+def notion(fake_notion, monkeypatch):
+    monkeypatch.setattr(parse_daily_report, "notion", fake_notion)
+    with patch("parse_daily_report.upload_file_to_notion", return_value="file-1"):
+        yield fake_notion
+
+
+def endpoint_calls(notion, name):
+    return [kwargs for endpoint, kwargs in notion.calls if endpoint == name]
+
+
+def fail_updates_of(notion, monkeypatch, page_id, error):
+    """Make pages.update raise ``error`` for ``page_id`` (a page deleted / archived in Notion)."""
+    update = notion.pages.update
+
+    def update_or_fail(**kwargs):
+        if kwargs["page_id"] == page_id:
+            raise error
+        return update(**kwargs)
+
+    monkeypatch.setattr(notion.pages, "update", update_or_fail)
+
+
+def not_found():
+    return APIResponseError(httpx.Response(404), "Could not find page with ID", APIErrorCode.ObjectNotFound)
+
+
+def archived():
+    return APIResponseError(
+        httpx.Response(400), "Can't edit block that is archived. You must unarchive the block before editing.",
+        APIErrorCode.ValidationError,
+    )
+
+
+class TestUpsertDailyReport:
+
+    def test_same_date_updates_existing_page(self, notion):
+        first_id, first_updated = upsert_daily_report(b"%PDF-1", SUMMARY, [], 0)
+        second_id, second_updated = upsert_daily_report(b"%PDF-2", SUMMARY, [], 0)
+
+        assert (first_updated, second_updated) == (False, True)
+        assert second_id == first_id
+        assert len(endpoint_calls(notion, "pages.create")) == 1
+        assert endpoint_calls(notion, "pages.update")[0]["page_id"] == first_id
+        # 索引の作成以外にアップロードごとの Notion クエリは発生しない
+        assert len(endpoint_calls(notion, "request")) == 1
+
+    def test_other_date_creates_page(self, notion):
+        upsert_daily_report(b"%PDF-1", SUMMARY, [], 0)
+        page_id, updated = upsert_daily_report(b"%PDF-2", {**SUMMARY, "date": "2025-01-16"}, [], 0)
+
+        assert not updated
+        assert len(endpoint_calls(notion, "pages.create")) == 2
+
+    def test_existing_page_in_notion_is_found(self, notion):
+        existing = notion.pages.create(properties={"日付": {"date": {"start": "2025-01-15"}}})
+
+        page_id, updated = upsert_daily_report(b"%PDF-1", SUMMARY, [], 0)
+        assert updated
+        assert page_id == existing["id"]
+
+    def test_client_page_id_takes_precedence(self, notion):
+        upsert_daily_report(b"%PDF-1", SUMMARY, [], 0)
+
+        page_id, updated = upsert_daily_report(b"%PDF-2", SUMMARY, [], 0, existing_page_id="page-from-client")
+        assert updated
+        assert page_id == "page-from-client"
+        assert endpoint_calls(notion, "pages.update")[-1]["page_id"] == "page-from-client"
+
+    @pytest.mark.parametrize("error", [not_found, archived])
+    def test_deleted_or_archived_page_is_replaced(self, notion, monkeypatch, error):
+        stale_id, _ = upsert_daily_report(b"%PDF-1", SUMMARY, [], 0)
+        fail_updates_of(notion, monkeypatch, stale_id, error())
+
+        page_id, updated = upsert_daily_report(b"%PDF-2", SUMMARY, [], 0)
+        assert not updated
+        assert page_id != stale_id
+        assert len(endpoint_calls(notion, "pages.create")) == 2
+
+        # 索引は新しいページを指す
+        next_id, next_updated = upsert_daily_report(b"%PDF-3", SUMMARY, [], 0)
+        assert (next_id, next_updated) == (page_id, True)
+
+    def test_stale_client_page_id_falls_back_to_new_page(self, notion, monkeypatch):
+        fail_updates_of(notion, monkeypatch, "page-from-client", not_found())
+
+        page_id, updated = upsert_daily_report(b"%PDF-1", SUMMARY, [], 0, existing_page_id="page-from-client")
+        assert not updated
+        assert page_id in notion.pages_by_id
+
+    def test_other_update_errors_are_not_swallowed(self, notion, monkeypatch):
+        stale_id, _ = upsert_daily_report(b"%PDF-1", SUMMARY, [], 0)
+        fail_updates_of(notion, monkeypatch, stale_id, APIResponseError(
+            httpx.Response(400), "body failed validation", APIErrorCode.ValidationError))
+
+        with pytest.raises(Exception, match="Page property update failed"):
+            upsert_daily_report(b"%PDF-2", SUMMARY, [], 0)
+        assert len(endpoint_calls(notion, "pages.create")) == 1
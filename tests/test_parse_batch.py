@@ -0,0 +1,189 @@
+"""
+Tests for the bulk upload endpoint (api/parse_batch.py).
+"""
+import io
+import json
+import threading
+import zipfile
+
+import pytest
+
+import parse_batch
+import parse_daily_report
+from utils.app_core import find_endpoint
+from utils.deadline import Deadline
+from utils.idempotency import get_idempotency_store
+
+from .conftest import CONTENT_TYPE, multipart_body, pdf_part
+
+
+def report_pdf(date):
+    return f"%PDF-1.4 {date}".encode()
+
+
+def zip_of(entries):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in entries.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    """PDF の中身の日付で解析結果を返し、保存した日付を記録する"""
+    saved = []
+    lock = threading.Lock()
+
+    def fake_parse_pdf(pdf_file):
+        date = pdf_file.read().decode().split()[-1]
+        if date == "broken":
+            raise ValueError("Not a daily report")
+        return {"summary": {"date": date, "zenkai_sagaku": 0}, "patients": [{"name": "山田太郎", "sagaku": -100}]}
+
+    def fake_upsert(pdf_bytes, summary, patients, today_difference, existing_page_id):
+        with lock:
+            saved.append(summary["date"])
+            return f"page-{summary['date']}", False
+
+    monkeypatch.setattr(parse_daily_report, "parse_pdf", fake_parse_pdf)
+    monkeypatch.setattr(parse_daily_report, "upsert_daily_report", fake_upsert)
+    return saved
+
+
+@pytest.fixture
+def post(call_handler):
+    def post(files, headers=None):
+        status, response_headers, payload = call_handler(
+            parse_batch.handler, "POST", path="/api/parse_batch",
+            headers={"Content-Type": CONTENT_TYPE, **(headers or {})},
+            body=multipart_body(files=[("file", *f) for f in files]),
+        )
+        return status, response_headers, payload
+
+    return post
+
+
+def test_route():
+    assert find_endpoint("/api/parse_batch") is parse_batch.ENDPOINT
+
+
+def test_multiple_file_parts(post, saved):
+    dates = ["2025-01-14", "2025-01-15", "2025-01-16"]
+    status, _, payload = post([(f"{d}.pdf", "application/pdf", report_pdf(d)) for d in dates])
+    result = json.loads(payload)
+
+    assert status == 200
+    assert result["success"] is True and result["failed"] == 0
+    assert result["pages"] == {d: f"page-{d}" for d in dates}
+    assert sorted(f["filename"] for f in result["files"]) == [f"{d}.pdf" for d in dates]
+    assert result["files"][0]["data"]["today_difference"] == -100
+    assert sorted(saved) == dates
+
+
+def test_zip_upload(post, saved):
+    archive = zip_of({
+        "week/2025-01-14.pdf": report_pdf("2025-01-14"),
+        "week/2025-01-15.PDF": report_pdf("2025-01-15"),
+        "week/readme.txt": b"ignored",
+        "__MACOSX/week/._2025-01-14.pdf": b"ignored",
+    })
+    status, _, payload = post([("week.zip", "application/zip", archive)])
+    result = json.loads(payload)
+    assert status == 200
+    assert result["pages"] == {"2025-01-14": "page-2025-01-14", "2025-01-15": "page-2025-01-15"}
+
+
+def test_stream_reports_each_file(post, saved):
+    status, headers, payload = post(
+        [("a.pdf", "application/pdf", report_pdf("2025-01-14")), ("b.pdf", "application/pdf", report_pdf("broken"))],
+        headers={"Accept": "application/x-ndjson"},
+    )
+    records = [json.loads(line) for line in payload.decode().splitlines()]
+    assert status == 200
+    assert headers["content-type"] == "application/x-ndjson"
+    assert [r["type"] for r in records] == ["file", "file", "result"]
+    by_name = {r["filename"]: r for r in records[:2]}
+    assert by_name["a.pdf"]["notion_page_id"] == "page-2025-01-14"
+    assert by_name["b.pdf"] == {"type": "file", "filename": "b.pdf", "success": False, "error": "Not a daily report"}
+    assert records[-1]["success"] is False and records[-1]["failed"] == 1
+    assert records[-1]["pages"] == {"2025-01-14": "page-2025-01-14"}
+
+
+def test_duplicate_files_are_saved_once(post, saved):
+    pdf = report_pdf("2025-01-14")
+    _, _, payload = post([("a.pdf", "application/pdf", pdf), ("copy.pdf", "application/pdf", pdf)])
+    result = json.loads(payload)
+    assert saved == ["2025-01-14"]
+    assert sorted(f["replayed"] for f in result["files"]) == [False, True]
+
+
+def test_earlier_single_upload_is_not_saved_again(post, saved, call_handler, monkeypatch):
+    monkeypatch.setattr(parse_daily_report, "upsert_daily_report", lambda *args: ("page-single", False))
+    pdf = report_pdf("2025-01-14")
+    call_handler(parse_daily_report.handler, "POST", path="/api/parse_daily_report",
+                 headers={"Content-Type": CONTENT_TYPE}, body=multipart_body(files=[pdf_part(pdf, filename="a.pdf")]))
+
+    _, _, payload = post([("a.pdf", "application/pdf", pdf)])
+    [file_result] = json.loads(payload)["files"]
+    assert file_result["notion_page_id"] == "page-single"
+    assert file_result["replayed"] is True
+    assert saved == []
+
+
+def test_failure_after_saving_still_reports_the_file(post, saved, monkeypatch):
+    """An error while recording the result (e.g. SQLite locked) must not leave the stream waiting forever."""
+    store = get_idempotency_store()
+    finish = store.finish
+
+    def finish_or_fail(key, flight, result=None, error=None):
+        finish(key, flight, result, error)
+        if result is not None:
+            raise OSError("database is locked")
+
+    monkeypatch.setattr(store, "finish", finish_or_fail)
+    _, _, payload = post([("a.pdf", "application/pdf", report_pdf("2025-01-14"))])
+    result = json.loads(payload)
+    assert result["failed"] == 1
+    assert result["files"] == [{"filename": "a.pdf", "success": False, "error": "database is locked"}]
+
+
+def test_result_wait_is_bounded_by_the_deadline(post, saved, monkeypatch):
+    release = threading.Event()
+
+    def stuck_upsert(*args):
+        release.wait(5)
+        return "page-late", False
+
+    monkeypatch.setattr(parse_daily_report, "upsert_daily_report", stuck_upsert)
+    monkeypatch.setattr(parse_daily_report, "NOTION_MIN_CALL_SECONDS", 0)
+    monkeypatch.setattr(parse_batch, "NOTION_MIN_CALL_SECONDS", 0)
+    monkeypatch.setattr(parse_batch, "request_deadline", lambda: Deadline(0.2, reserve=0))
+    try:
+        _, _, payload = post([("a.pdf", "application/pdf", report_pdf("2025-01-14"))],
+                             headers={"Accept": "application/x-ndjson"})
+    finally:
+        release.set()
+    records = [json.loads(line) for line in payload.decode().splitlines()]
+    assert records[0]["filename"] == "a.pdf" and records[0]["success"] is False
+    assert "time budget" in records[0]["error"]
+    assert records[-1]["failed"] == 1
+
+
+@pytest.mark.parametrize("files, status", [
+    ([], 400),
+    ([("week.zip", "application/zip", b"not a zip")], 400),
+    ([(f"{i}.pdf", "application/pdf", report_pdf(f"2025-01-{i:02d}")) for i in range(1, 34)], 413),
+])
+def test_rejected_uploads(post, saved, files, status):
+    response_status, _, payload = post(files)
+    assert response_status == status
+    assert json.loads(payload)["success"] is False
+    assert saved == []
+
+
+def test_zip_size_limit():
+    archive = zip_of({"a.pdf": b"0" * 1000, "b.pdf": b"0" * 1000})
+    with pytest.raises(parse_batch.BatchError) as error:
+        parse_batch.extract_zip(memoryview(archive), max_bytes=1500)
+    assert error.value.status == 413
@@ -0,0 +1,116 @@
+"""
+Tests for the patient data attachment (api/utils/patient_file.py) and the
+csv/json storage modes of save_to_notion.
+"""
+from unittest.mock import patch
+
+import pytest
+
+import parse_daily_report
+from parse_daily_report import save_to_notion
+from utils.append_planner import count_blocks
+from utils.patient_file import (
+    columns_to_patients, dump_patients, find_patients_file, load_patients, load_patients_from_page,
+    patients_to_columns,
+)
+
+
+SUMMARY = {
+    "date": "2025-01-15",
+    "shaho_count": 0, "shaho_amount": 0,
+    "kokuho_count": 0, "kokuho_amount": 0,
+    "kouki_count": 0, "kouki_amount": 0,
+    "jihi_count": 0, "jihi_amount": 0,
+    "hoken_nashi_count": 0, "hoken_nashi_amount": 0,
+    "total_count": 0, "total_points": 0, "total_amount": 0,
+    "bushan_amount": 0, "kaigo_amount": 0, "zenkai_sagaku": 0,
+}
+
+PATIENTS = [
+    {
+        "number": 1, "patient_id": "No.1", "name": "山田, 太郎", "insurance_type": "社本",
+        "points": 500, "burden_amount": 1500, "kaigo_units": 0, "kaigo_burden": 0,
+        "jihi": 0, "bushan": 0, "zenkai_sagaku": -100, "receipt_amount": 1400,
+        "sagaku": -100, "remarks": "再初診\n訪問",
+    },
+    {
+        "number": 2, "patient_id": "No.2", "name": "鈴木花子", "insurance_type": "国本",
+        "points": 300, "burden_amount": 900, "kaigo_units": 120, "kaigo_burden": 1200,
+        "jihi": 500, "bushan": 0, "zenkai_sagaku": 0, "receipt_amount": 2600,
+        "sagaku": 0, "remarks": "",
+    },
+]
+
+
+class TestDumpAndLoad:
+
+    @pytest.mark.parametrize("fmt", ["csv", "json"])
+    def test_round_trip(self, fmt):
+        assert load_patients(dump_patients(PATIENTS, fmt), fmt) == PATIENTS
+
+    def test_columnar_round_trip(self):
+        columns = patients_to_columns(PATIENTS)
+        assert columns["number"] == [1, 2]
+        assert columns["name"] == ["山田, 太郎", "鈴木花子"]
+        assert columns_to_patients(columns) == PATIENTS
+
+    def test_csv_has_bom_and_header(self):
+        data = dump_patients(PATIENTS, "csv")
+        assert data.startswith(b"\xef\xbb\xbfnumber,patient_id,name")
+
+    def test_unknown_format(self):
+        with pytest.raises(ValueError):
+            dump_patients(PATIENTS, "xml")
+
+
+class TestLoadFromPage:
+
+    def test_reads_attached_file(self, fake_notion):
+        fake_notion.children["page-1"] = [
+            {"id": "b1", "type": "heading_1", "heading_1": {}},
+            {"id": "b2", "type": "file", "file": {
+                "type": "file", "name": "日計表_2025-01-15.pdf",
+                "file": {"url": "https://files.example/pdf"},
+            }},
+            {"id": "b3", "type": "file", "file": {
+                "type": "file", "name": "患者データ_2025-01-15.json",
+                "file": {"url": "https://files.example/json"},
+            }},
+        ]
+        downloads = {"https://files.example/json": dump_patients(PATIENTS, "json")}
+
+        assert load_patients_from_page(fake_notion, "page-1", fetch=downloads.__getitem__) == PATIENTS
+
+    def test_missing_file(self, fake_notion):
+        fake_notion.children["page-1"] = []
+        with pytest.raises(ValueError):
+            load_patients_from_page(fake_notion, "page-1", fetch=lambda url: b"")
+
+    def test_find_ignores_other_files(self):
+        assert find_patients_file([{"type": "file", "file": {"type": "file", "name": "memo.csv"}}]) is None
+
+
+class TestAttachmentStorage:
+
+    def test_save_attaches_patients_instead_of_tables(self, fake_notion, monkeypatch):
+        monkeypatch.setattr(parse_daily_report, "notion", fake_notion)
+        monkeypatch.setattr(parse_daily_report, "PATIENT_STORAGE", "csv")
+        uploads = {}
+
+        def upload(data, filename, content_type):
+            uploads[filename] = (bytes(data), content_type)
+            return f"file-{len(uploads)}"
+
+        with patch("parse_daily_report.upload_file_to_notion", side_effect=upload):
+            page_id = save_to_notion(b"%PDF", SUMMARY, PATIENTS * 50, 0)
+
+        csv_bytes, content_type = uploads["患者データ_2025-01-15.csv"]
+        assert content_type == "text/csv"
+        assert load_patients(csv_bytes, "csv") == PATIENTS * 50
+
+        blocks = fake_notion.children[page_id]
+        assert not [b for b in blocks if b["type"] == "table" and b["table"]["table_width"] != 3]
+        attached = [b["file"] for b in blocks if b["type"] == "file"]
+        assert [f["file_upload"]["id"] for f in attached] == ["file-2", "file-1"]
+        assert attached[0]["name"] == "患者データ_2025-01-15.csv"
+        assert sum(map(count_blocks, blocks)) == 3 + 7 + 1 + 1 + 2
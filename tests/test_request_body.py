@@ -0,0 +1,244 @@
+"""
+Tests for zero-copy request body handling (api/utils/request_body.py), the
+streaming multipart reader and the memory profile of /api/parse_daily_report.
+"""
+import functools
+import io
+import json
+import mmap
+import os
+import tracemalloc
+
+import pytest
+import requests
+
+import parse_daily_report
+from utils import notion_uploader
+from utils.buffer_reader import BufferReader
+from utils import request_body
+from utils.request_body import SpooledBody, UploadTooLarge, read_body, read_multipart
+
+
+BOUNDARY = "----TestBoundary7MA4YWxkTrZu0gW"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+SUMMARY = {
+    "date": "2025-01-15",
+    "shaho_count": 0, "shaho_amount": 0,
+    "kokuho_count": 0, "kokuho_amount": 0,
+    "kouki_count": 0, "kouki_amount": 0,
+    "jihi_count": 0, "jihi_amount": 0,
+    "hoken_nashi_count": 0, "hoken_nashi_amount": 0,
+    "total_count": 0, "total_points": 0, "total_amount": 0,
+    "bushan_amount": 0, "kaigo_amount": 0, "zenkai_sagaku": 0,
+}
+
+
+def build_multipart(fields=None, files=None, boundary=BOUNDARY):
+    """Build a multipart/form-data body the way a browser would."""
+    out = bytearray()
+    for name, value in (fields or {}).items():
+        out += f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n".encode()
+        out += value.encode("utf-8") + b"\r\n"
+    for name, (filename, data) in (files or {}).items():
+        out += (
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"; "
+            f"filename=\"{filename}\"\r\nContent-Type: application/pdf\r\n\r\n"
+        ).encode("utf-8")
+        out += data + b"\r\n"
+    out += f"--{boundary}--\r\n".encode()
+    return bytes(out)
+
+
+class ChunkedReader(io.RawIOBase):
+    """rfile stand-in that returns at most `chunk` bytes per readinto call."""
+
+    def __init__(self, data, chunk):
+        self._inner = io.BytesIO(data)
+        self._chunk = chunk
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self._inner.read(min(len(b), self._chunk))
+        b[:len(data)] = data
+        return len(data)
+
+
+# ============================================================
+# read_body / read_multipart
+# ============================================================
+
+class TestReadBody:
+
+    def test_reads_across_short_reads(self):
+        data = os.urandom(10_000)
+        assert read_body(ChunkedReader(data, 999), len(data)) == data
+
+    def test_truncated_body(self):
+        assert read_body(io.BytesIO(b"abc"), 10) == b"abc"
+
+
+class TestReadMultipart:
+
+    PDF = b"%PDF-1.4\r\n--not-a-boundary\r\n" + bytes(range(256)) * 8
+
+    def read(self, body, chunk=7, **kwargs):
+        return read_multipart(ChunkedReader(body, chunk), CONTENT_TYPE, len(body), **kwargs)
+
+    def test_fields_and_file_across_small_reads(self):
+        body = build_multipart(
+            fields={"existing_page_id": "page-1", "mode": "job"},
+            files={"file": ("日計表.pdf", self.PDF)},
+        )
+        fields, files = self.read(body)
+
+        assert fields == {"existing_page_id": "page-1", "mode": "job"}
+        uploaded = files["file"]
+        assert (uploaded.filename, uploaded.content_type) == ("日計表.pdf", "application/pdf")
+        assert bytes(uploaded.data) == self.PDF
+
+    def test_small_part_stays_in_memory(self):
+        body = build_multipart(files={"file": ("a.pdf", self.PDF)})
+        _, files = self.read(body, spool_threshold=len(self.PDF))
+
+        assert isinstance(files["file"].data, memoryview)
+        assert isinstance(files["file"].data.obj, bytearray)
+        assert bytes(files["file"].data) == self.PDF
+
+    def test_quoted_boundary(self):
+        body = build_multipart(fields={"a": "1"})
+        fields, _ = read_multipart(io.BytesIO(body), f'multipart/form-data; boundary="{BOUNDARY}"', len(body))
+        assert fields == {"a": "1"}
+
+    def test_large_part_is_spooled_to_disk(self):
+        body = build_multipart(files={"file": ("a.pdf", self.PDF)})
+        _, files = self.read(body, chunk=1000, spool_threshold=100)
+
+        assert isinstance(files["file"].data, memoryview)
+        assert isinstance(files["file"].data.obj, mmap.mmap)
+        assert bytes(files["file"].data) == self.PDF
+
+    def test_spooled_body_is_not_spooled_again(self, tmp_path, monkeypatch):
+        body = build_multipart(fields={"mode": "job"}, files={"file": ("a.pdf", self.PDF)})
+        path = tmp_path / "body"
+        path.write_bytes(body)
+        monkeypatch.setattr(request_body.tempfile, "TemporaryFile", None)  # no second temporary file
+
+        with open(path, "rb") as f:
+            fields, files = read_multipart(SpooledBody(f), CONTENT_TYPE, len(body), spool_threshold=100)
+
+        assert fields == {"mode": "job"}
+        assert isinstance(files["file"].data.obj, mmap.mmap)
+        assert bytes(files["file"].data) == self.PDF
+
+    def test_multiple_files_with_the_same_name(self):
+        body = (build_multipart(files={"file": ("a.pdf", b"%PDF a")})[:-len(f"--{BOUNDARY}--\r\n")]
+                + build_multipart(files={"file": ("b.pdf", b"%PDF b")}))
+        assert self.read(body)[1]["file"].filename == "b.pdf"
+
+        _, files = self.read(body, multiple=True)
+        assert [(f.filename, bytes(f.data)) for f in files["file"]] == [("a.pdf", b"%PDF a"), ("b.pdf", b"%PDF b")]
+
+    def test_too_large_is_rejected_before_reading(self):
+        body = build_multipart(files={"file": ("a.pdf", self.PDF)})
+        rfile = io.BytesIO(body)
+        with pytest.raises(UploadTooLarge):
+            read_multipart(rfile, CONTENT_TYPE, len(body), max_bytes=100)
+        assert rfile.tell() == 0
+
+    def test_reads_exactly_the_body(self):
+        body = build_multipart(fields={"a": "1"})
+        rfile = io.BytesIO(body + b"GET / HTTP/1.1")
+        read_multipart(rfile, CONTENT_TYPE, len(body))
+        assert rfile.read() == b"GET / HTTP/1.1"
+
+    @pytest.mark.parametrize("content_type, body", [
+        ("multipart/form-data", b""),
+        (CONTENT_TYPE, b"garbage"),
+        (CONTENT_TYPE, f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"a\"\r\n\r\nno end".encode()),
+    ])
+    def test_malformed(self, content_type, body):
+        with pytest.raises(ValueError):
+            read_multipart(io.BytesIO(body), content_type, len(body))
+
+
+class TestBufferReader:
+
+    def test_seek_and_read(self):
+        reader = BufferReader(bytearray(b"0123456789"))
+        reader.seek(-3, io.SEEK_END)
+        assert reader.read() == b"789"
+        reader.seek(2)
+        buf = bytearray(3)
+        assert reader.readinto(buf) == 3 and buf == b"234"
+
+
+# ============================================================
+# Memory profile of the parse endpoint
+# ============================================================
+
+class TestParseEndpointMemory:
+
+    PDF_SIZE = 4 * 1024 * 1024
+
+    def test_peak_memory_is_about_one_copy_of_the_pdf(self, call_handler, fake_notion, monkeypatch):
+        """Body -> parser -> pdfplumber -> uploader should hold the PDF only once."""
+        pdf = b"%PDF-1.4\n" + os.urandom(self.PDF_SIZE)
+        body = build_multipart(files={"file": ("report.pdf", pdf)})
+        seen = {}
+
+        def fake_parse_pdf(pdf_file):
+            # pdfminer reads the stream in small pieces; do the same here
+            pdf_file.seek(0)
+            while pdf_file.read(64 * 1024):
+                pass
+            seen["parsed"] = True
+            return {"summary": {**SUMMARY}, "patients": []}
+
+        def fake_notion_request(method, url, files=None, **kwargs):
+            if files:
+                f = files["file"][1]
+                size = 0
+                while chunk := f.read(64 * 1024):
+                    size += len(chunk)
+                seen["uploaded"] = size
+            resp = requests.Response()
+            resp.status_code = 200
+            resp._content = b'{"id": "file-1"}'
+            return resp
+
+        monkeypatch.setattr(parse_daily_report, "parse_pdf", fake_parse_pdf)
+        monkeypatch.setattr(parse_daily_report, "notion", fake_notion)
+        monkeypatch.setattr(notion_uploader, "notion_request", fake_notion_request)
+
+        tracemalloc.start()
+        try:
+            status, _, payload = call_handler(
+                parse_daily_report.handler, "POST",
+                path="/api/parse_daily_report",
+                headers={"Content-Type": CONTENT_TYPE},
+                body=body,
+            )
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        assert status == 200, payload
+        assert json.loads(payload)["notion_page_id"].startswith("page-")
+        assert seen == {"parsed": True, "uploaded": len(pdf)}
+        assert peak < 1.5 * len(pdf), f"peak {peak} bytes for a {len(pdf)} byte PDF"
+
+
+    def test_too_large_upload_is_413(self, call_handler, monkeypatch):
+        monkeypatch.setattr(parse_daily_report, "read_multipart", functools.partial(read_multipart, max_bytes=1000))
+        body = build_multipart(files={"file": ("report.pdf", os.urandom(2000))})
+
+        status, headers, payload = call_handler(
+            parse_daily_report.handler, "POST",
+            headers={"Content-Type": CONTENT_TYPE},
+            body=body,
+        )
+        assert status == 413
+        assert headers["connection"] == "close"
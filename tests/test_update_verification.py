@@ -0,0 +1,226 @@
+"""
+Tests for /api/update_verification: the multipart/form-data variant, the
+legacy base64 JSON body, server-side rendering of the verification sheet and
+the concurrent Notion calls of save_verification.
+"""
+import io
+import json
+import time
+import base64
+import tracemalloc
+from unittest.mock import patch
+
+import pytest
+
+import update_verification
+from update_verification import read_verification_request, save_verification
+from utils.deadline import Deadline, current_deadline
+from utils.notion_rate_limit import call_with_limits
+
+from .conftest import CONTENT_TYPE, multipart_body, pdf_part
+
+
+PDF = b"%PDF-1.4 verification screen" + bytes(range(256)) * 4
+SCREEN = pdf_part(PDF, name="frontend_pdf", filename="v.pdf")
+
+
+FIELDS = {
+    "notion_page_id": "page-1",
+    "is_matched": "true",
+    "cash_input": "12000",
+    "date": "2025-01-15",
+    "expense_director": "3000",
+}
+MULTIPART_HEADERS = {"Content-Type": CONTENT_TYPE}
+
+
+@pytest.fixture
+def notion(fake_notion, monkeypatch):
+    monkeypatch.setattr(update_verification, "notion", fake_notion)
+    with patch("update_verification.upload_file_to_notion", return_value="file-1") as upload:
+        fake_notion.upload = upload
+        yield fake_notion
+
+
+def updated_properties(notion):
+    properties = {}
+    for endpoint, kwargs in notion.calls:
+        if endpoint == "pages.update":
+            properties.update(kwargs["properties"])
+    return properties
+
+
+class TestMultipart:
+
+    def test_updates_page(self, notion, call_handler):
+        status, headers, body = call_handler(
+            update_verification.handler, "POST", headers=MULTIPART_HEADERS, body=multipart_body(FIELDS, [SCREEN])
+        )
+
+        assert status == 200, body
+        assert "upload;dur=" in headers["server-timing"]
+        data, filename, content_type = notion.upload.call_args.args
+        assert bytes(data) == PDF
+        assert filename == "照合画面_2025-01-15.pdf"
+
+        properties = updated_properties(notion)
+        assert properties["照合状態"] == {"select": {"name": "一致"}}
+        assert properties["入力金額"] == {"number": 12000}
+        assert properties["院長へ"] == {"number": 3000}
+        assert properties["照合画面PDF"]["files"][0]["file_upload"] == {"id": "file-1"}
+
+    def test_out_of_time_is_504(self, notion, call_handler, monkeypatch):
+        """The request deadline reaches the Notion calls running on the pool threads."""
+        seen = []
+        update = notion.pages.update
+
+        def limited_update(**kwargs):
+            seen.append(current_deadline())
+            return call_with_limits(lambda: update(**kwargs), lambda result: None, "PATCH pages/:id")
+
+        deadline = Deadline(0.5, reserve=0)
+        monkeypatch.setattr(notion.pages, "update", limited_update)
+        monkeypatch.setattr(update_verification, "request_deadline", lambda: deadline)
+
+        status, _, body = call_handler(
+            update_verification.handler, "POST", headers=MULTIPART_HEADERS, body=multipart_body(FIELDS, [SCREEN])
+        )
+        assert status == 504
+        assert json.loads(body)["success"] is False
+        assert seen and all(d is deadline for d in seen)
+
+    def test_missing_pdf_is_bad_request(self, notion, call_handler):
+        status, _, body = call_handler(
+            update_verification.handler, "POST", headers=MULTIPART_HEADERS, body=multipart_body(FIELDS)
+        )
+        assert status == 400
+        assert json.loads(body)["error"] == "No frontend_pdf uploaded"
+
+    def test_non_integer_amount_is_bad_request(self, notion, call_handler):
+        body = multipart_body({**FIELDS, "cash_input": "abc"}, [SCREEN])
+        status, _, _ = call_handler(update_verification.handler, "POST", headers=MULTIPART_HEADERS, body=body)
+        assert status == 400
+
+    def test_pdf_is_not_copied(self):
+        pdf = bytes(4 * 1024 * 1024)
+        body = multipart_body(FIELDS, [pdf_part(pdf, name="frontend_pdf", filename="v.pdf")])
+        headers = {**MULTIPART_HEADERS, "Content-Length": str(len(body))}
+
+        tracemalloc.start()
+        request = read_verification_request(headers, io.BytesIO(body))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        assert isinstance(request["frontend_pdf"], memoryview)
+        assert peak < 1.5 * len(pdf)
+
+
+class TestJsonCompatibility:
+
+    def test_json_body_still_accepted(self, notion, call_handler):
+        body = json.dumps({
+            "notion_page_id": "page-1",
+            "is_matched": False,
+            "cash_input": 12000,
+            "frontend_pdf_base64": base64.b64encode(PDF).decode(),
+            "date": "2025-01-15",
+        }).encode()
+        status, _, _ = call_handler(
+            update_verification.handler, "POST", headers={"Content-Type": "application/json"}, body=body
+        )
+
+        assert status == 200
+        assert bytes(notion.upload.call_args.args[0]) == PDF
+        properties = updated_properties(notion)
+        assert properties["照合状態"] == {"select": {"name": "不一致"}}
+        assert properties["院長へ"] == {"number": 0}
+
+    @pytest.mark.parametrize("missing", ["notion_page_id", "is_matched", "cash_input"])
+    def test_missing_required_key_is_bad_request(self, notion, call_handler, missing):
+        data = {"notion_page_id": "page-1", "is_matched": True, "cash_input": 12000,
+                "frontend_pdf_base64": base64.b64encode(PDF).decode()}
+        del data[missing]
+        status, _, body = call_handler(
+            update_verification.handler, "POST", headers={"Content-Type": "application/json"},
+            body=json.dumps(data).encode(),
+        )
+
+        assert status == 400
+        assert json.loads(body)["error"] == f"{missing} is required"
+        notion.upload.assert_not_called()
+
+
+# ============================================================
+# save_verification
+# ============================================================
+
+REQUEST = {
+    "notion_page_id": "page-1",
+    "is_matched": True,
+    "cash_input": 12000,
+    "date": "2025-01-15",
+    "expense_director": 0,
+    "frontend_pdf": PDF,
+}
+
+
+class TestSaveVerification:
+
+    def test_property_update_runs_while_uploading(self, notion):
+        delay = 0.2
+
+        def slow(func):
+            def call(*args, **kwargs):
+                time.sleep(delay)
+                return func(*args, **kwargs)
+            return call
+
+        notion.pages.update = slow(notion.pages.update)
+        notion.blocks.children.append = slow(notion.blocks.children.append)
+        notion.upload.side_effect = slow(lambda *args: "file-1")
+
+        timings = save_verification(REQUEST)
+
+        # 直列なら upload + update + append = 3 × delay
+        # 並行: max(upload, update) + max(file_property, blocks) = 2 × delay
+        assert {"upload", "properties", "file_property", "blocks", "total"} <= set(timings)
+        assert timings["total"] < 2.7 * delay
+
+    def test_too_large_pdf_adds_note_instead(self, notion):
+        save_verification(REQUEST, max_upload_bytes=10)
+
+        notion.upload.assert_not_called()
+        assert "照合画面PDF" not in updated_properties(notion)
+        appended = [kwargs for endpoint, kwargs in notion.calls if endpoint == "blocks.children.append"]
+        assert appended[0]["children"][0]["type"] == "callout"
+
+
+class TestServerRendering:
+
+    def test_renders_pdf_from_values(self, notion, call_handler):
+        summary = {"date": "2025-01-15", "total_count": 3, "total_amount": 4500}
+        sheet = {"sections": [{"title": "窓口現金出納", "rows": [["本日の残高", "12000"]]}]}
+        body = multipart_body(
+            {**FIELDS, "summary": json.dumps(summary), "sheet": json.dumps(sheet)}
+        )
+        status, headers, _ = call_handler(update_verification.handler, "POST", headers=MULTIPART_HEADERS, body=body)
+
+        assert status == 200
+        assert "render;dur=" in headers["server-timing"]
+        data, filename, content_type = notion.upload.call_args.args
+        assert data.startswith(b"%PDF-1.4")
+        assert len(data) < 10 * 1024
+        assert (filename, content_type) == ("照合画面_2025-01-15.pdf", "application/pdf")
+
+    def test_invalid_sheet_is_bad_request(self, notion, call_handler):
+        body = multipart_body({**FIELDS, "sheet": "{"})
+        status, _, _ = call_handler(update_verification.handler, "POST", headers=MULTIPART_HEADERS, body=body)
+        assert status == 400
+
+    def test_uploaded_pdf_takes_precedence(self, notion, call_handler):
+        body = multipart_body({**FIELDS, "summary": "{\"date\": \"2025-01-15\"}"}, [SCREEN])
+        status, headers, _ = call_handler(update_verification.handler, "POST", headers=MULTIPART_HEADERS, body=body)
+
+        assert status == 200
+        assert bytes(notion.upload.call_args.args[0]) == PDF
+        assert "render" not in headers["server-timing"]
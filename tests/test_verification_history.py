@@ -0,0 +1,144 @@
+"""
+Tests for the bounded verification history (api/utils/verification_history.py)
+and the pruning done by /api/update_verification.
+"""
+from unittest.mock import patch
+
+import pytest
+
+import update_verification
+from update_verification import build_skipped_note_block, build_verification_blocks, save_verification
+from utils.verification_history import VerificationHistory, find_verification_attempts
+
+
+REQUEST = {
+    "notion_page_id": "page-1",
+    "is_matched": True,
+    "cash_input": 12000,
+    "date": "2025-01-15",
+    "expense_director": 0,
+    "frontend_pdf": b"%PDF-1.4",
+}
+
+
+def with_ids(blocks, prefix):
+    return [{**block, "id": f"{prefix}-{i}"} for i, block in enumerate(blocks)]
+
+
+class TestVerificationHistory:
+
+    def test_trim_returns_oldest_beyond_limit(self, tmp_path):
+        history = VerificationHistory(path=str(tmp_path / "h.sqlite3"), limit=2)
+        history.seed("page-1", [[f"h{i}", f"f{i}"] for i in range(4)])
+
+        assert history.trim("page-1") == [["h0", "f0"], ["h1", "f1"]]
+        assert history.attempts("page-1") == [["h2", "f2"], ["h3", "f3"]]
+        assert history.trim("page-1") == []
+
+    def test_pages_are_independent(self, tmp_path):
+        history = VerificationHistory(path=str(tmp_path / "h.sqlite3"), limit=1)
+        history.seed("page-1", [["a"]])
+        history.seed("page-2", [["b"]])
+        assert history.trim("page-1") == []
+
+    def test_unlimited(self, tmp_path):
+        history = VerificationHistory(path=str(tmp_path / "h.sqlite3"), limit=0)
+        history.seed("page-1", [[str(i)] for i in range(5)])
+        assert history.trim("page-1") == []
+
+    def test_seed_and_forget(self, tmp_path):
+        history = VerificationHistory(path=str(tmp_path / "h.sqlite3"))
+        history.seed("page-1", [["a"], ["b", "c"]])
+        assert history.attempts("page-1") == [["a"], ["b", "c"]]
+        history.seed("page-1", [["b", "c"]])
+        assert history.attempts("page-1") == [["b", "c"]]
+
+        history.forget("page-1")
+        assert history.attempts("page-1") == []
+
+
+class TestFindVerificationAttempts:
+
+    def test_finds_heading_file_pairs_and_notes(self):
+        blocks = (
+            with_ids([{"type": "heading_1", "heading_1": {"rich_text": [{"plain_text": "📊 集計データ"}]}}], "s")
+            + with_ids(build_verification_blocks("file-1", "一致"), "v1")
+            + with_ids([build_skipped_note_block(False)], "n")
+            + with_ids(build_verification_blocks("file-2", "不一致"), "v2")
+        )
+        assert find_verification_attempts(blocks) == [["v1-0", "v1-1"], ["n-0"], ["v2-0", "v2-1"]]
+
+    def test_file_after_other_block_is_ignored(self):
+        blocks = with_ids([
+            {"type": "paragraph", "paragraph": {"rich_text": []}},
+            {"type": "file", "file": {}},
+        ], "x")
+        assert find_verification_attempts(blocks) == []
+
+
+class TestPruning:
+
+    @pytest.fixture
+    def notion(self, fake_notion, monkeypatch, tmp_path):
+        monkeypatch.setattr(update_verification, "notion", fake_notion)
+        monkeypatch.setattr(
+            "utils.verification_history.get_verification_history.instance",
+            VerificationHistory(path=str(tmp_path / "history.sqlite3"), limit=2),
+        )
+        with patch("update_verification.upload_file_to_notion", return_value="file-1"):
+            yield fake_notion
+
+    def verification_blocks(self, notion):
+        return find_verification_attempts(notion.children["page-1"])
+
+    def test_keeps_latest_attempts(self, notion):
+        notion.children["page-1"] = with_ids(
+            [{"type": "heading_1", "heading_1": {"rich_text": [{"text": {"content": "📊 集計データ"}}]}}], "summary"
+        )
+        for _ in range(4):
+            save_verification(REQUEST)
+
+        blocks = notion.children["page-1"]
+        assert blocks[0]["id"] == "summary-0"
+        assert len(self.verification_blocks(notion)) == 2
+        assert len(blocks) == 1 + 2 * 2
+
+    def test_attempts_from_other_instances_are_pruned(self, notion):
+        # 別の環境（他のインスタンス・コールドスタート前）で追加された照合結果が 3 件ある
+        notion.children["page-1"] = (
+            with_ids(build_verification_blocks("old-1", "一致"), "old1")
+            + with_ids(build_verification_blocks("old-2", "一致"), "old2")
+            + with_ids([build_skipped_note_block(True)], "old3")
+        )
+        save_verification(REQUEST)
+        ids = [block["id"] for block in notion.children["page-1"]]
+        assert not [block_id for block_id in ids if block_id.startswith(("old1", "old2"))]
+        assert len(self.verification_blocks(notion)) == 2
+
+        # この索引が知らないうちに、別のインスタンスがさらに照合結果を追加した
+        notion.children["page-1"] += with_ids(build_verification_blocks("other", "一致"), "other")
+        save_verification(REQUEST)
+
+        lists = [kwargs for endpoint, kwargs in notion.calls if endpoint == "blocks.children.list"]
+        assert len(lists) == 2
+        # 最初の照合結果が削除され、別のインスタンスの照合結果と今回の照合結果が残る
+        attempts = self.verification_blocks(notion)
+        assert len(attempts) == 2
+        assert attempts[0] == ["other-0", "other-1"]
+
+    def test_block_missing_from_the_listing_counts_as_latest(self, notion, monkeypatch):
+        notion.children["page-1"] = with_ids(build_verification_blocks("old-1", "一致"), "old1")
+        # 追加したばかりのブロックがまだ一覧に出てこない
+        monkeypatch.setattr(update_verification, "list_child_blocks", lambda page_id: notion.children["page-1"][:2])
+        history = update_verification.get_verification_history()
+        save_verification(REQUEST)
+        assert history.attempts("page-1")[0] == ["old1-0", "old1-1"]
+        assert len(history.attempts("page-1")) == 2
+
+    def test_already_deleted_block_is_ignored(self, notion):
+        notion.children["page-1"] = []
+        save_verification(REQUEST)
+        notion.children["page-1"] = []  # 日計表の再アップロードなどでブロックが消えた
+        save_verification(REQUEST)
+        save_verification(REQUEST)
+        assert len(self.verification_blocks(notion)) == 2
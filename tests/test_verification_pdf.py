@@ -0,0 +1,93 @@
+"""
+Tests for the server-side verification sheet renderer
+(api/utils/pdf_canvas.py, api/utils/verification_pdf.py).
+"""
+import re
+import zlib
+
+from utils.pdf_canvas import PdfCanvas
+from utils.verification_pdf import format_yen, render_verification_pdf
+
+
+SUMMARY = {
+    "date": "2025-01-15",
+    "shaho_count": 3, "shaho_amount": 4500,
+    "total_count": 3, "total_amount": 4500,
+    "zenkai_sagaku": -100,
+}
+
+SHEET = {
+    "sections": [
+        {
+            "title": "窓口現金出納",
+            "column": 1,
+            "header": [],
+            "rows": [["前日の繰越", "30000"], ["本日の残高", "34500"]],
+            "totals": [1],
+        },
+    ]
+}
+
+
+def page_text(pdf):
+    """全ページの描画命令を展開し、Tj のテキストを文字列にする"""
+    texts = []
+    for match in re.finditer(rb"/Length (\d+) /Filter /FlateDecode >>\nstream\n", pdf):
+        start = match.end()
+        stream = zlib.decompress(pdf[start:start + int(match.group(1))]).decode("ascii")
+        texts += [bytes.fromhex(h).decode("utf-16-be") for h in re.findall(r"<([0-9a-f]+)> Tj", stream)]
+    return texts
+
+
+class TestPdfCanvas:
+
+    def test_xref_offsets_point_to_objects(self):
+        canvas = PdfCanvas()
+        canvas.text(10, 10, "日計表", 10)
+        pdf = canvas.to_bytes()
+
+        assert pdf.startswith(b"%PDF-1.4")
+        assert pdf.endswith(b"%%EOF\n")
+        xref = int(re.search(rb"startxref\n(\d+)", pdf).group(1))
+        assert pdf[xref:].startswith(b"xref")
+        offsets = re.findall(rb"(\d{10}) 00000 n ", pdf)
+        for number, offset in enumerate(offsets, start=1):
+            assert pdf[int(offset):].startswith(f"{number} 0 obj".encode())
+
+    def test_pages(self):
+        canvas = PdfCanvas()
+        canvas.new_page()
+        assert b"/Count 2" in canvas.to_bytes()
+
+    def test_text_width(self):
+        assert PdfCanvas.text_width("ab日本", 10) == 30
+
+
+class TestRenderVerificationPdf:
+
+    def test_contains_values(self):
+        pdf = render_verification_pdf(True, 34500, 3000, date="2025-01-15", summary=SUMMARY, sheet=SHEET)
+        texts = page_text(pdf)
+
+        assert "照合: 一致" in texts
+        assert "日付: 2025-01-15" in texts
+        assert {"窓口現金出納", "前日の繰越", "30000", "34,500円", "3,000円", "日計表PDFの集計", "-100円"} <= set(texts)
+
+    def test_mismatch_label(self):
+        assert "照合: 不一致" in page_text(render_verification_pdf(False, 0))
+
+    def test_small_and_deterministic(self):
+        first = render_verification_pdf(True, 34500, 3000, summary=SUMMARY, sheet=SHEET, verified_at="2025-01-15 18:00")
+        second = render_verification_pdf(True, 34500, 3000, summary=SUMMARY, sheet=SHEET, verified_at="2025-01-15 18:00")
+        assert first == second
+        assert len(first) < 10 * 1024
+
+    def test_overflow_adds_page(self):
+        long_section = {"title": "出金", "column": 0, "header": [], "rows": [["x", "1"]] * 30, "totals": []}
+        pdf = render_verification_pdf(True, 0, sheet={"sections": [long_section] * 3})
+        assert b"/Count 2" in pdf
+
+    def test_format_yen(self):
+        assert format_yen(1234567) == "1,234,567円"
+        assert format_yen(-100) == "-100円"
+        assert format_yen(None) == ""
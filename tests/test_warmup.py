@@ -0,0 +1,118 @@
+"""
+Tests for the warm-up routine (api/utils/warmup.py) and GET /api/warmup.
+"""
+import io
+import json
+import threading
+
+import pdfplumber
+import pytest
+from pdfminer.cmapdb import CMapDB
+
+import parse_daily_report
+from utils import warmup
+from utils.app_core import find_endpoint
+
+
+@pytest.fixture(autouse=True)
+def cold_process(monkeypatch):
+    monkeypatch.setattr(warmup, "_done", {})
+    monkeypatch.setattr(warmup, "_running", set())
+
+
+def test_steps_run_once_per_process():
+    calls = []
+    steps = [("a", lambda: calls.append("a")), ("b", lambda: calls.append("b"))]
+
+    first = warmup.warm_up(steps)
+    assert first["warm"] is False
+    assert set(first["timings"]) == {"a", "b"}
+
+    assert warmup.warm_up(steps) == {"warm": True, "timings": {}, "errors": {}}
+    assert calls == ["a", "b"]
+
+
+def test_failed_step_is_retried():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("offline")
+
+    assert warmup.warm_up([("notion", flaky)])["errors"] == {"notion": "offline"}
+    assert "notion" in warmup.warm_up([("notion", flaky)])["timings"]
+
+
+def test_slow_step_does_not_hold_the_lock():
+    started, release = threading.Event(), threading.Event()
+
+    def seed_notion():
+        started.set()
+        release.wait(5)
+
+    slow = threading.Thread(target=warmup.warm_up, args=([("notion", seed_notion)],))
+    slow.start()
+    try:
+        assert started.wait(5)
+        # 別のリクエストは実行中のステップを飛ばし、待たされない
+        result = warmup.warm_up([("notion", seed_notion), ("modules", lambda: None)])
+        assert result["warm"] is False
+        assert set(result["timings"]) == {"modules"}
+    finally:
+        release.set()
+        slow.join(5)
+    assert warmup.warm_up([("notion", seed_notion)])["warm"] is True
+
+
+def test_warm_pdfminer_loads_japanese_cmaps(monkeypatch):
+    monkeypatch.setattr(CMapDB, "_cmap_cache", {})
+    monkeypatch.setattr(CMapDB, "_umap_cache", {})
+    warmup.warm_pdfminer(cmaps=("UniJIS-UCS2-H", "90ms-RKSJ-H"))
+    assert {"UniJIS-UCS2-H", "90ms-RKSJ-H"} <= set(CMapDB._cmap_cache)
+    assert "Adobe-Japan1" in CMapDB._umap_cache
+
+
+def test_sample_pdf_has_a_japanese_table():
+    with pdfplumber.open(io.BytesIO(warmup.sample_pdf())) as pdf:
+        [table] = pdf.pages[0].extract_tables()
+    assert table[0] == ["番号", "患者名", "保険"]
+
+
+class TestWarmupEndpoint:
+
+    def test_served_by_the_parse_function(self):
+        assert find_endpoint("/api/warmup") is parse_daily_report.ENDPOINT
+
+    def test_get(self, call_handler, monkeypatch):
+        notion_calls = []
+        monkeypatch.setattr(parse_daily_report, "warm_notion", lambda: notion_calls.append(1))
+
+        status, _, payload = call_handler(parse_daily_report.handler, "GET", path="/api/warmup")
+        result = json.loads(payload)
+        assert status == 200
+        assert result["success"] is True and result["warm"] is False
+        assert set(result["timings"]) == {"pdfminer", "modules", "notion"}
+
+        _, _, payload = call_handler(parse_daily_report.handler, "GET", path="/api/warmup")
+        assert json.loads(payload)["warm"] is True
+        assert notion_calls == [1]
+
+    def test_notion_can_be_skipped(self, call_handler, monkeypatch):
+        def fail():
+            raise AssertionError("Notion must not be called")
+
+        monkeypatch.setattr(parse_daily_report, "warm_notion", fail)
+        _, _, payload = call_handler(parse_daily_report.handler, "GET", path="/api/warmup?notion=0")
+        assert set(json.loads(payload)["timings"]) == {"pdfminer", "modules"}
+
+    def test_errors_are_reported(self, call_handler, monkeypatch):
+        def fail():
+            raise RuntimeError("unauthorized")
+
+        monkeypatch.setattr(parse_daily_report, "warm_notion", fail)
+        status, _, payload = call_handler(parse_daily_report.handler, "GET", path="/api/warmup")
+        result = json.loads(payload)
+        assert status == 200
+        assert result["success"] is False
+        assert result["errors"] == {"notion": "unauthorized"}